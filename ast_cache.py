@@ -0,0 +1,105 @@
+import hashlib
+import os
+import pickle
+from typing import List, Optional
+
+import expressions
+import statements
+from environment import GlobalEnvironment
+
+# Bump when the meaning of a cached tree changes in a way the schema
+# fingerprint below cannot see, e.g. a change to how the resolver numbers slots.
+FORMAT_VERSION = 2
+
+MAGIC = b"LOXAST"
+
+# Directory created next to a source file, like __pycache__.
+CACHE_DIR_NAME = "__loxcache__"
+
+
+def _schema_fingerprint() -> bytes:
+    '''
+    Hashes the field layout of every AST node, so regenerating the AST
+    invalidates old entries without a manual version bump.
+    '''
+    layout = []
+    for module in (expressions, statements):
+        for name in sorted(vars(module)):
+            node = getattr(module, name)
+            if isinstance(node, type) and "__slots__" in vars(node):
+                layout.append(f"{module.__name__}.{name}{node.__slots__}")
+    return hashlib.sha256("\n".join(layout).encode()).digest()
+
+
+_SCHEMA = _schema_fingerprint()
+
+
+def cache_path(source_path: str, cache_dir: str = None, optimized: bool = False) -> str:
+    '''
+    Where the cache entry for `source_path` lives: `__loxcache__/<name>.ast`
+    next to the source, or a path-keyed file in `cache_dir`. Trees built with
+    `-O` get a `.O.ast` entry of their own.
+    '''
+    name = os.path.basename(source_path)
+    if optimized:
+        name += ".O"
+    if cache_dir is None:
+        directory = os.path.join(os.path.dirname(source_path), CACHE_DIR_NAME)
+        return os.path.join(directory, f"{name}.ast")
+    path_hash = hashlib.sha256(
+        os.path.abspath(source_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}-{path_hash}.ast")
+
+
+def _header(source: str, optimized: bool) -> bytes:
+    digest = hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+    flags = b"O" if optimized else b"-"
+    return MAGIC + FORMAT_VERSION.to_bytes(2, "little") + flags + _SCHEMA + digest
+
+
+def load(path: str, source: str, globals: GlobalEnvironment, optimized: bool = False) -> Optional[List[statements.Stmt]]:
+    '''
+    Returns the resolved statements cached for `source`, or None if there is no
+    usable entry. The global names the tree refers to are interned into
+    `globals`; if they would not land in the same slots the entry is treated
+    as stale.
+    '''
+    header = _header(source, optimized)
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(header)) != header:
+                return None
+            global_names, stmts = pickle.load(f)
+    except Exception:
+        # Missing, truncated or corrupt; the caller rebuilds the entry.
+        return None
+
+    for slot, name in enumerate(global_names):
+        if globals.intern(name) != slot:
+            return None
+    return stmts
+
+
+def save(path: str, source: str, stmts: List[statements.Stmt], globals: GlobalEnvironment,
+         optimized: bool = False) -> None:
+    '''
+    Writes resolved `stmts` for `source`. Failures are ignored: the cache is
+    only an optimization.
+    '''
+    # Slot order of the global table the tree was resolved against.
+    global_names = sorted(globals.slots, key=globals.slots.get)
+    try:
+        payload = pickle.dumps((global_names, stmts), pickle.HIGHEST_PROTOCOL)
+    except (RecursionError, pickle.PicklingError):
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(_header(source, optimized))
+            f.write(payload)
+        os.replace(temp_path, path)
+    except OSError:
+        return
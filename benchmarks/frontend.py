@@ -0,0 +1,205 @@
+'''
+Times the front end, `Scanner.scan_tokens`, `Parser.parse` and
+`Resolver.resolve_stmts`, on generated Lox sources of a given shape and size,
+and reports tokens/s, nodes/s and the peak memory each phase allocates:
+
+    python benchmarks/frontend.py --shape functions --size 2000
+    python benchmarks/frontend.py --shape nesting --depth 40 --json
+
+The shapes are many small functions, deeply nested blocks, and long
+expression chains.
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import List, Dict, Any, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import expressions  # noqa: E402
+import statements  # noqa: E402
+from scanner import Scanner, RegexScanner  # noqa: E402
+from lox_parser import Parser  # noqa: E402
+from resolver import Resolver  # noqa: E402
+from environment import GlobalEnvironment  # noqa: E402
+
+
+def functions_source(size: int, depth: int, width: int) -> str:
+    '''
+    `size` functions with parameters, locals, a loop and a call of the
+    previous function.
+    '''
+    lines = ["fun f0(a, b) { return a + b; }"]
+    for i in range(1, size):
+        lines.append(
+            f"fun f{i}(a, b) {{\n"
+            f"  var total = 0;\n"
+            f"  for (var i = 0; i < a; i = i + 1) {{\n"
+            f"    if (i > b) total = total + f{i - 1}(i, b); else total = total - 1;\n"
+            f"  }}\n"
+            f"  return total * {i};\n"
+            f"}}")
+    return "\n".join(lines) + "\n"
+
+
+def nesting_source(size: int, depth: int, width: int) -> str:
+    '''
+    `size` statements that each nest blocks and `if`s `depth` deep, reading
+    variables declared at every level above.
+    '''
+    parts = []
+    for i in range(size):
+        opening = []
+        for level in range(depth):
+            opening.append(f"{{ var v{level} = {level}; if (v{level} < {i}) ")
+        parts.append("".join(opening) + f"print v0 + v{depth - 1};" + " }" * depth)
+    return "\n".join(parts) + "\n"
+
+
+def expressions_source(size: int, depth: int, width: int) -> str:
+    '''
+    `size` declarations whose initializers chain `width` operators.
+    '''
+    operators = ["+", "-", "*", "/", "<", "==", "and", "or"]
+    lines = ["var x = 1;"]
+    for i in range(size):
+        terms = ["x"]
+        for j in range(1, width):
+            terms.append(operators[(i + j) % len(operators)])
+            terms.append(f"(x - {j})" if j % 3 == 0 else str(j))
+        lines.append(f"var e{i} = {' '.join(terms)};")
+    return "\n".join(lines) + "\n"
+
+
+SHAPES: Dict[str, Callable[[int, int, int], str]] = {
+    "functions": functions_source,
+    "nesting": nesting_source,
+    "expressions": expressions_source,
+}
+
+
+def count_nodes(nodes: List[Any]) -> int:
+    '''
+    The number of AST nodes in `nodes` and their children.
+    '''
+    count = 0
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        count += 1
+        for field in node.__slots__:
+            value = getattr(node, field)
+            if isinstance(value, (expressions.Expr, statements.Stmt)):
+                stack.append(value)
+            elif type(value) is list:
+                stack.extend(item for item in value
+                             if isinstance(item, (expressions.Expr, statements.Stmt)))
+    return count
+
+
+def run_phases(source: str, scanner_class: type, measure: Callable) -> tuple:
+    '''
+    Scans, parses and resolves `source`, wrapping each phase in `measure`,
+    which calls the phase and returns its result and a measurement.
+    '''
+    tokens, scan = measure(lambda: scanner_class(source).scan_tokens())
+    stmts, parse = measure(lambda: Parser().parse(tokens))
+    _, resolve = measure(lambda: Resolver(GlobalEnvironment()).resolve_stmts(stmts))
+    return tokens, stmts, {"scan": scan, "parse": parse, "resolve": resolve}
+
+
+def timed(phase: Callable) -> tuple:
+    start = time.perf_counter()
+    result = phase()
+    return result, time.perf_counter() - start
+
+
+def traced(phase: Callable) -> tuple:
+    '''
+    Like `timed`, but measures the bytes the phase allocated at its peak.
+    '''
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = phase()
+    return result, tracemalloc.get_traced_memory()[1] - before
+
+
+def benchmark(source: str, scanner_class: type, repeat: int) -> Dict[str, Any]:
+    times = {"scan": [], "parse": [], "resolve": []}
+    for _ in range(repeat):
+        tokens, stmts, seconds = run_phases(source, scanner_class, timed)
+        for phase, value in seconds.items():
+            times[phase].append(value)
+
+    tracemalloc.start()
+    try:
+        _, _, peaks = run_phases(source, scanner_class, traced)
+    finally:
+        tracemalloc.stop()
+
+    nodes = count_nodes(stmts)
+    results = {"bytes": len(source), "tokens": len(tokens), "nodes": nodes}
+    for phase in times:
+        median = statistics.median(times[phase])
+        results[phase] = {"median_seconds": median, "peak_bytes": peaks[phase]}
+        # Tokens are what the scanner makes and the parser reads; nodes are
+        # what the parser makes and the resolver visits.
+        if phase != "resolve":
+            results[phase]["tokens_per_second"] = len(tokens) / median
+        if phase != "scan":
+            results[phase]["nodes_per_second"] = nodes / median
+    return results
+
+
+def report(shape: str, results: Dict[str, Any]) -> None:
+    print(f"{shape}: {results['bytes']} bytes, {results['tokens']} tokens, "
+          f"{results['nodes']} nodes")
+    print(f"{'phase':<9} {'median':>10} {'tokens/s':>12} {'nodes/s':>12} {'peak':>10}")
+    for phase in ("scan", "parse", "resolve"):
+        result = results[phase]
+        rates = [f"{result[rate]:,.0f}" if rate in result else "-"
+                 for rate in ("tokens_per_second", "nodes_per_second")]
+        print(f"{phase:<9} {result['median_seconds'] * 1000:>7.1f} ms {rates[0]:>12} "
+              f"{rates[1]:>12} {result['peak_bytes'] / 1024:>7.0f} KB")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark the Lox front end')
+    argparser.add_argument(
+        '--shape', choices=sorted(SHAPES) + ['all'], default='all',
+        help='The kind of program to generate')
+    # How many top-level units (functions, nested statements or declarations)
+    # the generated program has.
+    argparser.add_argument(
+        '--size', type=int, default=1000, help='Units in the program (default 1000)')
+    argparser.add_argument(
+        '--depth', type=int, default=20, help='Nesting depth for --shape nesting (default 20)')
+    argparser.add_argument(
+        '--width', type=int, default=50,
+        help='Operators per expression for --shape expressions (default 50)')
+    argparser.add_argument(
+        '--scanner', choices=['loop', 'regex'], default='loop', help='The scanner implementation')
+    argparser.add_argument(
+        '--repeat', type=int, default=5, metavar='N', help='Timed runs per phase (default 5)')
+    argparser.add_argument(
+        '--json', action='store_true', help='Print the results as JSON')
+
+    args = argparser.parse_args()
+    scanner_class = Scanner if args.scanner == "loop" else RegexScanner
+    shapes = sorted(SHAPES) if args.shape == 'all' else [args.shape]
+    results = {}
+    for shape in shapes:
+        source = SHAPES[shape](args.size, args.depth, args.width)
+        results[shape] = benchmark(source, scanner_class, args.repeat)
+        if not args.json:
+            report(shape, results[shape])
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Runs the Lox programs in this directory through `Runner` and reports the
+median wall time of each. Results can be saved as JSON and compared against
+a saved baseline:
+
+    python benchmarks/harness.py --save baseline.json
+    # ...change the interpreter...
+    python benchmarks/harness.py --baseline baseline.json --threshold 0.05
+
+Exits with status 1 if any benchmark got slower than the threshold allows.
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Dict, List, Any
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from run import Runner  # noqa: E402
+
+
+def benchmark_names() -> List[str]:
+    return sorted(name[:-len(".lox")] for name in os.listdir(BENCHMARK_DIR)
+                  if name.endswith(".lox"))
+
+
+def time_run(path: str, engine: str) -> float:
+    '''
+    Runs the program at `path` once on a fresh `Runner`, discarding what it
+    prints, and returns the seconds it took.
+    '''
+    runner = Runner(engine=engine)
+    output = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            runner.run_file(path)
+    except SystemExit:
+        raise RuntimeError(f"{path} failed:\n{output.getvalue()}")
+    return time.perf_counter() - start
+
+
+def run_benchmarks(names: List[str], engine: str, warmup: int,
+                   repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name in names:
+        path = os.path.join(BENCHMARK_DIR, name + ".lox")
+        for _ in range(warmup):
+            time_run(path, engine)
+        runs = [time_run(path, engine) for _ in range(repeat)]
+        results[name] = {"median": statistics.median(runs), "runs": runs}
+        print(f"{name:<12} {results[name]['median'] * 1000:>10.1f} ms", file=sys.stderr)
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "warmup": warmup,
+        "repeat": repeat,
+        "benchmarks": results,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    '''
+    Prints how each median changed from `baseline` and returns the names of
+    the benchmarks that got slower by more than `threshold`, a fraction.
+    '''
+    regressions = []
+    print(f"{'benchmark':<12} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            print(f"{name:<12} {'-':>12} {result['median'] * 1000:>9.1f} ms {'new':>8}")
+            continue
+        change = result["median"] / before["median"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<12} {before['median'] * 1000:>9.1f} ms "
+              f"{result['median'] * 1000:>9.1f} ms {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Run the Lox benchmarks')
+    # Benchmarks to run, by file name without `.lox`; all of them by default.
+    argparser.add_argument(
+        'names', nargs='*', help='The benchmarks to run')
+    argparser.add_argument(
+        '--engine', choices=['interpreter', 'vm', 'closure'], default='interpreter',
+        help='The execution engine')
+    # Runs before the measured ones, so that imports and caches are warm.
+    argparser.add_argument(
+        '--warmup', type=int, default=1, metavar='K', help='Unmeasured runs (default 1)')
+    argparser.add_argument(
+        '--repeat', type=int, default=5, metavar='N', help='Measured runs (default 5)')
+    argparser.add_argument(
+        '--save', metavar='PATH', help='Write the results as JSON to PATH')
+    # Compare the medians against results saved with --save, failing when one
+    # is more than --threshold slower.
+    argparser.add_argument(
+        '--baseline', metavar='PATH', help='Results to compare against')
+    argparser.add_argument(
+        '--threshold', type=float, default=0.10,
+        help='Allowed slowdown as a fraction (default 0.10)')
+
+    args = argparser.parse_args()
+    names = args.names or benchmark_names()
+    unknown = set(names) - set(benchmark_names())
+    if unknown:
+        argparser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = run_benchmarks(names, args.engine, args.warmup, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("engine") != args.engine:
+            print(f"Warning: the baseline ran on the {baseline.get('engine')} engine.",
+                  file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Slower than the baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+from enum import IntEnum, auto
+from typing import List, Any
+
+
+class OpCode(IntEnum):
+    CONSTANT = auto()
+    NIL = auto()
+    TRUE = auto()
+    FALSE = auto()
+    POP = auto()
+    GET_LOCAL = auto()
+    SET_LOCAL = auto()
+    GET_GLOBAL = auto()
+    DEFINE_GLOBAL = auto()
+    SET_GLOBAL = auto()
+    GET_UPVALUE = auto()
+    SET_UPVALUE = auto()
+    GET_PROPERTY = auto()
+    SET_PROPERTY = auto()
+    EQUAL = auto()
+    NOT_EQUAL = auto()
+    GREATER = auto()
+    GREATER_EQUAL = auto()
+    LESS = auto()
+    LESS_EQUAL = auto()
+    ADD = auto()
+    SUBTRACT = auto()
+    MULTIPLY = auto()
+    DIVIDE = auto()
+    NOT = auto()
+    NEGATE = auto()
+    PRINT = auto()
+    JUMP = auto()
+    JUMP_IF_FALSE = auto()
+    JUMP_IF_TRUE = auto()
+    LOOP = auto()
+    CALL = auto()
+    # A call whose result is returned at once; reuses the caller's frame.
+    TAIL_CALL = auto()
+    # `obj.name(args)`: calls a method without creating a bound method.
+    INVOKE = auto()
+    CLOSURE = auto()
+    CLOSE_UPVALUE = auto()
+    RETURN = auto()
+    CLASS = auto()
+    METHOD = auto()
+
+
+# Number of inline operands that follow each opcode. CLOSURE is followed by
+# one constant index plus two operands (is_local, index) per upvalue. The
+# constant of GET_PROPERTY and INVOKE is the site's `InlineCache`, and that of
+# SET_PROPERTY its `StoreCache`.
+OPERAND_COUNTS = {
+    OpCode.CONSTANT: 1,
+    OpCode.GET_LOCAL: 1,
+    OpCode.SET_LOCAL: 1,
+    OpCode.GET_GLOBAL: 1,
+    OpCode.DEFINE_GLOBAL: 1,
+    OpCode.SET_GLOBAL: 1,
+    OpCode.GET_UPVALUE: 1,
+    OpCode.SET_UPVALUE: 1,
+    OpCode.GET_PROPERTY: 1,
+    OpCode.SET_PROPERTY: 1,
+    OpCode.JUMP: 1,
+    OpCode.JUMP_IF_FALSE: 1,
+    OpCode.JUMP_IF_TRUE: 1,
+    OpCode.LOOP: 1,
+    OpCode.CALL: 1,
+    OpCode.TAIL_CALL: 1,
+    OpCode.INVOKE: 2,
+    OpCode.CLOSURE: 1,
+    OpCode.CLASS: 1,
+    OpCode.METHOD: 1,
+}
+
+
+class Chunk:
+    '''
+    A flat list of opcodes and their inline operands, plus a constant pool and
+    the source line of every entry in `code`.
+    '''
+
+    def __init__(self) -> None:
+        self.code: List[int] = []
+        self.constants: List[Any] = []
+        self.lines: List[int] = []
+        self._constant_indexes = {}
+
+    def write(self, byte: int, line: int) -> None:
+        self.code.append(int(byte))
+        self.lines.append(line)
+
+    def add_constant(self, value: Any) -> int:
+        # Numbers, strings and names are deduplicated. The key includes the type
+        # so that `1` and `true` don't share a slot.
+        try:
+            key = (type(value), value)
+            index = self._constant_indexes.get(key)
+        except TypeError:
+            key, index = None, None
+        if index is not None:
+            return index
+        self.constants.append(value)
+        index = len(self.constants) - 1
+        if key is not None:
+            self._constant_indexes[key] = index
+        return index
+
+
+class FunctionProto:
+    '''
+    The compiled form of a Lox function: its code plus how many upvalues a
+    closure over it has to capture.
+    '''
+
+    def __init__(self, name: str, arity: int) -> None:
+        self.name = name
+        self.arity = arity
+        self.chunk = Chunk()
+        self.upvalue_count = 0
+        # The `purity.Memo` of a pure function when memoization is enabled.
+        self.memo = None
+
+    def __str__(self) -> str:
+        return f"<fn {self.name}, arity {self.arity}>"
+
+
+def disassemble(proto: FunctionProto) -> List[str]:
+    lines = [f"== {proto.name} =="]
+    chunk = proto.chunk
+    nested = []
+    ip = 0
+    while ip < len(chunk.code):
+        op = OpCode(chunk.code[ip])
+        operands = chunk.code[ip + 1:ip + 1 + OPERAND_COUNTS.get(op, 0)]
+        text = f"{ip:04d} {chunk.lines[ip]:4d} {op.name:<16}"
+        if op in (OpCode.CONSTANT, OpCode.GET_GLOBAL, OpCode.DEFINE_GLOBAL, OpCode.SET_GLOBAL,
+                  OpCode.GET_PROPERTY, OpCode.SET_PROPERTY, OpCode.CLASS, OpCode.METHOD):
+            text += f"{operands[0]:4d} '{chunk.constants[operands[0]]}'"
+        elif op == OpCode.INVOKE:
+            text += f"{operands[0]:4d} '{chunk.constants[operands[0]]}' ({operands[1]} args)"
+        elif operands:
+            text += " ".join(f"{operand:4d}" for operand in operands)
+        ip += 1 + len(operands)
+        if op == OpCode.CLOSURE:
+            function = chunk.constants[operands[0]]
+            nested.append(function)
+            text += f" {function}"
+            for _ in range(function.upvalue_count):
+                is_local, index = chunk.code[ip], chunk.code[ip + 1]
+                text += f" {'local' if is_local else 'upvalue'} {index}"
+                ip += 2
+        lines.append(text)
+    for function in nested:
+        lines.extend(disassemble(function))
+    return lines
@@ -0,0 +1,511 @@
+import expressions
+import statements
+from tokens import TokenType
+from typing import List, Any
+from runtime_error import RuntimeError
+from completion import Return, TailCall
+from purity import MISSING, memo_key
+from environment import Environment, UNDEFINED
+from resolver import Resolver
+from interpreter import Interpreter, ErrorFrame, Callable, LoxFunction, LoxInstance, LoxClass, BoundMethod, InlineCache, StoreCache
+
+
+class CompiledFunction(LoxFunction):
+    '''
+    A `LoxFunction` whose body has already been compiled to closures. Calls
+    bind parameters in a fresh `Environment` and finish on a `Return` or
+    trampoline on a `TailCall` completion, exactly like `LoxFunction.call`.
+    '''
+
+    def __init__(self, declaration: statements.Function, closure: Environment, body: List[Any],
+                 is_method: bool = False, is_initializer: bool = False) -> None:
+        super().__init__(declaration, closure, is_method, is_initializer)
+        self._body = body
+        self._scope_size = declaration.scope_size
+
+    def call(self, interpreter, args):
+        function = self
+        waiting = None
+        while True:
+            if function._memo is not None:
+                key = memo_key(args)
+                value = function._memo.lookup(key)
+                if value is not MISSING:
+                    break
+                if waiting is None:
+                    waiting = []
+                waiting.append((function._memo, key))
+            environment = Environment(function._closure, function._scope_size)
+            environment.values[:function._param_count] = args
+            for statement in function._body:
+                completion = statement(environment)
+                if completion is not None:
+                    break
+            else:
+                completion = None
+            if function._is_initializer:
+                return environment.values[0]
+            if completion is None:
+                value = None
+                break
+            if type(completion) is Return:
+                value = completion.value
+                break
+            function, args = completion.function, completion.args
+        if waiting is not None:
+            # Store the outermost call last, so it is evicted last.
+            for memo, key in reversed(waiting):
+                memo.store(key, value)
+        return value
+
+
+class ClosureCompiler(expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Walks a resolved AST once and turns every node into a Python closure that
+    takes the current `Environment`. Statement closures return their
+    completion like `Interpreter.execute`. Operators and variable depths are decided
+    at compile time, so running the program does no visitor dispatch.
+    '''
+
+    def __init__(self, interpreter: Interpreter) -> None:
+        self.interpreter = interpreter
+
+    def compile_stmts(self, stmts: List[statements.Stmt]) -> List[Any]:
+        return [self.compile_stmt(statement) for statement in stmts]
+
+    def compile_stmt(self, stmt: statements.Stmt):
+        return stmt.accept(self)
+
+    def compile_expr(self, expr: expressions.Expr):
+        return expr.accept(self)
+
+    # Statements
+    def visit_expression_stmt(self, node: statements.Expression):
+        expression = self.compile_expr(node.expression)
+
+        def expression_stmt(env):
+            expression(env)
+        return expression_stmt
+
+    def visit_print_stmt(self, node: statements.Print):
+        expression = self.compile_expr(node.expression)
+        stringify = self.interpreter.stringify
+
+        def print_stmt(env):
+            print(stringify(expression(env)))
+        return print_stmt
+
+    def visit_var_stmt(self, node: statements.Var):
+        if node.initializer is None:
+            return self.define(node, lambda env: None)
+        return self.define(node, self.compile_expr(node.initializer))
+
+    def visit_function_stmt(self, node: statements.Function):
+        body = self.compile_stmts(node.body)
+        return self.define(node, lambda env: CompiledFunction(node, env, body))
+
+    def visit_class_stmt(self, node: statements.Class):
+        name = node.name.lexeme
+        methods = [(method, self.compile_stmts(method.body))
+                   for method in node.methods]
+
+        def make_class(env):
+            return LoxClass(name, {
+                method.name.lexeme: CompiledFunction(
+                    method, env, body, is_method=True,
+                    is_initializer=method.name.lexeme == "init")
+                for method, body in methods})
+        return self.define(node, make_class)
+
+    def visit_return_stmt(self, node: statements.Return):
+        if node.value is None:
+            def return_nil_stmt(env):
+                return Return(None)
+            return return_nil_stmt
+
+        if type(node.value) is expressions.Call:
+            return self.compile_tail_call(node.value)
+
+        value = self.compile_expr(node.value)
+
+        def return_stmt(env):
+            return Return(value(env))
+        return return_stmt
+
+    def visit_block_stmt(self, node: statements.Block):
+        body = self.compile_stmts(node.statements)
+
+        scope_size = node.scope_size
+
+        def block_stmt(env):
+            environment = Environment(env, scope_size)
+            for statement in body:
+                completion = statement(environment)
+                if completion is not None:
+                    return completion
+        return block_stmt
+
+    def visit_if_stmt(self, node: statements.If):
+        condition = self.compile_expr(node.condition)
+        then_branch = self.compile_stmt(node.then_branch)
+        if node.else_branch is None:
+            def if_stmt(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+            return if_stmt
+
+        else_branch = self.compile_stmt(node.else_branch)
+
+        def if_else_stmt(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+        return if_else_stmt
+
+    def visit_while_stmt(self, node: statements.While):
+        condition = self.compile_expr(node.condition)
+        body = self.compile_stmt(node.body)
+
+        def while_stmt(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                completion = body(env)
+                if completion is not None:
+                    return completion
+        return while_stmt
+
+    # Expressions
+    def visit_literal_expr(self, node: expressions.Literal):
+        value = node.value
+        return lambda env: value
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        return self.compile_expr(node.expression)
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        name = node.name
+        distance = node.depth
+        slot = node.slot
+        if distance is None:
+            values = self.interpreter.globals.values
+            global_slot = node.global_slot
+
+            def get_global(env):
+                value = values[global_slot]
+                if value is UNDEFINED:
+                    raise RuntimeError(
+                        name, f"Undefined variable: {name.lexeme}.")
+                return value
+            return get_global
+        if distance == 0:
+            return lambda env: env.values[slot]
+        if distance == 1:
+            return lambda env: env.enclosing.values[slot]
+        if distance == 2:
+            return lambda env: env.enclosing.enclosing.values[slot]
+        return lambda env: env.get_at(distance, slot)
+
+    def visit_this_expr(self, node: expressions.This):
+        distance = node.depth
+        slot = node.slot
+        if distance == 0:
+            return lambda env: env.values[slot]
+        if distance == 1:
+            return lambda env: env.enclosing.values[slot]
+        return lambda env: env.get_at(distance, slot)
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        name = node.name
+        value = self.compile_expr(node.value)
+        distance = node.depth
+        slot = node.slot
+        if distance is None:
+            assign_global = self.interpreter.globals.assign_at
+            global_slot = node.global_slot
+
+            def assign_global_expr(env):
+                result = value(env)
+                assign_global(global_slot, name, result)
+                return result
+            return assign_global_expr
+
+        def assign_expr(env):
+            result = value(env)
+            env.ancestor(distance).values[slot] = result
+            return result
+        return assign_expr
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        left = self.compile_expr(node.left)
+        right = self.compile_expr(node.right)
+        if node.operator.type == TokenType.OR:
+            def or_expr(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+            return or_expr
+
+        def and_expr(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+        return and_expr
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        right = self.compile_expr(node.right)
+        if node.operator.type == TokenType.MINUS:
+            return lambda env: -right(env)
+
+        def not_expr(env):
+            value = right(env)
+            return value is None or value is False
+        return not_expr
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        left = self.compile_expr(node.left)
+        right = self.compile_expr(node.right)
+        operator = node.operator
+        check = self.interpreter._check_number_operands
+        node_type = operator.type
+
+        if node_type == TokenType.PLUS:
+            def add(env):
+                a = left(env)
+                b = right(env)
+                if (type(a) is float and type(b) is float) or (type(a) is str and type(b) is str):
+                    return a + b
+                raise RuntimeError(operator,
+                                   "Operands must be two numbers or two strings.")
+            return add
+        if node_type == TokenType.MINUS:
+            def subtract(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a - b
+            return subtract
+        if node_type == TokenType.STAR:
+            def multiply(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a * b
+            return multiply
+        if node_type == TokenType.SLASH:
+            def divide(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a / b
+            return divide
+        if node_type == TokenType.GREATER:
+            def greater(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a > b
+            return greater
+        if node_type == TokenType.GREATER_EQUAL:
+            def greater_equal(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a >= b
+            return greater_equal
+        if node_type == TokenType.LESS:
+            def less(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a < b
+            return less
+        if node_type == TokenType.LESS_EQUAL:
+            def less_equal(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    check(operator, a, b)
+                return a <= b
+            return less_equal
+        if node_type == TokenType.EQUAL_EQUAL:
+            return lambda env: left(env) == right(env)
+        if node_type == TokenType.BANG_EQUAL:
+            return lambda env: left(env) != right(env)
+        raise RuntimeError(operator, f"Unknown binary operator {operator.lexeme}")
+
+    def visit_call_expr(self, node: expressions.Call):
+        if type(node.callee) is expressions.Get:
+            return self.compile_invoke(node)
+        callee = self.compile_expr(node.callee)
+        arguments = [self.compile_expr(argument)
+                     for argument in node.arguments]
+        paren = node.paren
+        interpreter = self.interpreter
+
+        def call_expr(env):
+            function = callee(env)
+            if not isinstance(function, Callable):
+                raise RuntimeError(
+                    paren, "Can only call functions and classes.")
+            args = [argument(env) for argument in arguments]
+            if len(args) != function.arity():
+                raise RuntimeError(
+                    paren, f"Expected {function.arity()} arguments but got {len(args)}.")
+            return function.call(interpreter, args)
+        return call_expr
+
+    def visit_get_expr(self, node: expressions.Get):
+        obj = self.compile_expr(node.object)
+        name = node.name
+        key = name.lexeme
+        cache = InlineCache(key)
+        miss = cache.miss
+
+        def get_expr(env):
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(name, "Only instances have properties.")
+            if instance.shape is not cache.shape and not miss(instance):
+                return instance.get_field(name)
+            slot = cache.slot
+            if slot >= 0:
+                return instance.values[slot]
+            return BoundMethod(instance, cache.method)
+        return get_expr
+
+    def visit_set_expr(self, node: expressions.Set):
+        obj = self.compile_expr(node.object)
+        value = self.compile_expr(node.value)
+        name = node.name
+        cache = StoreCache(name.lexeme)
+
+        def set_expr(env):
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(
+                    name, f"Only instances have fields. Got {instance.__class__.__name__}.")
+            result = value(env)
+            if instance.shape is cache.shape and cache.next_shape is cache.shape:
+                instance.values[cache.slot] = result
+            else:
+                cache.store(instance, result)
+        return set_expr
+
+    # Helpers
+    def compile_invoke(self, node: expressions.Call):
+        '''
+        Compiles `obj.name(...)`. A method found in the site's inline cache is
+        called with `obj` as its receiver without creating a `BoundMethod`.
+        '''
+        obj = self.compile_expr(node.callee.object)
+        name = node.callee.name
+        cache = InlineCache(name.lexeme)
+        arguments = [self.compile_expr(argument)
+                     for argument in node.arguments]
+        paren = node.paren
+        interpreter = self.interpreter
+
+        def invoke_expr(env):
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(name, "Only instances have properties.")
+            if instance.shape is not cache.shape and not cache.miss(instance):
+                raise RuntimeError(name, f"Undefined property '{name.lexeme}'.")
+            slot = cache.slot
+            if slot >= 0:
+                # A field, which is called without a receiver.
+                function = instance.values[slot]
+                if not isinstance(function, Callable):
+                    raise RuntimeError(
+                        paren, "Can only call functions and classes.")
+                args = [argument(env) for argument in arguments]
+                if len(args) != function.arity():
+                    raise RuntimeError(
+                        paren, f"Expected {function.arity()} arguments but got {len(args)}.")
+                return function.call(interpreter, args)
+            method = cache.method
+            args = [argument(env) for argument in arguments]
+            if len(args) != method.arity():
+                raise RuntimeError(
+                    paren, f"Expected {method.arity()} arguments but got {len(args)}.")
+            return method.call(interpreter, [instance, *args])
+        return invoke_expr
+
+    def compile_tail_call(self, node: expressions.Call):
+        '''
+        Compiles `return f(...)`. Calls to compiled functions are left to the
+        trampoline in `CompiledFunction.call`; other callables are called here.
+        '''
+        callee = self.compile_expr(node.callee)
+        arguments = [self.compile_expr(argument)
+                     for argument in node.arguments]
+        paren = node.paren
+        interpreter = self.interpreter
+
+        def tail_call_stmt(env):
+            function = callee(env)
+            if not isinstance(function, Callable):
+                raise RuntimeError(
+                    paren, "Can only call functions and classes.")
+            args = [argument(env) for argument in arguments]
+            if len(args) != function.arity():
+                raise RuntimeError(
+                    paren, f"Expected {function.arity()} arguments but got {len(args)}.")
+            if type(function) is CompiledFunction:
+                return TailCall(function, args)
+            if type(function) is BoundMethod and type(function.method) is CompiledFunction:
+                return TailCall(function.method, [function.receiver, *args])
+            return Return(function.call(interpreter, args))
+        return tail_call_stmt
+
+    def define(self, node: statements.Stmt, value):
+        '''
+        Returns a statement closure that stores `value(env)` in the slot the
+        resolver assigned to the declaration `node`, local or global.
+        '''
+        slot = node.slot
+        if slot is None:
+            values = self.interpreter.globals.values
+            global_slot = node.global_slot
+
+            def define_global_stmt(env):
+                values[global_slot] = value(env)
+            return define_global_stmt
+
+        def define_local_stmt(env):
+            env.values[slot] = value(env)
+        return define_local_stmt
+
+
+class ClosureInterpreter(Interpreter):
+    '''
+    Runs programs by compiling them with `ClosureCompiler` after the
+    `Resolver` pass instead of visiting the AST on every evaluation.
+    '''
+
+    def interpret(self, statements: List[statements.Stmt], resolved: bool = False) -> None:
+        self.error_frames = []
+        try:
+            if not resolved:
+                resolver = Resolver(self.globals)
+                resolver.resolve_stmts(statements)
+            program = ClosureCompiler(self).compile_stmts(statements)
+            for statement in program:
+                statement(self.globals)
+        except RuntimeError as error:
+            self._had_runtime_error = True
+            self.error_frames.append(ErrorFrame(
+                error.token.line, error.message))
+            return
@@ -0,0 +1,387 @@
+import expressions
+import statements
+from tokens import TokenType, Token
+from typing import List, Dict, Any
+import dataclasses
+from bytecode import OpCode, FunctionProto
+from interpreter import InlineCache, StoreCache
+
+
+@dataclasses.dataclass
+class Local:
+    name: str
+    depth: int
+    is_captured: bool = False
+
+
+class FunctionState:
+    '''
+    Compile-time bookkeeping for the function currently being compiled. Slot 0
+    of every frame holds the callee itself, or `this` in methods, so locals
+    start at slot 1.
+    '''
+
+    def __init__(self, enclosing: "FunctionState", proto: FunctionProto,
+                 is_method: bool = False, is_initializer: bool = False) -> None:
+        self.enclosing = enclosing
+        self.proto = proto
+        self.is_initializer = is_initializer
+        self.locals: List[Local] = [Local("this" if is_method else "", 0)]
+        self.upvalues: List[tuple] = []
+        self.scope_depth = 0
+        # Slots reserved by `reserve_branch_declarations` for local functions
+        # and classes declared as the body of an `if` or `while`.
+        self.reserved: Dict[statements.Stmt, int] = {}
+
+
+_BINARY_OPS = {
+    TokenType.PLUS: OpCode.ADD,
+    TokenType.MINUS: OpCode.SUBTRACT,
+    TokenType.STAR: OpCode.MULTIPLY,
+    TokenType.SLASH: OpCode.DIVIDE,
+    TokenType.GREATER: OpCode.GREATER,
+    TokenType.GREATER_EQUAL: OpCode.GREATER_EQUAL,
+    TokenType.LESS: OpCode.LESS,
+    TokenType.LESS_EQUAL: OpCode.LESS_EQUAL,
+    TokenType.EQUAL_EQUAL: OpCode.EQUAL,
+    TokenType.BANG_EQUAL: OpCode.NOT_EQUAL,
+}
+
+
+class Compiler(expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Lowers a resolved AST into bytecode for `vm.VM`. Static errors are left to
+    the `Resolver`, which must have accepted the program first.
+    '''
+
+    def __init__(self) -> None:
+        self.state: FunctionState = None
+        self.line = 1
+
+    def compile(self, statements: List[statements.Stmt]) -> FunctionProto:
+        self.state = FunctionState(None, FunctionProto("script", 0))
+        for statement in statements:
+            self.compile_stmt(statement)
+        self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+        return self.state.proto
+
+    def compile_stmt(self, stmt: statements.Stmt) -> None:
+        stmt.accept(self)
+
+    def compile_expr(self, expr: expressions.Expr) -> None:
+        expr.accept(self)
+
+    # Statements
+    def visit_expression_stmt(self, node: statements.Expression):
+        self.compile_expr(node.expression)
+        self.emit(OpCode.POP)
+
+    def visit_print_stmt(self, node: statements.Print):
+        self.compile_expr(node.expression)
+        self.emit(OpCode.PRINT)
+
+    def visit_var_stmt(self, node: statements.Var):
+        self.line = node.name.line
+        if node.initializer is not None:
+            self.compile_expr(node.initializer)
+        else:
+            self.emit(OpCode.NIL)
+        self.define_variable(node.name)
+
+    def visit_function_stmt(self, node: statements.Function):
+        slot = self.state.reserved.pop(node, None)
+        if slot is not None:
+            self.state.locals[slot].name = node.name.lexeme
+            self.function(node)
+            self.emit(OpCode.SET_LOCAL, slot)
+            self.emit(OpCode.POP)
+        elif self.state.scope_depth > 0:
+            # Declare the local first so the body can refer to itself.
+            self.add_local(node.name)
+            self.function(node)
+        else:
+            self.function(node)
+            self.define_variable(node.name)
+
+    def visit_class_stmt(self, node: statements.Class):
+        self.line = node.name.line
+        self.emit(OpCode.CLASS, self.make_constant(node.name.lexeme))
+        slot = self.state.reserved.pop(node, None)
+        if slot is not None:
+            self.state.locals[slot].name = node.name.lexeme
+        elif self.state.scope_depth > 0:
+            # Declare the local first so methods can refer to the class.
+            self.add_local(node.name)
+        # Each METHOD pops a closure into the class below it.
+        for method in node.methods:
+            self.function(method, is_method=True,
+                          is_initializer=method.name.lexeme == "init")
+            self.emit(OpCode.METHOD, self.make_constant(method.name.lexeme))
+        if slot is not None:
+            self.emit(OpCode.SET_LOCAL, slot)
+            self.emit(OpCode.POP)
+        elif self.state.scope_depth == 0:
+            self.line = node.name.line
+            self.emit(OpCode.DEFINE_GLOBAL, self.make_constant(node.name.lexeme))
+
+    def visit_return_stmt(self, node: statements.Return):
+        self.line = node.keyword.line
+        if type(node.value) is expressions.Call:
+            self.compile_call(node.value, OpCode.TAIL_CALL)
+            return
+        if node.value is not None:
+            self.compile_expr(node.value)
+        else:
+            self.emit_implicit_return_value()
+        self.emit(OpCode.RETURN)
+
+    def visit_block_stmt(self, node: statements.Block):
+        self.begin_scope()
+        for statement in node.statements:
+            self.compile_stmt(statement)
+        self.end_scope()
+
+    def visit_if_stmt(self, node: statements.If):
+        self.reserve_branch_declarations(node)
+        self.compile_expr(node.condition)
+        then_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.emit(OpCode.POP)
+        self.compile_stmt(node.then_branch)
+        else_jump = self.emit_jump(OpCode.JUMP)
+        self.patch_jump(then_jump)
+        self.emit(OpCode.POP)
+        if node.else_branch is not None:
+            self.compile_stmt(node.else_branch)
+        self.patch_jump(else_jump)
+
+    def visit_while_stmt(self, node: statements.While):
+        self.reserve_branch_declarations(node)
+        loop_start = len(self.chunk().code)
+        self.compile_expr(node.condition)
+        exit_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.emit(OpCode.POP)
+        self.compile_stmt(node.body)
+        self.emit(OpCode.LOOP, loop_start)
+        self.patch_jump(exit_jump)
+        self.emit(OpCode.POP)
+
+    # Expressions
+    def visit_literal_expr(self, node: expressions.Literal):
+        if node.value is None:
+            self.emit(OpCode.NIL)
+        elif node.value is True:
+            self.emit(OpCode.TRUE)
+        elif node.value is False:
+            self.emit(OpCode.FALSE)
+        else:
+            self.emit(OpCode.CONSTANT, self.make_constant(node.value))
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        self.compile_expr(node.expression)
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        self.compile_expr(node.right)
+        self.line = node.operator.line
+        if node.operator.type == TokenType.MINUS:
+            self.emit(OpCode.NEGATE)
+        else:
+            self.emit(OpCode.NOT)
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        self.compile_expr(node.left)
+        self.compile_expr(node.right)
+        self.line = node.operator.line
+        self.emit(_BINARY_OPS[node.operator.type])
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        self.compile_expr(node.left)
+        if node.operator.type == TokenType.OR:
+            end_jump = self.emit_jump(OpCode.JUMP_IF_TRUE)
+        else:
+            end_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.emit(OpCode.POP)
+        self.compile_expr(node.right)
+        self.patch_jump(end_jump)
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        self.line = node.name.line
+        get_op, _, operand = self.resolve_variable(node.name)
+        self.emit(get_op, operand)
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        self.compile_expr(node.value)
+        self.line = node.name.line
+        _, set_op, operand = self.resolve_variable(node.name)
+        self.emit(set_op, operand)
+
+    def visit_call_expr(self, node: expressions.Call):
+        if type(node.callee) is expressions.Get:
+            callee = node.callee
+            self.compile_expr(callee.object)
+            for argument in node.arguments:
+                self.compile_expr(argument)
+            self.line = node.paren.line
+            self.emit(OpCode.INVOKE, self.make_constant(
+                InlineCache(callee.name.lexeme)), len(node.arguments))
+            return
+        self.compile_call(node, OpCode.CALL)
+
+    def compile_call(self, node: expressions.Call, op: OpCode) -> None:
+        self.compile_expr(node.callee)
+        for argument in node.arguments:
+            self.compile_expr(argument)
+        self.line = node.paren.line
+        self.emit(op, len(node.arguments))
+
+    def visit_get_expr(self, node: expressions.Get):
+        self.compile_expr(node.object)
+        self.line = node.name.line
+        self.emit(OpCode.GET_PROPERTY, self.make_constant(
+            InlineCache(node.name.lexeme)))
+
+    def visit_this_expr(self, node: expressions.This):
+        self.line = node.keyword.line
+        get_op, _, operand = self.resolve_variable(node.keyword)
+        self.emit(get_op, operand)
+
+    def visit_set_expr(self, node: expressions.Set):
+        self.compile_expr(node.object)
+        self.compile_expr(node.value)
+        self.line = node.name.line
+        self.emit(OpCode.SET_PROPERTY, self.make_constant(
+            StoreCache(node.name.lexeme)))
+
+    # Helpers
+    def chunk(self):
+        return self.state.proto.chunk
+
+    def emit(self, op: OpCode, *operands: int) -> None:
+        chunk = self.chunk()
+        chunk.write(op, self.line)
+        for operand in operands:
+            chunk.write(operand, self.line)
+
+    def emit_jump(self, op: OpCode) -> int:
+        self.emit(op, -1)
+        return len(self.chunk().code) - 1
+
+    def patch_jump(self, offset: int) -> None:
+        self.chunk().code[offset] = len(self.chunk().code)
+
+    def make_constant(self, value: Any) -> int:
+        return self.chunk().add_constant(value)
+
+    def function(self, node: statements.Function, is_method: bool = False,
+                 is_initializer: bool = False) -> None:
+        self.line = node.name.line
+        proto = FunctionProto(node.name.lexeme, len(node.params))
+        proto.memo = node.memo
+        self.state = FunctionState(
+            self.state, proto, is_method, is_initializer)
+        self.begin_scope()
+        for param in node.params:
+            self.add_local(param)
+        for statement in node.body:
+            self.compile_stmt(statement)
+        self.emit_implicit_return_value()
+        self.emit(OpCode.RETURN)
+
+        state = self.state
+        proto.upvalue_count = len(state.upvalues)
+        self.state = state.enclosing
+        self.line = node.name.line
+        self.emit(OpCode.CLOSURE, self.make_constant(proto))
+        for is_local, index in state.upvalues:
+            self.emit(1 if is_local else 0, index)
+
+    def emit_implicit_return_value(self) -> None:
+        if self.state.is_initializer:
+            # `init` always returns the instance.
+            self.emit(OpCode.GET_LOCAL, 0)
+        else:
+            self.emit(OpCode.NIL)
+
+    def reserve_branch_declarations(self, node: statements.Stmt) -> None:
+        '''
+        A local function or class declared as the body of an `if` or `while`,
+        directly or through nested ones, would get its slot only on the path
+        that runs it, leaving later slots misnumbered on the others. Such a
+        declaration gets a nil slot before the statement instead, as the
+        `Interpreter` gives it, and stores into it when it runs. The slot has
+        no name until the declaration is compiled, so the condition still
+        sees what the `Resolver` bound it to.
+        '''
+        if self.state.scope_depth == 0:
+            return
+        pending = [node]
+        while pending:
+            stmt = pending.pop()
+            if type(stmt) is statements.If:
+                pending.append(stmt.then_branch)
+                if stmt.else_branch is not None:
+                    pending.append(stmt.else_branch)
+            elif type(stmt) is statements.While:
+                pending.append(stmt.body)
+            elif (type(stmt) is statements.Function or type(stmt) is statements.Class) \
+                    and stmt not in self.state.reserved:
+                self.emit(OpCode.NIL)
+                self.state.reserved[stmt] = len(self.state.locals)
+                self.state.locals.append(Local("", self.state.scope_depth))
+
+    def define_variable(self, name: Token) -> None:
+        if self.state.scope_depth > 0:
+            # The value on top of the stack becomes the local's slot.
+            self.add_local(name)
+            return
+        self.emit(OpCode.DEFINE_GLOBAL, self.make_constant(name.lexeme))
+
+    def add_local(self, name: Token) -> None:
+        self.state.locals.append(Local(name.lexeme, self.state.scope_depth))
+
+    def begin_scope(self) -> None:
+        self.state.scope_depth += 1
+
+    def end_scope(self) -> None:
+        state = self.state
+        state.scope_depth -= 1
+        while state.locals and state.locals[-1].depth > state.scope_depth:
+            if state.locals[-1].is_captured:
+                self.emit(OpCode.CLOSE_UPVALUE)
+            else:
+                self.emit(OpCode.POP)
+            state.locals.pop()
+
+    def resolve_variable(self, name: Token) -> tuple:
+        slot = self.resolve_local(self.state, name.lexeme)
+        if slot is not None:
+            return OpCode.GET_LOCAL, OpCode.SET_LOCAL, slot
+        index = self.resolve_upvalue(self.state, name.lexeme)
+        if index is not None:
+            return OpCode.GET_UPVALUE, OpCode.SET_UPVALUE, index
+        return OpCode.GET_GLOBAL, OpCode.SET_GLOBAL, self.make_constant(name.lexeme)
+
+    def resolve_local(self, state: FunctionState, name: str) -> int:
+        for slot in range(len(state.locals) - 1, -1, -1):
+            if state.locals[slot].name == name:
+                return slot
+        return None
+
+    def resolve_upvalue(self, state: FunctionState, name: str) -> int:
+        if state.enclosing is None:
+            return None
+        slot = self.resolve_local(state.enclosing, name)
+        if slot is not None:
+            state.enclosing.locals[slot].is_captured = True
+            return self.add_upvalue(state, True, slot)
+        index = self.resolve_upvalue(state.enclosing, name)
+        if index is not None:
+            return self.add_upvalue(state, False, index)
+        return None
+
+    def add_upvalue(self, state: FunctionState, is_local: bool, index: int) -> int:
+        upvalue = (is_local, index)
+        if upvalue in state.upvalues:
+            return state.upvalues.index(upvalue)
+        state.upvalues.append(upvalue)
+        return len(state.upvalues) - 1
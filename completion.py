@@ -0,0 +1,22 @@
+class Return:
+    '''
+    Completion of a `return` statement. Executing a statement yields None when
+    it completes normally, and a `Return` when the enclosing function should
+    return `value`; blocks, `if` and `while` pass it up to the call.
+    '''
+    __slots__ = ("value",)
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+
+class TailCall:
+    '''
+    Completion of `return f(...)` when `f` is a Lox function: the trampoline
+    in the caller's `call` runs `function` in place of the returning one.
+    '''
+    __slots__ = ("function", "args")
+
+    def __init__(self, function, args) -> None:
+        self.function = function
+        self.args = args
@@ -4,33 +4,21 @@ from tokens import Token
 
 
 class Environment:
-    def __init__(self, enclosing=None) -> None:
-        self.values = {}
-        self.enclosing = enclosing
-
-    def assign(self, name: Token, value: Any) -> None:
-        if name.lexeme in self.values:
-            self.values[name.lexeme] = value
-            return
-        if self.enclosing is not None:
-            self.enclosing.assign(name, value)
-            return
-        raise RuntimeError(
-            name, f"Undefined variable assignment: {name.lexeme}.")
-
-    def define(self, name: str, value: Any) -> None:
-        self.values[name] = value
-
-    def get(self, name: Token) -> Any:
-        if name.lexeme in self.values:
-            return self.values[name.lexeme]
+    '''
+    A local scope. Variables live in a fixed-size list; the resolver assigns
+    every local a slot index and records how many slots each scope needs.
+    '''
+    __slots__ = ("values", "enclosing")
 
-        if self.enclosing is not None:
-            return self.enclosing.get(name)
-        raise RuntimeError(name, f"Undefined variable: {name.lexeme}.")
+    def __init__(self, enclosing=None, size: int = 0) -> None:
+        self.values = [None] * size
+        self.enclosing = enclosing
 
-    def get_at(self, distance: int, name: str) -> Any:
-        return self.ancestor(distance).values[name]
+    def get_at(self, distance: int, slot: int) -> Any:
+        environment = self
+        for _ in range(distance):
+            environment = environment.enclosing
+        return environment.values[slot]
 
     def ancestor(self, distance: int) -> "Environment":
         environment = self
@@ -38,5 +26,44 @@ class Environment:
             environment = environment.enclosing
         return environment
 
-    def assign_at(self, distance: int, name: Token, value: Any) -> None:
-        self.ancestor(distance).values[name.lexeme] = value
+    def assign_at(self, distance: int, slot: int, value: Any) -> None:
+        self.ancestor(distance).values[slot] = value
+
+
+# Marks a global slot that has been interned but not defined yet.
+UNDEFINED = object()
+
+
+class GlobalEnvironment:
+    '''
+    The global scope. The resolver interns every global name into a slot of
+    `values`; undefined slots hold the `UNDEFINED` sentinel. The table lives as
+    long as the interpreter, so REPL lines share and can redefine globals.
+    '''
+
+    def __init__(self) -> None:
+        self.slots = {}
+        self.values = []
+
+    def intern(self, name: str) -> int:
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = len(self.values)
+            self.slots[name] = slot
+            self.values.append(UNDEFINED)
+        return slot
+
+    def define(self, name: str, value: Any) -> None:
+        self.values[self.intern(name)] = value
+
+    def get_at(self, slot: int, name: Token) -> Any:
+        value = self.values[slot]
+        if value is UNDEFINED:
+            raise RuntimeError(name, f"Undefined variable: {name.lexeme}.")
+        return value
+
+    def assign_at(self, slot: int, name: Token, value: Any) -> None:
+        if self.values[slot] is UNDEFINED:
+            raise RuntimeError(
+                name, f"Undefined variable assignment: {name.lexeme}.")
+        self.values[slot] = value
@@ -17,6 +17,8 @@ class ExprVisitor:
         raise NotImplementedError()
     def visit_literal_expr(self, node : "Literal"):
         raise NotImplementedError()
+    def visit_this_expr(self, node : "This"):
+        raise NotImplementedError()
     def visit_logical_expr(self, node : "Logical"):
         raise NotImplementedError()
     def visit_variable_expr(self, node : "Variable"):
@@ -27,33 +29,20 @@ class ExprVisitor:
         pass
 
 class Expr:
+    __slots__ = ()
     def accept(self, visitor : ExprVisitor):
-        if isinstance(self, Assign):
-            return visitor.visit_assign_expr(self)
-        if isinstance(self, Binary):
-            return visitor.visit_binary_expr(self)
-        if isinstance(self, Call):
-            return visitor.visit_call_expr(self)
-        if isinstance(self, Grouping):
-            return visitor.visit_grouping_expr(self)
-        if isinstance(self, Get):
-            return visitor.visit_get_expr(self)
-        if isinstance(self, Set):
-            return visitor.visit_set_expr(self)
-        if isinstance(self, Literal):
-            return visitor.visit_literal_expr(self)
-        if isinstance(self, Logical):
-            return visitor.visit_logical_expr(self)
-        if isinstance(self, Variable):
-            return visitor.visit_variable_expr(self)
-        if isinstance(self, Unary):
-            return visitor.visit_unary_expr(self)
         return visitor.default_expr(self)
 
 class Assign(Expr):
+    __slots__ = ("name", "value", "depth", "slot", "global_slot",)
     def __init__(self , name : Token, value : Expr):
         self.name : Token = name
         self.value : Expr = value
+        self.depth : int = None
+        self.slot : int = None
+        self.global_slot : int = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_assign_expr(self)
     def __str__(self):
         r = "Assign("
         r += f"name : Token = "
@@ -67,10 +56,14 @@ class Assign(Expr):
         r += ")"
         return r
 class Binary(Expr):
+    __slots__ = ("left", "operator", "right", "feedback",)
     def __init__(self , left : Expr, operator : Token, right : Expr):
         self.left : Expr = left
         self.operator : Token = operator
         self.right : Expr = right
+        self.feedback : Any = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_binary_expr(self)
     def __str__(self):
         r = "Binary("
         r += f"left : Expr = "
@@ -88,10 +81,13 @@ class Binary(Expr):
         r += ")"
         return r
 class Call(Expr):
+    __slots__ = ("callee", "paren", "arguments",)
     def __init__(self , callee : Expr, paren : Token, arguments : List[Expr]):
         self.callee : Expr = callee
         self.paren : Token = paren
         self.arguments : List[Expr] = arguments
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_call_expr(self)
     def __str__(self):
         r = "Call("
         r += f"callee : Expr = "
@@ -109,8 +105,11 @@ class Call(Expr):
         r += ")"
         return r
 class Grouping(Expr):
+    __slots__ = ("expression",)
     def __init__(self , expression : Expr):
         self.expression : Expr = expression
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_grouping_expr(self)
     def __str__(self):
         r = "Grouping("
         r += f"expression : Expr = "
@@ -120,9 +119,13 @@ class Grouping(Expr):
         r += ")"
         return r
 class Get(Expr):
+    __slots__ = ("object", "name", "cache",)
     def __init__(self , object : Expr, name : Token):
         self.object : Expr = object
         self.name : Token = name
+        self.cache : Any = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_get_expr(self)
     def __str__(self):
         r = "Get("
         r += f"object : Expr = "
@@ -136,10 +139,14 @@ class Get(Expr):
         r += ")"
         return r
 class Set(Expr):
+    __slots__ = ("object", "name", "value", "cache",)
     def __init__(self , object : Expr, name : Token, value : Expr):
         self.object : Expr = object
         self.name : Token = name
         self.value : Expr = value
+        self.cache : Any = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_set_expr(self)
     def __str__(self):
         r = "Set("
         r += f"object : Expr = "
@@ -157,21 +164,43 @@ class Set(Expr):
         r += ")"
         return r
 class Literal(Expr):
+    __slots__ = ("value",)
     def __init__(self , value : Any):
         self.value : Any = value
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_literal_expr(self)
     def __str__(self):
         r = "Literal("
         r += f"value : Any = "
         r += str(self.value)
         r += ","
 
+        r += ")"
+        return r
+class This(Expr):
+    __slots__ = ("keyword", "depth", "slot",)
+    def __init__(self , keyword : Token):
+        self.keyword : Token = keyword
+        self.depth : int = None
+        self.slot : int = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_this_expr(self)
+    def __str__(self):
+        r = "This("
+        r += f"keyword : Token = "
+        r += str(self.keyword)
+        r += ","
+
         r += ")"
         return r
 class Logical(Expr):
+    __slots__ = ("left", "operator", "right",)
     def __init__(self , left : Expr, operator : Token, right : Expr):
         self.left : Expr = left
         self.operator : Token = operator
         self.right : Expr = right
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_logical_expr(self)
     def __str__(self):
         r = "Logical("
         r += f"left : Expr = "
@@ -189,8 +218,14 @@ class Logical(Expr):
         r += ")"
         return r
 class Variable(Expr):
+    __slots__ = ("name", "depth", "slot", "global_slot",)
     def __init__(self , name : Token):
         self.name : Token = name
+        self.depth : int = None
+        self.slot : int = None
+        self.global_slot : int = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_variable_expr(self)
     def __str__(self):
         r = "Variable("
         r += f"name : Token = "
@@ -200,9 +235,13 @@ class Variable(Expr):
         r += ")"
         return r
 class Unary(Expr):
+    __slots__ = ("operator", "right", "feedback",)
     def __init__(self , operator : Token, right : Expr):
         self.operator : Token = operator
         self.right : Expr = right
+        self.feedback : Any = None
+    def accept(self, visitor : ExprVisitor):
+        return visitor.visit_unary_expr(self)
     def __str__(self):
         r = "Unary("
         r += f"operator : Token = "
@@ -14,15 +14,11 @@ def define_ast(output_file: FileIO, base_name: str, types: List[str], extra_impo
     define_visitor(output_file, base_name, types)
 
     output_file.write(f"class {base_name}:\n")
-    # define accept method for each type.
+    output_file.write(f"    __slots__ = ()\n")
+    # Subclasses override accept to call their own visitor method directly; the
+    # base class only falls back to the default visitor method.
     output_file.write(
         f"    def accept(self, visitor : {base_name}Visitor):\n")
-    for type in types:
-        class_name = type.split(":")[0].strip()
-        output_file.write(f"        if isinstance(self, {class_name}):\n")
-        output_file.write(
-            f"            return visitor.visit_{class_name.lower()}_{base_name.lower()}(self)\n")
-    # call default visitor method.
     output_file.write(
         f"        return visitor.default_{base_name.lower()}(self)\n")
     output_file.write("\n")
@@ -49,16 +45,30 @@ def define_visitor(output_file: FileIO, base_name: str, types: List[str]):
     output_file.write("\n")
 
 
-def define_type(output_file: FileIO, base_name: str, class_name: str, fields: str):
-    # parse the fields.
+def parse_fields(fields: str):
     parsed_fileds = []
     for field in fields.split(","):
         field = field.strip()
         field_type = field.split(" ")[0]
         field_name = field.split(" ")[-1]
         parsed_fileds.append((field_type, field_name))
+    return parsed_fileds
+
+
+def define_type(output_file: FileIO, base_name: str, class_name: str, fields: str):
+    # parse the fields. Fields after a `|` are not constructor parameters; they
+    # start out as None and are filled in by the resolver or at run time.
+    annotations = []
+    if "|" in fields:
+        fields, annotation_fields = fields.split("|")
+        annotations = parse_fields(annotation_fields)
+    parsed_fileds = parse_fields(fields)
 
     output_file.write(f"class {class_name}({base_name}):\n")
+    # Declare the fields as slots so nodes don't carry a per-instance __dict__.
+    slots = "".join(f"\"{field_name}\", " for _,
+                    field_name in parsed_fileds + annotations)
+    output_file.write(f"    __slots__ = ({slots.strip()})\n")
 
     # Generate a constructor.
     output_file.write(f"    def __init__(self ")
@@ -69,6 +79,14 @@ def define_type(output_file: FileIO, base_name: str, class_name: str, fields: st
     for field_type, field_name in parsed_fileds:
         output_file.write(
             f"        self.{field_name} : {field_type} = {field_name}\n")
+    for field_type, field_name in annotations:
+        output_file.write(
+            f"        self.{field_name} : {field_type} = None\n")
+    # Generate an accept method that dispatches straight to the visitor method.
+    output_file.write(
+        f"    def accept(self, visitor : {base_name}Visitor):\n")
+    output_file.write(
+        f"        return visitor.visit_{class_name.lower()}_{base_name.lower()}(self)\n")
     # Generate a __str__ method.
     output_file.write(f"    def __str__(self):\n")
     output_file.write(f"        r = \"{class_name}(\"\n")
@@ -104,16 +122,17 @@ def main():
     output_file = open(os.path.join(
         args.output_directory, 'expressions.py'), 'w')
     define_ast(output_file, "Expr", [
-        "Assign   : Token name, Expr value",
-        "Binary : Expr left, Token operator, Expr right",
+        "Assign   : Token name, Expr value | int depth, int slot, int global_slot",
+        "Binary : Expr left, Token operator, Expr right | Any feedback",
         "Call : Expr callee, Token paren, List[Expr] arguments",
         "Grouping : Expr expression",
-        "Get : Expr object, Token name",
-        "Set : Expr object, Token name, Expr value",
+        "Get : Expr object, Token name | Any cache",
+        "Set : Expr object, Token name, Expr value | Any cache",
         "Literal : Any value",
+        "This : Token keyword | int depth, int slot",
         "Logical : Expr left, Token operator, Expr right",
-        "Variable : Token name",
-        "Unary : Token operator, Expr right",
+        "Variable : Token name | int depth, int slot, int global_slot",
+        "Unary : Token operator, Expr right | Any feedback",
     ])
 
     # Generate the statements.py file.
@@ -121,11 +140,11 @@ def main():
         args.output_directory, 'statements.py'), 'w')
     define_ast(output_file, "Stmt", [
         "Expression : Expr expression",
-        "Function : Token name, List[Token] params, List[Stmt] body",
+        "Function : Token name, List[Token] params, List[Stmt] body | int slot, int global_slot, int scope_size, Any memo, Any jit",
         "If : Expr condition, Stmt then_branch, Stmt else_branch",
-        "Block : List[Stmt] statements",
-        "Class : Token name, List[Function] methods",
-        "Var: Token name, Expr initializer",
+        "Block : List[Stmt] statements | int scope_size",
+        "Class : Token name, List[Function] methods | int slot, int global_slot",
+        "Var: Token name, Expr initializer | int slot, int global_slot",
         "Return : Token keyword, Expr value",
         "Print : Expr expression",
         "While : Expr condition, Stmt body",
@@ -4,8 +4,12 @@ from tokens import TokenType, Token
 from typing import List, Any
 import dataclasses
 from runtime_error import RuntimeError
-from return_exception import ReturnException
-from environment import Environment
+from completion import Return, TailCall
+from purity import MISSING, memo_key
+import quickening
+import tracing
+import jit
+from environment import Environment, GlobalEnvironment
 import time
 from resolver import Resolver
 
@@ -27,21 +31,93 @@ class Callable:
         raise NotImplementedError()
 
 
+class Clock(Callable):
+    def arity(self):
+        return 0
+
+    def call(self, interpreter, args):
+        # Returns the current system time in milliseconds.
+        return time.time()
+
+    def __str__(self):
+        return "<native fn> Clock()"
+
+
 class LoxFunction(Callable):
-    def __init__(self, declaration: statements.Function, closure: Environment) -> None:
+    def __init__(self, declaration: statements.Function, closure: Environment,
+                 is_method: bool = False, is_initializer: bool = False) -> None:
         self.declaration = declaration
         self._arity = len(declaration.params)
+        # Methods are called with the instance ahead of the arguments; it
+        # becomes `this` in slot 0.
+        self._param_count = self._arity + 1 if is_method else self._arity
         self._closure = closure
+        self._is_initializer = is_initializer
+        # Set on pure functions when memoization is enabled.
+        self._memo = declaration.memo
 
     def call(self, interpreter, args):
-        environment = Environment(self._closure)
-        for i in range(len(args)):
-            environment.define(self.declaration.params[i].lexeme, args[i])
-        try:
-            interpreter.execute_block(self.declaration.body, environment)
-        except ReturnException as e:
-            return e.value
-        return None
+        function = self
+        # Memo entries for this call and the tail calls that replaced it,
+        # which all have the value the last one returns.
+        waiting = None
+        tracer = interpreter.tracer
+        # Trampoline: a `TailCall` replaces the running function instead of
+        # nesting another call.
+        while True:
+            if function._memo is not None:
+                key = memo_key(args)
+                value = function._memo.lookup(key)
+                if value is not MISSING:
+                    break
+                if waiting is None:
+                    waiting = []
+                waiting.append((function._memo, key))
+            compiled = function.declaration.jit
+            if compiled is None or compiled.__class__ is int:
+                compiled = jit.observe(function, interpreter)
+            if compiled:
+                # Hot functions run as Python code, which returns the result
+                # or a `TailCall` rather than a completion.
+                if tracer is None:
+                    value = compiled(interpreter, function._closure, args)
+                else:
+                    name = function.declaration.name.lexeme
+                    tracer.begin(name, tracing.FUNCTION)
+                    value = compiled(interpreter, function._closure, args)
+                    tracer.end(name, tracing.FUNCTION)
+                if type(value) is not TailCall:
+                    break
+                function, args = value.function, value.args
+                continue
+            environment = Environment(
+                function._closure, function.declaration.scope_size)
+            # Parameters occupy the first slots of the function's scope.
+            environment.values[:function._param_count] = args
+            if tracer is None:
+                completion = interpreter.execute_block(
+                    function.declaration.body, environment)
+            else:
+                name = function.declaration.name.lexeme
+                tracer.begin(name, tracing.FUNCTION)
+                completion = interpreter.execute_block(
+                    function.declaration.body, environment)
+                tracer.end(name, tracing.FUNCTION)
+            if function._is_initializer:
+                # `init` always returns the instance.
+                return environment.values[0]
+            if completion is None:
+                value = None
+                break
+            if type(completion) is Return:
+                value = completion.value
+                break
+            function, args = completion.function, completion.args
+        if waiting is not None:
+            # Store the outermost call last, so it is evicted last.
+            for memo, key in reversed(waiting):
+                memo.store(key, value)
+        return value
 
     def arity(self):
         return self._arity
@@ -50,36 +126,209 @@ class LoxFunction(Callable):
         return f"<fn {self.declaration.name.lexeme}, arity {self.arity()}>"
 
 
+class BoundMethod(Callable):
+    '''
+    A method read off an instance with `obj.name`, remembering `obj` as the
+    receiver. Works for the methods of every engine.
+    '''
+
+    def __init__(self, receiver: 'LoxInstance', method: Callable) -> None:
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self):
+        return self.method.arity()
+
+    def call(self, interpreter, args):
+        return self.method.call(interpreter, [self.receiver, *args])
+
+    def __str__(self) -> str:
+        return str(self.method)
+
+
+class Shape:
+    '''
+    The layout shared by instances of one class that were given the same
+    fields in the same order: `slots` maps each field name to its index in
+    `LoxInstance.values`. Adding a field moves an instance along a transition
+    to the next shape, which is made once and then reused.
+    '''
+    __slots__ = ("slots", "transitions")
+
+    def __init__(self, slots: dict) -> None:
+        self.slots = slots
+        self.transitions = {}
+
+    def with_field(self, name: str) -> 'Shape':
+        shape = self.transitions.get(name)
+        if shape is None:
+            slots = dict(self.slots)
+            slots[name] = len(slots)
+            shape = self.transitions[name] = Shape(slots)
+        return shape
+
+
 class LoxInstance:
+    __slots__ = ("klass", "shape", "values")
+
     def __init__(self, klass: 'LoxClass') -> None:
         self.klass = klass
-        self.fields = {}
+        self.shape = klass.root_shape
+        self.values = []
 
     def get_field(self, name: Token):
-        if name.lexeme in self.fields:
-            return self.fields[name.lexeme]
-        raise RuntimeError(f"Undefined property '{name.lexeme}'.")
+        '''
+        Reads the field `name`, or else the method `name` bound to this
+        instance.
+        '''
+        slot = self.shape.slots.get(name.lexeme)
+        if slot is not None:
+            return self.values[slot]
+        method = self.klass.methods.get(name.lexeme)
+        if method is not None:
+            return BoundMethod(self, method)
+        raise RuntimeError(name, f"Undefined property '{name.lexeme}'.")
 
     def set_field(self, name: Token, value: Any):
-        self.fields[name.lexeme] = value
+        self.store(name.lexeme, value)
+
+    def store(self, name: str, value: Any):
+        slot = self.shape.slots.get(name)
+        if slot is None:
+            self.shape = self.shape.with_field(name)
+            self.values.append(value)
+        else:
+            self.values[slot] = value
 
     def __str__(self):
         return f"<instance of {self.klass.name}>"
 
 
 class LoxClass(Callable):
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, methods: dict = None) -> None:
         self.name = name
+        self.methods = {} if methods is None else methods
+        # Every class has shapes of its own, so a shape also identifies the
+        # class of its instances.
+        self.root_shape = Shape({})
 
     def __str__(self) -> str:
         return self.name
 
     def call(self, interpreter, args):
         instance = LoxInstance(self)
+        initializer = self.methods.get("init")
+        if initializer is not None:
+            initializer.call(interpreter, [instance, *args])
         return instance
 
     def arity(self):
-        return 0
+        initializer = self.methods.get("init")
+        if initializer is None:
+            return 0
+        return initializer.arity()
+
+
+class InlineCache:
+    '''
+    Per-site cache for reading the property `name`, keyed by the instance's
+    `Shape`. A shape fixes both the class and the fields, so an entry never
+    goes stale: `slot` is the field's index in `values`, or -1 with `method`
+    the class method `name` finds. Up to `MAX_SHAPES` shapes are kept.
+    '''
+    __slots__ = ("name", "shape", "slot", "method", "others")
+
+    MAX_SHAPES = 4
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # The most recent shape is checked inline; `others` holds
+        # `(shape, slot, method)` for polymorphic sites.
+        self.shape = None
+        self.slot = -1
+        self.method = None
+        self.others = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    def miss(self, instance: LoxInstance) -> bool:
+        '''
+        Makes `instance`'s shape the inline entry. Returns False, caching
+        nothing, if the instance has no property `name`.
+        '''
+        shape = instance.shape
+        for index, entry in enumerate(self.others):
+            if entry[0] is shape:
+                self.others[index] = (self.shape, self.slot, self.method)
+                self.shape, self.slot, self.method = entry
+                return True
+        slot = shape.slots.get(self.name, -1)
+        method = None
+        if slot < 0:
+            method = instance.klass.methods.get(self.name)
+            if method is None:
+                return False
+        if self.shape is not None:
+            if len(self.others) == self.MAX_SHAPES - 1:
+                del self.others[0]
+            self.others.append((self.shape, self.slot, self.method))
+        self.shape, self.slot, self.method = shape, slot, method
+        return True
+
+
+class StoreCache:
+    '''
+    Per-site cache for assigning the property `name`, keyed by the instance's
+    `Shape` like `InlineCache`: `slot` is where the value goes and
+    `next_shape` the shape the instance has afterwards. A `slot` equal to the
+    number of values means the field is new and the value is appended.
+    '''
+    __slots__ = ("name", "shape", "slot", "next_shape", "others")
+
+    MAX_SHAPES = 4
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.shape = None
+        self.slot = 0
+        self.next_shape = None
+        self.others = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    def miss(self, instance: LoxInstance) -> None:
+        '''
+        Makes `instance`'s shape the inline entry.
+        '''
+        shape = instance.shape
+        for index, entry in enumerate(self.others):
+            if entry[0] is shape:
+                self.others[index] = (self.shape, self.slot, self.next_shape)
+                self.shape, self.slot, self.next_shape = entry
+                return
+        slot = shape.slots.get(self.name)
+        if slot is None:
+            slot, next_shape = len(shape.slots), shape.with_field(self.name)
+        else:
+            next_shape = shape
+        if self.shape is not None:
+            if len(self.others) == self.MAX_SHAPES - 1:
+                del self.others[0]
+            self.others.append((self.shape, self.slot, self.next_shape))
+        self.shape, self.slot, self.next_shape = shape, slot, next_shape
+
+    def store(self, instance: LoxInstance, value: Any) -> None:
+        if instance.shape is not self.shape:
+            self.miss(instance)
+        values = instance.values
+        slot = self.slot
+        if slot < len(values):
+            values[slot] = value
+        else:
+            values.append(value)
+            instance.shape = self.next_shape
 
 
 class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
@@ -87,39 +336,68 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
         self.globals = self.global_env()
         self.environment = self.globals
         self.error_frames = []
+        # Operator sites specialized by `quickening`, and how many of those
+        # went back to the generic path.
+        self.quickened = 0
+        self.deoptimized = 0
+        # Counters of internals while `metrics.enable` is in effect.
+        self.metrics = None
+        # Records calls of Lox functions while `--trace` is in effect.
+        self.tracer = None
+        # Calls before a function is compiled by `jit`, or None to never
+        # compile, and how many functions were compiled.
+        self.jit_threshold = jit.JIT_THRESHOLD
+        self.jitted = 0
 
     def global_env(self):
-        class Clock(Callable):
-            def arity(self):
-                return 0
-
-            def call(self, interpreter, args):
-                # Returns the current system time in milliseconds.
-                return time.time()
-
-            def __str__(self):
-                return "<native fn> Clock()"
-
-        r = Environment()
+        r = GlobalEnvironment()
         r.define("clock", Clock())
         return r
 
     def evaluate(self, expr: expressions.Expr) -> Any:
         return expr.accept(self)
 
-    def execute(self, stmt: statements.Stmt) -> None:
-        stmt.accept(self)
+    def execute(self, stmt: statements.Stmt) -> Any:
+        '''
+        Runs `stmt` and returns its completion: None, or a `Return` or
+        `TailCall` to pass up to the enclosing call.
+        '''
+        return stmt.accept(self)
+
+    @property
+    def global_table(self) -> GlobalEnvironment:
+        '''
+        The table the resolver interns global names into.
+        '''
+        return self.globals
+
+    def resolve(self, statements: List[statements.Stmt]) -> None:
+        '''
+        Runs only the resolver pass, leaving any errors in `error_frames`.
+        '''
+        self.error_frames = []
+        try:
+            Resolver(self.global_table).resolve_stmts(statements)
+        except RuntimeError as error:
+            self.error_frames.append(ErrorFrame(
+                error.token.line, error.message))
 
-    def interpret(self, statements: List[statements.Stmt]) -> None:
-        resolver = Resolver()
-        resolver.resolve_stmts(statements)
-        self.locals = resolver.resolutions
+    def interpret(self, statements: List[statements.Stmt], resolved: bool = False) -> None:
+        '''
+        Resolves and runs `statements`. Pass `resolved=True` for a tree that
+        `resolve` already accepted against this interpreter's globals.
+        '''
+        self.error_frames = []
         try:
-            self.error_frames = []
+            if not resolved:
+                resolver = Resolver(self.globals)
+                resolver.resolve_stmts(statements)
             for statement in statements:
                 self.execute(statement)
         except RuntimeError as error:
             self._had_runtime_error = True
+            if self.metrics is not None:
+                self.metrics.runtime_errors += 1
             self.error_frames.append(ErrorFrame(
                 error.token.line, error.message))
             return
@@ -138,66 +416,70 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
         value = None
         if node.initializer is not None:
             value = self.evaluate(node.initializer)
-        self.environment.define(node.name.lexeme, value)
+        self._define(node, value)
         return None
 
     def visit_function_stmt(self, node: statements.Function):
         f = LoxFunction(node, self.environment)
-        self.environment.define(node.name.lexeme, f)
+        self._define(node, f)
         return None
 
     def visit_return_stmt(self, node: statements.Return):
+        if type(node.value) is expressions.Call:
+            callee, arguments = self._prepare_call(node.value)
+            if type(callee) is LoxFunction:
+                return TailCall(callee, arguments)
+            return Return(callee.call(self, arguments))
         value = None
         if node.value is not None:
             value = self.evaluate(node.value)
-        raise ReturnException(value)
+        return Return(value)
 
     def visit_expression_stmt(self, node: statements.Expression):
-        return self.evaluate(node.expression)
+        self.evaluate(node.expression)
 
     def visit_print_stmt(self, node: statements.Print):
         value = self.evaluate(node.expression)
         print(self.stringify(value))
 
     def visit_block_stmt(self, node: statements.Block):
-        self.execute_block(node.statements, Environment(self.environment))
+        return self.execute_block(node.statements, Environment(
+            self.environment, node.scope_size))
 
     def visit_if_stmt(self, node: statements.If):
         if self._is_true(self.evaluate(node.condition)):
-            self.execute(node.then_branch)
+            return self.execute(node.then_branch)
         elif node.else_branch is not None:
-            self.execute(node.else_branch)
+            return self.execute(node.else_branch)
         return None
 
     def visit_while_stmt(self, node: statements.While):
         while self._is_true(self.evaluate(node.condition)):
-            self.execute(node.body)
+            completion = self.execute(node.body)
+            if completion is not None:
+                return completion
         return None
 
     def visit_class_stmt(self, node: statements.Class):
-        self.environment.define(node.name.lexeme, None)
-        klass = LoxClass(node.name.lexeme)
-        self.environment.assign(node.name, klass)
+        methods = {}
+        for method in node.methods:
+            name = method.name.lexeme
+            methods[name] = LoxFunction(method, self.environment, is_method=True,
+                                        is_initializer=name == "init")
+        klass = LoxClass(node.name.lexeme, methods)
+        self._define(node, klass)
     # Expressions
 
     def visit_assign_expr(self, node: expressions.Assign):
         value = self.evaluate(node.value)
-        distance = self.locals.get(node, None)
-        if distance is not None:
-            self.environment.assign_at(distance, node.name, value)
+        if node.depth is not None:
+            self.environment.assign_at(node.depth, node.slot, value)
         else:
-            self.globals.assign(node.name, value)
+            self.globals.assign_at(node.global_slot, node.name, value)
         return value
 
     def visit_call_expr(self, node: expressions.Call):
-        callee = self.evaluate(node.callee)
-        if not isinstance(callee, Callable):
-            raise RuntimeError(
-                node.paren, "Can only call functions and classes.")
-        arguments = [self.evaluate(arg) for arg in node.arguments]
-        if len(arguments) != callee.arity():
-            raise RuntimeError(
-                node.paren, f"Expected {callee.arity()} arguments but got {len(arguments)}.")
+        callee, arguments = self._prepare_call(node)
         return callee.call(self, arguments)
 
     def visit_grouping_expr(self, node: expressions.Grouping):
@@ -220,17 +502,34 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
         return self.evaluate(node.right)
 
     def visit_unary_expr(self, node: expressions.Unary):
+        right = self.evaluate(node.right)
+        if node.feedback is not quickening.GENERIC:
+            quick = quickening.UNARY.get((node.operator.type, type(right)))
+            if quickening.observe(node, quick):
+                node.__class__ = quick
+                self.quickened += 1
+        return self._unary(node, right)
+
+    def _unary(self, node: expressions.Unary, right: Any):
         if node.operator.type == TokenType.MINUS:
-            return -self.evaluate(node.right)
+            return -right
         elif node.operator.type == TokenType.BANG:
-            return not self._is_true(self.evaluate(node.right))
+            return not self._is_true(right)
 
         raise RuntimeError(f"Unknown unary operator {node.operator.lexeme}")
 
     def visit_binary_expr(self, node: expressions.Binary):
         left = self.evaluate(node.left)
         right = self.evaluate(node.right)
-
+        if node.feedback is not quickening.GENERIC:
+            quick = quickening.BINARY.get(
+                (node.operator.type, type(left), type(right)))
+            if quickening.observe(node, quick):
+                node.__class__ = quick
+                self.quickened += 1
+        return self._binary(node, left, right)
+
+    def _binary(self, node: expressions.Binary, left: Any, right: Any):
         node_type = node.operator.type
         if node_type == TokenType.MINUS:
             self._check_number_operands(node.operator, left, right)
@@ -266,11 +565,125 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
             return self._is_equal(left, right)
         raise RuntimeError(f"Unknown binary operator {node.operator.lexeme}")
 
+    # Quickened nodes, see `quickening`. Operands are evaluated by calling
+    # `accept` directly, and a guard miss sends the site back to the generic
+    # visitor for good.
+    def visit_float_add(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left + right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_string_concat(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is str and type(right) is str:
+            return left + right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_subtract(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left - right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_multiply(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left * right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_divide(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left / right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_less(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left < right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_less_equal(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left <= right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_greater(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left > right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_greater_equal(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left >= right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_equal(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left == right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_not_equal(self, node: expressions.Binary):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left != right
+        return self._deoptimize_binary(node, left, right)
+
+    def visit_float_negate(self, node: expressions.Unary):
+        right = node.right.accept(self)
+        if type(right) is float:
+            return -right
+        return self._deoptimize_unary(node, right)
+
+    def visit_bool_not(self, node: expressions.Unary):
+        right = node.right.accept(self)
+        if type(right) is bool:
+            return not right
+        return self._deoptimize_unary(node, right)
+
+    def _deoptimize_binary(self, node: expressions.Binary, left: Any, right: Any):
+        node.__class__ = expressions.Binary
+        node.feedback = quickening.GENERIC
+        self.deoptimized += 1
+        return self._binary(node, left, right)
+
+    def _deoptimize_unary(self, node: expressions.Unary, right: Any):
+        node.__class__ = expressions.Unary
+        node.feedback = quickening.GENERIC
+        self.deoptimized += 1
+        return self._unary(node, right)
+
     def visit_get_expr(self, node: expressions.Get):
         obj = self.evaluate(node.object)
-        if isinstance(obj, LoxInstance):
+        if not isinstance(obj, LoxInstance):
+            raise RuntimeError(node.name, "Only instances have properties.")
+        cache = node.cache
+        if cache is None:
+            cache = node.cache = InlineCache(node.name.lexeme)
+        if obj.shape is not cache.shape and not cache.miss(obj):
             return obj.get_field(node.name)
-        raise RuntimeError(node.name, "Only instances have properties.")
+        if cache.slot >= 0:
+            return obj.values[cache.slot]
+        return BoundMethod(obj, cache.method)
+
+    def visit_this_expr(self, node: expressions.This):
+        return self.environment.get_at(node.depth, node.slot)
 
     def visit_set_expr(self, node: expressions.Set):
         obj = self.evaluate(node.object)
@@ -278,13 +691,14 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
             raise RuntimeError(
                 node.name, f"Only instances have fields. Got {obj.__class__.__name__}.")
 
-        if False:
-            if node.name.lexeme not in obj.fields:
-                raise RuntimeError(
-                    node.name, f"Instance has no field {node.name.lexeme}.")
-
         value = self.evaluate(node.value)
-        obj.set_field(node.name, value)
+        cache = node.cache
+        if cache is None:
+            cache = node.cache = StoreCache(node.name.lexeme)
+        if obj.shape is cache.shape and cache.next_shape is cache.shape:
+            obj.values[cache.slot] = value
+        else:
+            cache.store(obj, value)
 
     # Helpers.
 
@@ -293,16 +707,64 @@ class Interpreter(expressions.ExprVisitor, statements.StmtVisitor):
         try:
             self.environment = environment
             for statement in statements:
-                self.execute(statement)
+                completion = statement.accept(self)
+                if completion is not None:
+                    return completion
+            return None
         finally:
             self.environment = previous
 
+    def _prepare_call(self, node: expressions.Call):
+        '''
+        Evaluates the callee and arguments of `node` and checks that the call
+        is valid, without making it. For `obj.name(...)` calls that find a
+        method in the inline cache, the callee is the unbound method and the
+        instance is passed ahead of the arguments, so no `BoundMethod` is made.
+        '''
+        receiver = None
+        if type(node.callee) is expressions.Get:
+            callee, receiver = self._prepare_invoke(node.callee)
+        else:
+            callee = self.evaluate(node.callee)
+        if not isinstance(callee, Callable):
+            raise RuntimeError(
+                node.paren, "Can only call functions and classes.")
+        arguments = [self.evaluate(arg) for arg in node.arguments]
+        if len(arguments) != callee.arity():
+            raise RuntimeError(
+                node.paren, f"Expected {callee.arity()} arguments but got {len(arguments)}.")
+        if receiver is not None:
+            arguments = [receiver, *arguments]
+        return callee, arguments
+
+    def _prepare_invoke(self, node: expressions.Get):
+        '''
+        Returns the method and receiver for calling `node`, or the property
+        value and None if it is not a cached method.
+        '''
+        obj = self.evaluate(node.object)
+        if not isinstance(obj, LoxInstance):
+            raise RuntimeError(node.name, "Only instances have properties.")
+        cache = node.cache
+        if cache is None:
+            cache = node.cache = InlineCache(node.name.lexeme)
+        if obj.shape is not cache.shape and not cache.miss(obj):
+            return obj.get_field(node.name), None
+        if cache.slot >= 0:
+            return obj.values[cache.slot], None
+        return cache.method, obj
+
     def _lookup_variable(self, name: Token, expr: expressions.Expr):
-        distance = self.locals.get(expr, None)
-        if distance is not None:
-            return self.environment.get_at(distance, name.lexeme)
+        if expr.depth is not None:
+            return self.environment.get_at(expr.depth, expr.slot)
+        else:
+            return self.globals.get_at(expr.global_slot, name)
+
+    def _define(self, node: statements.Stmt, value: Any):
+        if node.slot is None:
+            self.globals.values[node.global_slot] = value
         else:
-            return self.globals.get(name)
+            self.environment.values[node.slot] = value
 
     def _is_true(self, value):
         if value is None:
@@ -0,0 +1,416 @@
+import math
+import expressions
+import statements
+from tokens import TokenType
+from typing import List, Any
+from runtime_error import RuntimeError
+from completion import TailCall
+from environment import UNDEFINED
+# `interpreter` imports this module, so only its module object is bound here.
+import interpreter as interpreter_module
+
+# Calls of a function before the `Interpreter` compiles it.
+JIT_THRESHOLD = 200
+
+# `jit` of a function that is not compiled, because it uses something
+# `SourceCompiler` does not translate or the JIT is disabled.
+NOT_COMPILABLE = False
+
+# Python operators for the binary operators with a float fast path.
+_FLOAT_OPERATORS = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.STAR: "*",
+    TokenType.SLASH: "/",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.EQUAL_EQUAL: "==",
+    TokenType.BANG_EQUAL: "!=",
+}
+
+
+class Unsupported(Exception):
+    '''
+    Raised by `SourceCompiler` on code it does not translate.
+    '''
+
+
+def observe(function: Any, interpreter: Any) -> Any:
+    '''
+    Counts a call of the `LoxFunction` `function` and compiles its
+    declaration once it has been called `interpreter.jit_threshold` times.
+    Returns the compiled body, `NOT_COMPILABLE`, or None while warming up.
+    While the threshold is None nothing is counted or recorded, so the
+    function can still be compiled once the JIT is back on.
+    '''
+    threshold = interpreter.jit_threshold
+    if threshold is None:
+        return NOT_COMPILABLE
+    declaration = function.declaration
+    count = (declaration.jit or 0) + 1
+    if count < threshold:
+        declaration.jit = count
+        return None
+    # Methods take `this` ahead of their arguments; they stay tree-walking.
+    if function._param_count != function._arity:
+        declaration.jit = NOT_COMPILABLE
+        return NOT_COMPILABLE
+    declaration.jit = compile_function(declaration)
+    if declaration.jit is not NOT_COMPILABLE:
+        interpreter.jitted += 1
+    return declaration.jit
+
+
+def compile_function(declaration: statements.Function) -> Any:
+    '''
+    Compiles the body of `declaration` with `SourceCompiler`, or returns
+    `NOT_COMPILABLE` if it cannot be.
+    '''
+    try:
+        return SourceCompiler(declaration).compile()
+    except Unsupported:
+        return NOT_COMPILABLE
+
+
+def _assigns(expr: expressions.Expr) -> bool:
+    '''
+    Whether evaluating `expr` can assign a variable.
+    '''
+    if type(expr) is expressions.Assign:
+        return True
+    for field in expr.__slots__:
+        value = getattr(expr, field)
+        if isinstance(value, expressions.Expr) and _assigns(value):
+            return True
+        if type(value) is list and any(_assigns(item) for item in value):
+            return True
+    return False
+
+
+class SourceCompiler(expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Translates the resolved body of a function into the source of a Python
+    function `(interpreter, closure, args)`, which returns the function's
+    result, or a `TailCall` for the `LoxFunction.call` trampoline, instead of
+    a completion.
+
+    Variables of the function, including those of its blocks, become Python
+    locals; this is sound because functions that declare functions or
+    classes, which could capture them, are not compiled. Variables of
+    enclosing functions are read from `closure`. Each expression is computed
+    into a temporary by straight-line statements, and operators run natively
+    behind a float guard, calling `Interpreter._binary` or `_unary` for other
+    operands so that results and errors are the tree-walker's.
+    '''
+
+    def __init__(self, declaration: statements.Function) -> None:
+        self.declaration = declaration
+        self.lines: List[str] = []
+        self.indent = 2
+        # Objects the code refers to, such as tokens for error messages.
+        self.constants: List[Any] = []
+        # The Python local of each slot, by scope, innermost last.
+        self.scopes: List[dict] = []
+        self.names = 0
+        # Float literals among the values of `compile_expr`, which need no
+        # guard, and the Lox value of every literal.
+        self.floats = set()
+        self.literals = {}
+
+    def compile(self) -> Any:
+        declaration = self.declaration
+        params = [self.new_name("v") for _ in declaration.params]
+        self.scopes.append(dict(enumerate(params)))
+        if params:
+            self.emit(f"{', '.join(params)}, = args")
+        self.emit("gv = interpreter.globals.values")
+        for statement in declaration.body:
+            self.compile_stmt(statement)
+
+        constants = [f"k{i}" for i in range(len(self.constants))]
+        # Lox names never appear in the source, so they cannot shadow the
+        # names it uses.
+        source = "\n".join([
+            f"def make({', '.join(constants)}):",
+            "    def body(interpreter, closure, args):",
+            *self.lines,
+            "    return body",
+        ])
+        namespace = {
+            "RuntimeError": RuntimeError,
+            "TailCall": TailCall,
+            "UNDEFINED": UNDEFINED,
+            "Callable": interpreter_module.Callable,
+            "LoxFunction": interpreter_module.LoxFunction,
+        }
+        code = compile(source, f"<jit {declaration.name.lexeme} line "
+                       f"{declaration.name.line}>", "exec")
+        exec(code, namespace)
+        return namespace["make"](*self.constants)
+
+    # Helpers.
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " * self.indent + line)
+
+    def new_name(self, prefix: str) -> str:
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def constant(self, value: Any) -> str:
+        self.constants.append(value)
+        return f"k{len(self.constants) - 1}"
+
+    def compile_stmt(self, stmt: statements.Stmt) -> None:
+        stmt.accept(self)
+
+    def compile_body(self, stmt: statements.Stmt) -> None:
+        '''
+        Compiles `stmt` one level deeper, as the body of a Python statement.
+        '''
+        self.indent += 1
+        count = len(self.lines)
+        self.compile_stmt(stmt)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.indent -= 1
+
+    def compile_expr(self, expr: expressions.Expr) -> str:
+        '''
+        Emits the statements that evaluate `expr` and returns a Python
+        expression for its value: a literal, a local or a temporary.
+        '''
+        # Quickened nodes dispatch to their own visitor methods.
+        if isinstance(expr, expressions.Binary):
+            return self.visit_binary_expr(expr)
+        if isinstance(expr, expressions.Unary):
+            return self.visit_unary_expr(expr)
+        return expr.accept(self)
+
+    def compile_operands(self, exprs: List[expressions.Expr]) -> List[str]:
+        '''
+        Like `compile_expr` for operands evaluated left to right. A local is
+        copied when a later operand could assign it.
+        '''
+        values = []
+        for i, expr in enumerate(exprs):
+            value = self.compile_expr(expr)
+            if value in self.scopes_names() and any(_assigns(e) for e in exprs[i + 1:]):
+                value = self.temporary(value)
+            values.append(value)
+        return values
+
+    def scopes_names(self) -> set:
+        return {name for scope in self.scopes for name in scope.values()}
+
+    def temporary(self, value: str) -> str:
+        name = self.new_name("t")
+        self.emit(f"{name} = {value}")
+        return name
+
+    def local(self, depth: int, slot: int) -> str:
+        '''
+        The Python local for a variable `depth` scopes out, or None if it
+        belongs to an enclosing function.
+        '''
+        if depth < len(self.scopes):
+            return self.scopes[-1 - depth][slot]
+        return None
+
+    def closure_depth(self, depth: int) -> int:
+        return depth - len(self.scopes)
+
+    def is_true(self, value: str) -> str:
+        '''
+        A Python condition for the truthiness of `value`, as `_is_true`
+        defines it.
+        '''
+        if value in self.literals:
+            literal = self.literals[value]
+            return repr(literal is not None and literal is not False)
+        return f"{value} is not None and {value} is not False"
+
+    def is_false(self, value: str) -> str:
+        if value in self.literals:
+            literal = self.literals[value]
+            return repr(literal is None or literal is False)
+        return f"{value} is None or {value} is False"
+
+    def guard(self, values: List[str]) -> str:
+        checks = [f"type({value}) is float" for value in values
+                  if value not in self.floats]
+        return " and ".join(checks) or "True"
+
+    def prepare_call(self, node: expressions.Call) -> tuple:
+        '''
+        Emits `Interpreter._prepare_call` for `node`: evaluates and checks
+        the callee, then evaluates the arguments and checks their number.
+        '''
+        if type(node.callee) is expressions.Get:
+            raise Unsupported()
+        callee = self.compile_expr(node.callee)
+        if callee in self.scopes_names() and any(_assigns(e) for e in node.arguments):
+            callee = self.temporary(callee)
+        paren = self.constant(node.paren)
+        self.emit(f"if not isinstance({callee}, Callable):")
+        self.emit(f"    raise RuntimeError({paren}, \"Can only call functions and classes.\")")
+        arguments = self.compile_operands(node.arguments)
+        count = len(arguments)
+        self.emit(f"if {callee}.arity() != {count}:")
+        self.emit(f"    raise RuntimeError({paren}, f\"Expected {{{callee}.arity()}} "
+                  f"arguments but got {count}.\")")
+        return callee, f"[{', '.join(arguments)}]"
+
+    # Statements
+    def visit_expression_stmt(self, node: statements.Expression):
+        self.compile_expr(node.expression)
+
+    def visit_print_stmt(self, node: statements.Print):
+        value = self.compile_expr(node.expression)
+        self.emit(f"print(interpreter.stringify({value}))")
+
+    def visit_var_stmt(self, node: statements.Var):
+        value = "None"
+        if node.initializer is not None:
+            value = self.compile_expr(node.initializer)
+        name = self.new_name("v")
+        self.scopes[-1][node.slot] = name
+        self.emit(f"{name} = {value}")
+
+    def visit_block_stmt(self, node: statements.Block):
+        self.scopes.append({})
+        for statement in node.statements:
+            self.compile_stmt(statement)
+        self.scopes.pop()
+
+    def visit_if_stmt(self, node: statements.If):
+        condition = self.compile_expr(node.condition)
+        self.emit(f"if {self.is_true(condition)}:")
+        self.compile_body(node.then_branch)
+        if node.else_branch is not None:
+            self.emit("else:")
+            self.compile_body(node.else_branch)
+
+    def visit_while_stmt(self, node: statements.While):
+        self.emit("while True:")
+        self.indent += 1
+        condition = self.compile_expr(node.condition)
+        self.emit(f"if {self.is_false(condition)}:")
+        self.emit("    break")
+        self.compile_stmt(node.body)
+        self.indent -= 1
+
+    def visit_return_stmt(self, node: statements.Return):
+        if type(node.value) is expressions.Call:
+            callee, arguments = self.prepare_call(node.value)
+            self.emit(f"if type({callee}) is LoxFunction:")
+            self.emit(f"    return TailCall({callee}, {arguments})")
+            self.emit(f"return {callee}.call(interpreter, {arguments})")
+            return
+        value = "None"
+        if node.value is not None:
+            value = self.compile_expr(node.value)
+        self.emit(f"return {value}")
+
+    def visit_function_stmt(self, node: statements.Function):
+        raise Unsupported()
+
+    def visit_class_stmt(self, node: statements.Class):
+        raise Unsupported()
+
+    # Expressions
+    def visit_literal_expr(self, node: expressions.Literal):
+        value = node.value
+        if type(value) is float and math.isfinite(value):
+            self.floats.add(repr(value))
+            self.literals[repr(value)] = value
+            return repr(value)
+        if type(value) in (str, bool) or value is None:
+            self.literals[repr(value)] = value
+            return repr(value)
+        # Folded constants can be infinite or NaN, which have no literal.
+        name = self.constant(value)
+        if type(value) is float:
+            self.floats.add(name)
+        return name
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        return self.compile_expr(node.expression)
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        if node.depth is None:
+            name = self.new_name("t")
+            self.emit(f"{name} = gv[{node.global_slot}]")
+            self.emit(f"if {name} is UNDEFINED:")
+            self.emit(f"    raise RuntimeError({self.constant(node.name)}, "
+                      f"{repr(f'Undefined variable: {node.name.lexeme}.')})")
+            return name
+        local = self.local(node.depth, node.slot)
+        if local is not None:
+            return local
+        return self.temporary(
+            f"closure.get_at({self.closure_depth(node.depth)}, {node.slot})")
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        value = self.compile_expr(node.value)
+        if node.depth is None:
+            slot = node.global_slot
+            self.emit(f"if gv[{slot}] is UNDEFINED:")
+            self.emit(f"    raise RuntimeError({self.constant(node.name)}, "
+                      f"{repr(f'Undefined variable assignment: {node.name.lexeme}.')})")
+            self.emit(f"gv[{slot}] = {value}")
+            return value
+        local = self.local(node.depth, node.slot)
+        if local is not None:
+            self.emit(f"{local} = {value}")
+            return local
+        self.emit(f"closure.assign_at({self.closure_depth(node.depth)}, "
+                  f"{node.slot}, {value})")
+        return value
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        left, right = self.compile_operands([node.left, node.right])
+        name = self.new_name("t")
+        self.emit(f"if {self.guard([left, right])}:")
+        self.emit(f"    {name} = {left} {_FLOAT_OPERATORS[node.operator.type]} {right}")
+        self.emit("else:")
+        self.emit(f"    {name} = interpreter._binary({self.constant(node)}, {left}, {right})")
+        return name
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        right = self.compile_expr(node.right)
+        name = self.new_name("t")
+        if node.operator.type == TokenType.BANG:
+            self.emit(f"{name} = {self.is_false(right)}")
+            return name
+        self.emit(f"if {self.guard([right])}:")
+        self.emit(f"    {name} = -{right}")
+        self.emit("else:")
+        self.emit(f"    {name} = interpreter._unary({self.constant(node)}, {right})")
+        return name
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        name = self.temporary(self.compile_expr(node.left))
+        if node.operator.type == TokenType.OR:
+            self.emit(f"if {self.is_false(name)}:")
+        else:
+            self.emit(f"if {self.is_true(name)}:")
+        self.indent += 1
+        self.emit(f"{name} = {self.compile_expr(node.right)}")
+        self.indent -= 1
+        return name
+
+    def visit_call_expr(self, node: expressions.Call):
+        callee, arguments = self.prepare_call(node)
+        return self.temporary(f"{callee}.call(interpreter, {arguments})")
+
+    def visit_get_expr(self, node: expressions.Get):
+        raise Unsupported()
+
+    def visit_set_expr(self, node: expressions.Set):
+        raise Unsupported()
+
+    def visit_this_expr(self, node: expressions.This):
+        raise Unsupported()
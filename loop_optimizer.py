@@ -0,0 +1,745 @@
+import expressions
+import statements
+from tokens import Token, TokenType
+from typing import List, Any
+
+# Static types of Lox values. `None` means "no value yet" and UNKNOWN means
+# "could be anything"; the specific types sit in between.
+NUMBER = "number"
+STRING = "string"
+BOOL = "bool"
+NIL = "nil"
+UNKNOWN = "unknown"
+
+_COMPARISONS = (TokenType.GREATER, TokenType.GREATER_EQUAL,
+                TokenType.LESS, TokenType.LESS_EQUAL)
+_ARITHMETIC = (TokenType.MINUS, TokenType.STAR, TokenType.SLASH)
+_EQUALITY = (TokenType.EQUAL_EQUAL, TokenType.BANG_EQUAL)
+
+
+def _join(a: str, b: str) -> str:
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    return UNKNOWN
+
+
+def _could_be(value_type: str, expected: str) -> bool:
+    return value_type == expected or value_type == UNKNOWN
+
+
+def _literal_type(value: Any) -> str:
+    if value is None:
+        return NIL
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, float):
+        return NUMBER
+    if isinstance(value, str):
+        return STRING
+    return UNKNOWN
+
+
+class Binding:
+    '''
+    Everything the analysis knows about one variable: the function that
+    declares it (None for top-level code), the values written to it, and the
+    functions that assign it.
+    '''
+    __slots__ = ("function", "values", "assigned_in")
+
+    def __init__(self, function: statements.Function) -> None:
+        self.function = function
+        # Each entry is an expression or a type name.
+        self.values: List[Any] = []
+        self.assigned_in = set()
+
+
+class _Keys:
+    '''
+    Maps variable references and declarations to the binding they refer to.
+    A global is identified by its name and a local by `(scope, slot)`, where
+    `scope` is the `Block` or `Function` node that opened it. Optimizer
+    temporaries are unique by name.
+    '''
+
+    def __init__(self, keys: dict) -> None:
+        self.keys = keys
+
+    def key_of(self, node: Any) -> tuple:
+        name = node.name.lexeme
+        if name.startswith("$"):
+            return ("temp", name)
+        return self.keys[id(node)]
+
+
+class BindingAnalyzer(_Keys, expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Mirrors the `Resolver`'s scope stack to turn the `depth`/`slot`
+    annotations back into bindings, and collects a `Binding` for each one.
+    Shared by the `LoopOptimizer` and `purity.PurityAnalyzer`.
+    '''
+
+    def __init__(self) -> None:
+        super().__init__({})
+        self.scopes: List[Any] = []
+        self.functions: List[statements.Function] = []
+        self.bindings = {}
+
+    def current_function(self) -> statements.Function:
+        return self.functions[-1] if self.functions else None
+
+    def resolve_key(self, node: Any) -> tuple:
+        if node.depth is None:
+            key = ("global", node.name.lexeme)
+        else:
+            key = (self.scopes[-1 - node.depth], node.slot)
+        self.keys[id(node)] = key
+        return key
+
+    def binding(self, key: tuple, function: statements.Function) -> Binding:
+        binding = self.bindings.get(key)
+        if binding is None:
+            binding = self.bindings[key] = Binding(function)
+        return binding
+
+    def analyze(self, stmts: List[statements.Stmt]) -> None:
+        for statement in stmts:
+            statement.accept(self)
+
+    def declare(self, node: statements.Stmt, value: Any) -> None:
+        if node.slot is None:
+            key = ("global", node.name.lexeme)
+        else:
+            key = (self.scopes[-1], node.slot)
+        self.keys[id(node)] = key
+        function = None if key[0] == "global" else self.current_function()
+        self.binding(key, function).values.append(value)
+
+    # Statements
+    def visit_var_stmt(self, node: statements.Var):
+        if node.initializer is None:
+            self.declare(node, NIL)
+        else:
+            self.declare(node, node.initializer)
+            node.initializer.accept(self)
+
+    def visit_function_stmt(self, node: statements.Function):
+        self.declare(node, UNKNOWN)
+        self.analyze_function(node, len(node.params))
+
+    def visit_class_stmt(self, node: statements.Class):
+        self.declare(node, UNKNOWN)
+        for method in node.methods:
+            # Slot 0 of a method holds `this`.
+            self.analyze_function(method, len(method.params) + 1)
+
+    def analyze_function(self, node: statements.Function, param_count: int) -> None:
+        self.scopes.append(node)
+        self.functions.append(node)
+        for slot in range(param_count):
+            self.binding((node, slot), node).values.append(UNKNOWN)
+        self.analyze(node.body)
+        self.functions.pop()
+        self.scopes.pop()
+
+    def visit_block_stmt(self, node: statements.Block):
+        self.scopes.append(node)
+        self.analyze(node.statements)
+        self.scopes.pop()
+
+    def visit_expression_stmt(self, node: statements.Expression):
+        node.expression.accept(self)
+
+    def visit_print_stmt(self, node: statements.Print):
+        node.expression.accept(self)
+
+    def visit_return_stmt(self, node: statements.Return):
+        if node.value is not None:
+            node.value.accept(self)
+
+    def visit_if_stmt(self, node: statements.If):
+        node.condition.accept(self)
+        node.then_branch.accept(self)
+        if node.else_branch is not None:
+            node.else_branch.accept(self)
+
+    def visit_while_stmt(self, node: statements.While):
+        node.condition.accept(self)
+        node.body.accept(self)
+
+    # Expressions
+    def visit_assign_expr(self, node: expressions.Assign):
+        node.value.accept(self)
+        key = self.resolve_key(node)
+        binding = self.binding(key, None)
+        binding.values.append(node.value)
+        binding.assigned_in.add(self.current_function())
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        node.left.accept(self)
+        node.right.accept(self)
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        node.left.accept(self)
+        node.right.accept(self)
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        node.right.accept(self)
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        node.expression.accept(self)
+
+    def visit_call_expr(self, node: expressions.Call):
+        node.callee.accept(self)
+        for argument in node.arguments:
+            argument.accept(self)
+
+    def visit_get_expr(self, node: expressions.Get):
+        node.object.accept(self)
+
+    def visit_set_expr(self, node: expressions.Set):
+        node.object.accept(self)
+        node.value.accept(self)
+
+    def visit_literal_expr(self, node: expressions.Literal):
+        pass
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        self.resolve_key(node)
+
+    def visit_this_expr(self, node: expressions.This):
+        pass
+
+
+class _Effects(_Keys, expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Collects the bindings a piece of code assigns or declares and whether it
+    makes calls. Function bodies count for assignments but not for calls,
+    since they only run when called.
+    '''
+
+    def __init__(self, keys: dict) -> None:
+        super().__init__(keys)
+        self.assigned = set()
+        self.declared = set()
+        self.has_calls = False
+        self._function_depth = 0
+
+    def visit_var_stmt(self, node: statements.Var):
+        self.declared.add(self.key_of(node))
+        if node.initializer is not None:
+            node.initializer.accept(self)
+
+    def visit_function_stmt(self, node: statements.Function):
+        self.declared.add(self.key_of(node))
+        self._function_depth += 1
+        for statement in node.body:
+            statement.accept(self)
+        self._function_depth -= 1
+
+    def visit_class_stmt(self, node: statements.Class):
+        self.declared.add(self.key_of(node))
+        self._function_depth += 1
+        for method in node.methods:
+            for statement in method.body:
+                statement.accept(self)
+        self._function_depth -= 1
+
+    def visit_block_stmt(self, node: statements.Block):
+        for statement in node.statements:
+            statement.accept(self)
+
+    visit_expression_stmt = BindingAnalyzer.visit_expression_stmt
+    visit_print_stmt = BindingAnalyzer.visit_print_stmt
+    visit_return_stmt = BindingAnalyzer.visit_return_stmt
+    visit_if_stmt = BindingAnalyzer.visit_if_stmt
+    visit_while_stmt = BindingAnalyzer.visit_while_stmt
+    visit_binary_expr = BindingAnalyzer.visit_binary_expr
+    visit_logical_expr = BindingAnalyzer.visit_logical_expr
+    visit_unary_expr = BindingAnalyzer.visit_unary_expr
+    visit_grouping_expr = BindingAnalyzer.visit_grouping_expr
+    visit_get_expr = BindingAnalyzer.visit_get_expr
+    visit_set_expr = BindingAnalyzer.visit_set_expr
+    visit_literal_expr = BindingAnalyzer.visit_literal_expr
+    visit_this_expr = BindingAnalyzer.visit_this_expr
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        pass
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        node.value.accept(self)
+        self.assigned.add(self.key_of(node))
+
+    def visit_call_expr(self, node: expressions.Call):
+        if self._function_depth == 0:
+            self.has_calls = True
+        BindingAnalyzer.visit_call_expr(self, node)
+
+
+class _Walk:
+    '''
+    State of an evaluation-order walk. `clean` stays true while everything
+    evaluated so far can neither raise nor have a side effect.
+    '''
+    __slots__ = ("clean", "candidate", "replace")
+
+    def __init__(self, candidate, replace) -> None:
+        self.clean = True
+        # `candidate(expr, first)` says whether to replace `expr`, where
+        # `first` tells whether it would be evaluated before anything else
+        # observable happens.
+        self.candidate = candidate
+        self.replace = replace
+
+
+class LoopOptimizer(_Keys, statements.StmtVisitor):
+    '''
+    Optional pass, enabled with `-O`, that runs after the `Optimizer`:
+
+    - Loop-invariant code motion: a pure expression inside a `while` loop
+      that reads no variable the loop assigns or declares (nor, if the loop
+      makes calls, one a function could assign) is computed once into a
+      temporary declared just before the loop.
+    - Common-subexpression elimination: a pure expression that occurs more
+      than once in a statement is computed once into a temporary declared
+      just before the statement.
+
+    Moving an expression must not move a runtime error, so it is only moved
+    if a small type inference proves that it cannot raise, or if it would be
+    the first thing evaluated anyway. Temporaries are named `$tN`, which
+    cannot clash with a Lox identifier. The tree has to be resolved again
+    afterwards.
+
+    With `whole_program` false, as in the REPL, other code may assign any
+    global, so globals are treated as unknown and changeable by calls.
+    '''
+
+    def __init__(self, whole_program: bool = True) -> None:
+        super().__init__({})
+        self.whole_program = whole_program
+        self.functions: List[statements.Function] = []
+        # How many blocks and functions enclose the current statement.
+        self.nesting = 0
+        self.bindings = {}
+        self.types = {}
+        self.temp_count = 0
+        # Globals that top-level code has defined by the current statement.
+        self.defined_globals = set()
+
+    def optimize(self, stmts: List[statements.Stmt]) -> List[statements.Stmt]:
+        analyzer = BindingAnalyzer()
+        analyzer.analyze(stmts)
+        self.keys = analyzer.keys
+        self.bindings = analyzer.bindings
+        self.infer_types()
+        return self.optimize_stmts(stmts)
+
+    def optimize_stmts(self, stmts: List[statements.Stmt]) -> List[statements.Stmt]:
+        result = []
+        for statement in stmts:
+            result.extend(statement.accept(self))
+            if self.nesting == 0 and isinstance(statement, (statements.Var, statements.Function, statements.Class)):
+                self.defined_globals.add(statement.name.lexeme)
+        return result
+
+    def optimize_branch(self, stmt: statements.Stmt) -> statements.Stmt:
+        result = stmt.accept(self)
+        if len(result) == 1:
+            return result[0]
+        return statements.Block(result)
+
+    # Statements. Each returns the statements that replace the node.
+    def visit_block_stmt(self, node: statements.Block):
+        self.nesting += 1
+        node.statements = self.optimize_stmts(node.statements)
+        self.nesting -= 1
+        return [node]
+
+    def visit_function_stmt(self, node: statements.Function):
+        self.nesting += 1
+        self.functions.append(node)
+        node.body = self.optimize_stmts(node.body)
+        self.functions.pop()
+        self.nesting -= 1
+        return [node]
+
+    def visit_class_stmt(self, node: statements.Class):
+        for method in node.methods:
+            self.visit_function_stmt(method)
+        return [node]
+
+    def visit_if_stmt(self, node: statements.If):
+        node.then_branch = self.optimize_branch(node.then_branch)
+        if node.else_branch is not None:
+            node.else_branch = self.optimize_branch(node.else_branch)
+        return [node]
+
+    def visit_while_stmt(self, node: statements.While):
+        hoisted = self.hoist_invariants(node)
+        node.body = self.optimize_branch(node.body)
+        return hoisted + [node]
+
+    def visit_expression_stmt(self, node: statements.Expression):
+        return self.eliminate_common(node, "expression")
+
+    def visit_print_stmt(self, node: statements.Print):
+        return self.eliminate_common(node, "expression")
+
+    def visit_var_stmt(self, node: statements.Var):
+        if node.initializer is None:
+            return [node]
+        return self.eliminate_common(node, "initializer")
+
+    def visit_return_stmt(self, node: statements.Return):
+        if node.value is None:
+            return [node]
+        return self.eliminate_common(node, "value")
+
+    # Loop-invariant code motion
+    def hoist_invariants(self, loop: statements.While) -> List[statements.Stmt]:
+        effects = _Effects(self.keys)
+        loop.accept(effects)
+        variant = effects.assigned | effects.declared
+
+        def stable(key):
+            return key not in variant and not (effects.has_calls and self.clobbered_by_calls(key))
+
+        temps = {}
+        hoisted = []
+
+        def candidate(expr, first):
+            shape = self.shape(expr)
+            if shape is None or self.operator_count(expr) == 0:
+                return False
+            if not all(stable(key) for key in self.reads(expr)):
+                return False
+            # Once computed before the loop, the value can be reused anywhere.
+            return shape in temps or first or not self.can_raise(expr)
+
+        def replace(expr):
+            shape = self.shape(expr)
+            temp = temps.get(shape)
+            if temp is None:
+                temp = temps[shape] = self.new_temp(expr)
+                hoisted.append(statements.Var(temp, expr))
+            return expressions.Variable(temp)
+
+        walk = _Walk(candidate, replace)
+        loop.condition = self.walk_expr(loop.condition, walk, False)
+        # The body only runs if the condition held, so nothing in it is
+        # certain to be evaluated unless the loop is unconditional.
+        always_entered = isinstance(
+            loop.condition, expressions.Literal) and loop.condition.value is True
+        self.walk_stmt(loop.body, walk, not always_entered)
+        return hoisted
+
+    def walk_stmt(self, stmt: statements.Stmt, walk: _Walk, conditional: bool) -> None:
+        '''
+        Walks the expressions of a statement inside a loop body in evaluation
+        order, replacing candidates.
+        '''
+        if isinstance(stmt, statements.Block):
+            for statement in stmt.statements:
+                self.walk_stmt(statement, walk, conditional)
+        elif isinstance(stmt, statements.Expression):
+            stmt.expression = self.walk_expr(
+                stmt.expression, walk, conditional)
+        elif isinstance(stmt, statements.Print):
+            stmt.expression = self.walk_expr(
+                stmt.expression, walk, conditional)
+            walk.clean = False
+        elif isinstance(stmt, statements.Var):
+            if stmt.initializer is not None:
+                stmt.initializer = self.walk_expr(
+                    stmt.initializer, walk, conditional)
+        elif isinstance(stmt, statements.Return):
+            if stmt.value is not None:
+                stmt.value = self.walk_expr(stmt.value, walk, conditional)
+            walk.clean = False
+        elif isinstance(stmt, statements.If):
+            stmt.condition = self.walk_expr(stmt.condition, walk, conditional)
+            self.walk_stmt(stmt.then_branch, walk, True)
+            if stmt.else_branch is not None:
+                self.walk_stmt(stmt.else_branch, walk, True)
+        elif isinstance(stmt, statements.While):
+            stmt.condition = self.walk_expr(stmt.condition, walk, True)
+            self.walk_stmt(stmt.body, walk, True)
+        # Function and class bodies run in their own environments, so nothing
+        # is moved out of them.
+
+    def walk_expr(self, expr: expressions.Expr, walk: _Walk, conditional: bool) -> expressions.Expr:
+        '''
+        Walks `expr` in evaluation order and returns it with candidates
+        replaced.
+        '''
+        if walk.candidate(expr, walk.clean and not conditional):
+            return walk.replace(expr)
+
+        if isinstance(expr, expressions.Binary):
+            expr.left = self.walk_expr(expr.left, walk, conditional)
+            expr.right = self.walk_expr(expr.right, walk, conditional)
+        elif isinstance(expr, expressions.Logical):
+            expr.left = self.walk_expr(expr.left, walk, conditional)
+            expr.right = self.walk_expr(expr.right, walk, True)
+        elif isinstance(expr, expressions.Unary):
+            expr.right = self.walk_expr(expr.right, walk, conditional)
+        elif isinstance(expr, expressions.Grouping):
+            expr.expression = self.walk_expr(
+                expr.expression, walk, conditional)
+        elif isinstance(expr, expressions.Call):
+            expr.callee = self.walk_expr(expr.callee, walk, conditional)
+            expr.arguments = [self.walk_expr(argument, walk, conditional)
+                              for argument in expr.arguments]
+        elif isinstance(expr, expressions.Get):
+            expr.object = self.walk_expr(expr.object, walk, conditional)
+        elif isinstance(expr, expressions.Set):
+            expr.object = self.walk_expr(expr.object, walk, conditional)
+            expr.value = self.walk_expr(expr.value, walk, conditional)
+        elif isinstance(expr, expressions.Assign):
+            expr.value = self.walk_expr(expr.value, walk, conditional)
+
+        if self.shape(expr) is None or self.can_raise(expr):
+            walk.clean = False
+        return expr
+
+    # Common-subexpression elimination
+    def eliminate_common(self, stmt: statements.Stmt, field: str) -> List[statements.Stmt]:
+        '''
+        Moves pure subexpressions that occur more than once in the `field`
+        expression of `stmt` into temporaries declared before it.
+        '''
+        effects = _Effects(self.keys)
+        getattr(stmt, field).accept(effects)
+
+        def stable(key):
+            return key not in effects.assigned and not (effects.has_calls and self.clobbered_by_calls(key))
+
+        prelude = []
+        while True:
+            occurrences = {}
+            first_clean = {}
+
+            def count(expr, first):
+                shape = self.shape(expr)
+                if shape is not None and self.operator_count(expr) > 0:
+                    occurrences[shape] = occurrences.get(shape, 0) + 1
+                    first_clean.setdefault(shape, first)
+                return False
+
+            self.walk_expr(getattr(stmt, field), _Walk(count, None), False)
+
+            best, best_saving = None, 1
+            for shape, uses in occurrences.items():
+                if uses < 2:
+                    continue
+                expr = self.find(getattr(stmt, field), shape)
+                if not all(stable(key) for key in self.reads(expr)):
+                    continue
+                if not first_clean[shape] and self.can_raise(expr):
+                    continue
+                saving = (uses - 1) * self.operator_count(expr)
+                if saving > best_saving:
+                    best, best_saving = shape, saving
+            if best is None:
+                break
+
+            expr = self.find(getattr(stmt, field), best)
+            temp = self.new_temp(expr)
+            prelude.append(statements.Var(temp, expr))
+
+            def same(candidate_expr, first):
+                return self.shape(candidate_expr) == best
+
+            walk = _Walk(same, lambda _: expressions.Variable(temp))
+            setattr(stmt, field, self.walk_expr(
+                getattr(stmt, field), walk, False))
+        return prelude + [stmt]
+
+    def find(self, expr: expressions.Expr, shape: tuple) -> expressions.Expr:
+        found = []
+
+        def match(candidate_expr, first):
+            if not found and self.shape(candidate_expr) == shape:
+                found.append(candidate_expr)
+            return False
+
+        self.walk_expr(expr, _Walk(match, None), False)
+        return found[0]
+
+    # Analysis helpers
+    def new_temp(self, expr: expressions.Expr) -> Token:
+        name = f"$t{self.temp_count}"
+        self.temp_count += 1
+        self.types[("temp", name)] = self.type_of(expr)
+        return Token(TokenType.IDENTIFIER, name, None, self.line_of(expr))
+
+    def line_of(self, expr: expressions.Expr) -> int:
+        for field in ("operator", "name", "paren"):
+            token = getattr(expr, field, None)
+            if token is not None:
+                return token.line
+        for field in ("left", "right", "expression", "callee", "object"):
+            child = getattr(expr, field, None)
+            if child is not None:
+                return self.line_of(child)
+        return 0
+
+    def is_global(self, key: tuple) -> bool:
+        return key[0] == "global"
+
+    def clobbered_by_calls(self, key: tuple) -> bool:
+        '''
+        Whether a call could assign the binding: it is assigned from a
+        function other than the one declaring it.
+        '''
+        if key[0] == "temp":
+            return False
+        if self.is_global(key) and not self.whole_program:
+            return True
+        binding = self.bindings.get(key)
+        if binding is None:
+            return False
+        return any(function is not binding.function for function in binding.assigned_in)
+
+    def infer_types(self) -> None:
+        '''
+        Assigns each binding the join of the types of every value written to
+        it. All rules are monotone, so iterating to a fixed point terminates.
+        '''
+        self.types = {key: None for key in self.bindings}
+        changed = True
+        while changed:
+            changed = False
+            for key, binding in self.bindings.items():
+                value_type = None
+                for value in binding.values:
+                    if isinstance(value, str):
+                        value_type = _join(value_type, value)
+                    else:
+                        value_type = _join(value_type, self.type_of(value))
+                if value_type != self.types[key]:
+                    self.types[key] = value_type
+                    changed = True
+
+    def type_of(self, expr: expressions.Expr) -> str:
+        '''
+        The type of the value `expr` produces, if it produces one at all.
+        '''
+        if isinstance(expr, expressions.Literal):
+            return _literal_type(expr.value)
+        if isinstance(expr, expressions.Variable):
+            key = self.key_of(expr)
+            if self.is_global(key) and not self.whole_program:
+                return UNKNOWN
+            return self.types.get(key, UNKNOWN)
+        if isinstance(expr, expressions.Grouping):
+            return self.type_of(expr.expression)
+        if isinstance(expr, expressions.Assign):
+            return self.type_of(expr.value)
+        if isinstance(expr, expressions.Logical):
+            return _join(self.type_of(expr.left), self.type_of(expr.right))
+        if isinstance(expr, expressions.Unary):
+            if expr.operator.type == TokenType.BANG:
+                return BOOL
+            right = self.type_of(expr.right)
+            return right if right is None or right == NUMBER else UNKNOWN
+        if isinstance(expr, expressions.Binary):
+            operator = expr.operator.type
+            if operator in _EQUALITY:
+                return BOOL
+            left = self.type_of(expr.left)
+            right = self.type_of(expr.right)
+            numbers = _could_be(left, NUMBER) and _could_be(right, NUMBER)
+            if operator in _COMPARISONS:
+                return BOOL if numbers else None
+            if operator in _ARITHMETIC:
+                return NUMBER if numbers else None
+            strings = _could_be(left, STRING) and _could_be(right, STRING)
+            return _join(NUMBER if numbers else None, STRING if strings else None)
+        return UNKNOWN
+
+    def can_raise(self, expr: expressions.Expr) -> bool:
+        '''
+        Whether evaluating `expr` could raise a runtime error. Only called on
+        pure expressions.
+        '''
+        if isinstance(expr, expressions.Literal):
+            return False
+        if isinstance(expr, expressions.Variable):
+            key = self.key_of(expr)
+            # Locals are always defined; globals only once top-level code has
+            # declared them, and only loops in top-level code can rely on it.
+            return self.is_global(key) and not (
+                self.whole_program and not self.functions and key[1] in self.defined_globals)
+        if isinstance(expr, expressions.Grouping):
+            return self.can_raise(expr.expression)
+        if isinstance(expr, expressions.Logical):
+            return self.can_raise(expr.left) or self.can_raise(expr.right)
+        if isinstance(expr, expressions.Unary):
+            if self.can_raise(expr.right):
+                return True
+            return expr.operator.type == TokenType.MINUS and self.type_of(expr.right) != NUMBER
+        if isinstance(expr, expressions.Binary):
+            if self.can_raise(expr.left) or self.can_raise(expr.right):
+                return True
+            operator = expr.operator.type
+            if operator in _EQUALITY:
+                return False
+            left = self.type_of(expr.left)
+            right = self.type_of(expr.right)
+            if operator == TokenType.PLUS:
+                return not ((left == NUMBER and right == NUMBER) or (left == STRING and right == STRING))
+            if left != NUMBER or right != NUMBER:
+                return True
+            if operator == TokenType.SLASH:
+                # Division by zero is not a Lox error; leave it where it is.
+                return not (isinstance(expr.right, expressions.Literal) and expr.right.value != 0)
+            return False
+        return True
+
+    def shape(self, expr: expressions.Expr) -> tuple:
+        '''
+        A hashable description of a pure expression, equal for expressions
+        that compute the same value. None if `expr` is not pure.
+        '''
+        if isinstance(expr, expressions.Literal):
+            return ("literal", type(expr.value).__name__, repr(expr.value))
+        if isinstance(expr, expressions.Variable):
+            return ("variable", self.key_of(expr))
+        if isinstance(expr, expressions.Grouping):
+            return self.shape(expr.expression)
+        if isinstance(expr, expressions.Unary):
+            right = self.shape(expr.right)
+            return None if right is None else ("unary", expr.operator.type, right)
+        if isinstance(expr, (expressions.Binary, expressions.Logical)):
+            left = self.shape(expr.left)
+            right = self.shape(expr.right)
+            if left is None or right is None:
+                return None
+            return ("binary", expr.operator.type, left, right)
+        return None
+
+    def operator_count(self, expr: expressions.Expr) -> int:
+        if isinstance(expr, expressions.Grouping):
+            return self.operator_count(expr.expression)
+        if isinstance(expr, expressions.Unary):
+            return 1 + self.operator_count(expr.right)
+        if isinstance(expr, (expressions.Binary, expressions.Logical)):
+            return 1 + self.operator_count(expr.left) + self.operator_count(expr.right)
+        return 0
+
+    def reads(self, expr: expressions.Expr) -> set:
+        '''
+        The bindings a pure expression reads.
+        '''
+        if isinstance(expr, expressions.Variable):
+            return {self.key_of(expr)}
+        if isinstance(expr, expressions.Grouping):
+            return self.reads(expr.expression)
+        if isinstance(expr, expressions.Unary):
+            return self.reads(expr.right)
+        if isinstance(expr, (expressions.Binary, expressions.Logical)):
+            return self.reads(expr.left) | self.reads(expr.right)
+        return set()
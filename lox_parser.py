@@ -1,8 +1,9 @@
-from tokens import Token, TokenType
+from tokens import Token, TokenType, TokenStream
 import expressions
 import statements
-from typing import List, Any
+from typing import List, Any, Iterator
 import dataclasses
+from enum import IntEnum
 
 
 @dataclasses.dataclass
@@ -25,14 +26,91 @@ class ParserError(Exception):
         return f"{self.token.line} - {self.token}: {self.message}"
 
 
+class Precedence(IntEnum):
+    '''
+    Binding power of expression operators, from loosest to tightest.
+    '''
+    ASSIGNMENT = 1
+    OR = 2
+    AND = 3
+    EQUALITY = 4
+    COMPARISON = 5
+    TERM = 6
+    FACTOR = 7
+    UNARY = 8
+    CALL = 9
+
+
+class TokenBuffer:
+    '''
+    Presents a token iterator as a sequence indexed by absolute position. Tokens
+    are pulled in as the parser looks ahead and dropped with `release`, so only
+    the tokens of the declaration being parsed are kept.
+    '''
+
+    def __init__(self, tokens: Iterator[Token]) -> None:
+        self._tokens = tokens
+        self._buffer: List[Token] = []
+        self._types: List[TokenType] = []
+        self._offset = 0
+        self.types = _TokenTypes(self)
+
+    def __getitem__(self, index: int) -> Token:
+        try:
+            return self._buffer[index - self._offset]
+        except IndexError:
+            self._fill(index)
+            return self._buffer[index - self._offset]
+
+    def _fill(self, index: int) -> None:
+        while index - self._offset >= len(self._buffer):
+            token = next(self._tokens)
+            self._buffer.append(token)
+            self._types.append(token.type)
+
+    def release(self, index: int) -> None:
+        '''
+        Forgets every token before `index`.
+        '''
+        count = index - self._offset
+        if count > 0:
+            del self._buffer[:count]
+            del self._types[:count]
+            self._offset = index
+
+
+class _TokenTypes:
+    '''
+    The `Parser.types` view of a `TokenBuffer`.
+    '''
+
+    def __init__(self, tokens: TokenBuffer) -> None:
+        self._tokens = tokens
+
+    def __getitem__(self, index: int) -> TokenType:
+        tokens = self._tokens
+        try:
+            return tokens._types[index - tokens._offset]
+        except IndexError:
+            tokens._fill(index)
+            return tokens._types[index - tokens._offset]
+
+
 class Parser:
     def __init__(self):
         self.tokens = []
+        self.types: List[TokenType] = []
         self.current = 0
         self.error_frames: List[ParserErrorFrame] = []
 
     def parse(self, tokens: List[Token]) -> List[statements.Stmt]:
         self.tokens = tokens
+        # Lookahead only needs token types, so keep them in a flat list. For a
+        # TokenStream this avoids materializing a Token for every check.
+        if isinstance(tokens, TokenStream):
+            self.types = tokens.token_types()
+        else:
+            self.types = [token.type for token in tokens]
         self.current = 0
         self.error_frames: List[ParserErrorFrame] = []
         statements: List[statements.Stmt] = []
@@ -44,6 +122,24 @@ class Parser:
         except ParserError as e:
             return []
 
+    def parse_stream(self, tokens: Iterator[Token]) -> Iterator[statements.Stmt]:
+        '''
+        Like `parse`, but pulls tokens from an iterator and yields top-level
+        declarations as soon as each one is parsed.
+        '''
+        buffer = TokenBuffer(tokens)
+        self.tokens = buffer
+        self.types = buffer.types
+        self.current = 0
+        self.error_frames: List[ParserErrorFrame] = []
+
+        try:
+            while not self.is_at_end():
+                buffer.release(self.current)
+                yield self.declaration()
+        except ParserError as e:
+            return
+
     def add_error(self, message: str):
         self.error_frames.append(ParserErrorFrame(self.peek(), message))
 
@@ -186,72 +282,86 @@ class Parser:
         return statements.Expression(expr)
 
     def expression(self) -> expressions.Expr:
-        return self.assignment()
+        return self.parse_precedence(Precedence.ASSIGNMENT)
 
-    def assignment(self) -> expressions.Expr:
-        expr = self.parse_or()
-        if self.match(TokenType.EQUAL):
-            operator = self.previous()
-            right = self.assignment()
-            if isinstance(expr, expressions.Variable):
-                return expressions.Assign(expr.name, right)
-            if isinstance(expr, expressions.Get):
-                name = expr.name
-                instance = expr.object
-                return expressions.Set(instance, name, right)
-            self.error_and_throw(operator, "Invalid assignment target.")
-        return expr
-
-    def left_associative_binary(self, parse_right, match_tokens: List[TokenType], op_constructor=expressions.Binary) -> expressions.Expr:
+    def parse_precedence(self, precedence: Precedence) -> expressions.Expr:
         '''
-        Helper function for binary expressions that are left associative.
+        Pratt parser: parses a prefix expression, then keeps folding in infix
+        operators that bind at least as tightly as `precedence`.
         '''
-        expr = parse_right()
+        types = self.types
+        prefix = _PREFIX_RULES.get(types[self.current])
+        if prefix is None:
+            self.error_and_throw(self.peek(), "Expect expression.")
+        self.current += 1
+        expr = prefix(self)
 
-        while self.match(*match_tokens):
-            operator = self.previous()
-            right = parse_right()
-            expr = op_constructor(expr, operator, right)
+        while True:
+            rule = _INFIX_RULES.get(types[self.current])
+            if rule is None or rule[1] < precedence:
+                return expr
+            self.current += 1
+            expr = rule[0](self, expr)
 
-        return expr
+    # Prefix rules. The operator token has already been consumed.
+    def literal(self) -> expressions.Expr:
+        return expressions.Literal(self.previous().literal)
 
-    def parse_or(self) -> expressions.Expr:
-        return self.left_associative_binary(self.parse_and, [TokenType.OR], op_constructor=expressions.Logical)
+    def literal_false(self) -> expressions.Expr:
+        return expressions.Literal(False)
 
-    def parse_and(self) -> expressions.Expr:
-        return self.left_associative_binary(self.equality, [TokenType.AND], op_constructor=expressions.Logical)
+    def literal_true(self) -> expressions.Expr:
+        return expressions.Literal(True)
 
-    def equality(self) -> expressions.Expr:
-        return self.left_associative_binary(self.comparison, [TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL])
+    def literal_nil(self) -> expressions.Expr:
+        return expressions.Literal(None)
 
-    def comparison(self) -> expressions.Expr:
-        return self.left_associative_binary(self.term, [TokenType.GREATER, TokenType.GREATER_EQUAL, TokenType.LESS, TokenType.LESS_EQUAL])
+    def variable(self) -> expressions.Expr:
+        return expressions.Variable(self.previous())
 
-    def term(self) -> expressions.Expr:
-        return self.left_associative_binary(self.factor, [TokenType.MINUS, TokenType.PLUS])
+    def this(self) -> expressions.Expr:
+        return expressions.This(self.previous())
 
-    def factor(self) -> expressions.Expr:
-        return self.left_associative_binary(self.unary, [TokenType.SLASH, TokenType.STAR])
+    def grouping(self) -> expressions.Expr:
+        expr = self.expression()
+        self.consume(TokenType.RIGHT_PAREN,
+                     "Expect ')' after expression.")
+        return expressions.Grouping(expr)
 
     def unary(self) -> expressions.Expr:
-        if self.match(TokenType.BANG, TokenType.MINUS):
-            operator = self.previous()
-            right = self.unary()
-            return expressions.Unary(operator, right)
-        return self.call()
-
-    def call(self) -> expressions.Expr:
-        expr = self.primary()
-        while True:
-            if self.match(TokenType.LEFT_PAREN):
-                expr = self.finish_call(expr)
-            elif self.match(TokenType.DOT):
-                name = self.consume(TokenType.IDENTIFIER,
-                                    "Expect property name after '.'.")
-                expr = expressions.Get(expr, name)
-            else:
-                break
-        return expr
+        operator = self.previous()
+        right = self.parse_precedence(Precedence.UNARY)
+        return expressions.Unary(operator, right)
+
+    # Infix rules. The operator token has already been consumed.
+    def binary(self, left: expressions.Expr) -> expressions.Expr:
+        operator = self.previous()
+        # Parsing the right operand one level tighter makes it left associative.
+        right = self.parse_precedence(_INFIX_RULES[operator.type][1] + 1)
+        return expressions.Binary(left, operator, right)
+
+    def logical(self, left: expressions.Expr) -> expressions.Expr:
+        operator = self.previous()
+        right = self.parse_precedence(_INFIX_RULES[operator.type][1] + 1)
+        return expressions.Logical(left, operator, right)
+
+    def assignment(self, target: expressions.Expr) -> expressions.Expr:
+        operator = self.previous()
+        # Assignment is right associative.
+        right = self.parse_precedence(Precedence.ASSIGNMENT)
+        if isinstance(target, expressions.Variable):
+            return expressions.Assign(target.name, right)
+        if isinstance(target, expressions.Get):
+            return expressions.Set(target.object, target.name, right)
+        self.error_and_throw(operator, "Invalid assignment target.")
+
+    def call(self, callee: expressions.Expr) -> expressions.Expr:
+        return self.finish_call(callee)
+
+    def get(self, instance: expressions.Expr) -> expressions.Expr:
+        name = self.consume(TokenType.IDENTIFIER,
+                            "Expect property name after '.'.")
+        return expressions.Get(instance, name)
 
     def finish_call(self, callee: expressions.Expr) -> expressions.Expr:
         arguments = []
@@ -266,24 +376,6 @@ class Parser:
                 self.consume(TokenType.COMMA, "Expect ',' after argument.")
         return expressions.Call(callee, self.previous(), arguments)
 
-    def primary(self) -> expressions.Expr:
-        if self.match(TokenType.FALSE):
-            return expressions.Literal(False)
-        if self.match(TokenType.TRUE):
-            return expressions.Literal(True)
-        if self.match(TokenType.NIL):
-            return expressions.Literal(None)
-        if self.match(TokenType.NUMBER, TokenType.STRING):
-            return expressions.Literal(self.previous().literal)
-        if self.match(TokenType.LEFT_PAREN):
-            expr = self.expression()
-            self.consume(TokenType.RIGHT_PAREN,
-                         "Expect ')' after expression.")
-            return expressions.Grouping(expr)
-        if self.match(TokenType.IDENTIFIER):
-            return expressions.Variable(self.previous())
-        self.error_and_throw(self.peek(), "Expect expression.")
-
     def consume(self, token_type: TokenType, message: str):
         if self.check(token_type):
             return self.advance()
@@ -303,7 +395,7 @@ class Parser:
             if self.previous().type == TokenType.SEMICOLON:
                 return
 
-            token_type = self.peek().type
+            token_type = self.types[self.current]
             if token_type in [TokenType.CLASS, TokenType.FUN, TokenType.VAR, TokenType.FOR, TokenType.IF, TokenType.WHILE, TokenType.PRINT, TokenType.RETURN]:
                 return
 
@@ -312,7 +404,9 @@ class Parser:
     def match(self, *token_types: TokenType) -> bool:
         for token_type in token_types:
             if self.check(token_type):
-                self.advance()
+                # check() already ruled out EOF, and callers use previous() when
+                # they need the token itself.
+                self.current += 1
                 return True
         return False
 
@@ -322,12 +416,11 @@ class Parser:
         return self.previous()
 
     def check(self, token_type: TokenType) -> bool:
-        if self.is_at_end():
-            return False
-        return self.peek().type == token_type
+        current_type = self.types[self.current]
+        return current_type == token_type and current_type != TokenType.EOF
 
     def is_at_end(self):
-        return self.peek().type == TokenType.EOF
+        return self.types[self.current] == TokenType.EOF
 
     def peek(self) -> Token:
         return self.tokens[self.current]
@@ -335,3 +428,37 @@ class Parser:
     def previous(self) -> Token:
         assert self.current > 0
         return self.tokens[self.current - 1]
+
+
+# Parse functions for tokens that can start an expression.
+_PREFIX_RULES = {
+    TokenType.FALSE: Parser.literal_false,
+    TokenType.TRUE: Parser.literal_true,
+    TokenType.NIL: Parser.literal_nil,
+    TokenType.NUMBER: Parser.literal,
+    TokenType.STRING: Parser.literal,
+    TokenType.IDENTIFIER: Parser.variable,
+    TokenType.THIS: Parser.this,
+    TokenType.LEFT_PAREN: Parser.grouping,
+    TokenType.BANG: Parser.unary,
+    TokenType.MINUS: Parser.unary,
+}
+
+# Parse functions and precedences for tokens that can follow an expression.
+_INFIX_RULES = {
+    TokenType.EQUAL: (Parser.assignment, Precedence.ASSIGNMENT),
+    TokenType.OR: (Parser.logical, Precedence.OR),
+    TokenType.AND: (Parser.logical, Precedence.AND),
+    TokenType.BANG_EQUAL: (Parser.binary, Precedence.EQUALITY),
+    TokenType.EQUAL_EQUAL: (Parser.binary, Precedence.EQUALITY),
+    TokenType.GREATER: (Parser.binary, Precedence.COMPARISON),
+    TokenType.GREATER_EQUAL: (Parser.binary, Precedence.COMPARISON),
+    TokenType.LESS: (Parser.binary, Precedence.COMPARISON),
+    TokenType.LESS_EQUAL: (Parser.binary, Precedence.COMPARISON),
+    TokenType.MINUS: (Parser.binary, Precedence.TERM),
+    TokenType.PLUS: (Parser.binary, Precedence.TERM),
+    TokenType.SLASH: (Parser.binary, Precedence.FACTOR),
+    TokenType.STAR: (Parser.binary, Precedence.FACTOR),
+    TokenType.LEFT_PAREN: (Parser.call, Precedence.CALL),
+    TokenType.DOT: (Parser.get, Precedence.CALL),
+}
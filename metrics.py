@@ -0,0 +1,106 @@
+from typing import Dict
+
+from completion import TailCall
+from interpreter import Interpreter, LoxFunction, BoundMethod, LoxClass
+
+# The `Interpreter` methods that `enable` replaces with counting versions.
+_INSTRUMENTED = ("execute_block", "_prepare_call",
+                 "_lookup_variable", "visit_return_stmt")
+
+
+class Metrics:
+    '''
+    Counters of what an `Interpreter` did while `enable` was in effect.
+    '''
+
+    def __init__(self, interpreter: Interpreter) -> None:
+        self.interpreter = interpreter
+        # What `disable` puts back in `interpreter.jit_threshold`.
+        self.jit_threshold = interpreter.jit_threshold
+        # Environments made for function calls and blocks.
+        self.environments = 0
+        # Calls to Lox functions, methods and initializers, including tail
+        # calls, and to native functions.
+        self.function_calls = 0
+        self.native_calls = 0
+        # `return` statements run, and how many of them were tail calls.
+        self.returns = 0
+        self.tail_calls = 0
+        # Variable reads by how `_lookup_variable` resolved them.
+        self.global_lookups = 0
+        self.local_lookups = 0
+        self.instances = 0
+        self.runtime_errors = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        counters = {name: value for name, value in vars(self).items()
+                    if name not in ("interpreter", "jit_threshold")}
+        counters["quickened_sites"] = self.interpreter.quickened
+        counters["deoptimized_sites"] = self.interpreter.deoptimized
+        return counters
+
+
+def enable(interpreter: Interpreter) -> Metrics:
+    '''
+    Starts counting what `interpreter` does into a new `Metrics`, which is
+    returned and kept in `interpreter.metrics`. The counting methods are
+    installed on this instance only, so other interpreters, and this one
+    after `disable`, run the plain methods at full speed. Functions are not
+    compiled by `jit` meanwhile, since compiled code bypasses the counters.
+    '''
+    disable(interpreter)
+    metrics = interpreter.metrics = Metrics(interpreter)
+    interpreter.jit_threshold = None
+    execute_block = interpreter.execute_block
+    prepare_call = interpreter._prepare_call
+    lookup_variable = interpreter._lookup_variable
+    visit_return_stmt = interpreter.visit_return_stmt
+
+    def counting_execute_block(statements, environment):
+        metrics.environments += 1
+        return execute_block(statements, environment)
+
+    def counting_prepare_call(node):
+        callee, arguments = prepare_call(node)
+        callee_type = type(callee)
+        if callee_type is LoxFunction or callee_type is BoundMethod:
+            metrics.function_calls += 1
+        elif callee_type is LoxClass:
+            metrics.instances += 1
+            if "init" in callee.methods:
+                metrics.function_calls += 1
+        else:
+            metrics.native_calls += 1
+        return callee, arguments
+
+    def counting_lookup_variable(name, expr):
+        if expr.depth is None:
+            metrics.global_lookups += 1
+        else:
+            metrics.local_lookups += 1
+        return lookup_variable(name, expr)
+
+    def counting_visit_return_stmt(node):
+        completion = visit_return_stmt(node)
+        metrics.returns += 1
+        if type(completion) is TailCall:
+            metrics.tail_calls += 1
+        return completion
+
+    interpreter.execute_block = counting_execute_block
+    interpreter._prepare_call = counting_prepare_call
+    interpreter._lookup_variable = counting_lookup_variable
+    interpreter.visit_return_stmt = counting_visit_return_stmt
+    return metrics
+
+
+def disable(interpreter: Interpreter) -> None:
+    '''
+    Stops counting and puts the plain methods back, and the JIT threshold
+    that was in effect before `enable`.
+    '''
+    for name in _INSTRUMENTED:
+        interpreter.__dict__.pop(name, None)
+    if interpreter.metrics is not None:
+        interpreter.jit_threshold = interpreter.metrics.jit_threshold
+    interpreter.metrics = None
@@ -0,0 +1,218 @@
+import expressions
+import statements
+from tokens import TokenType
+from typing import List, Any
+
+
+def _is_true(value: Any) -> bool:
+    return value is not None and value is not False
+
+
+def _is_equal(a: Any, b: Any) -> bool:
+    if a is None and b is None:
+        return True
+    if a is None or b is None:
+        return False
+    return a == b
+
+
+def _declares(stmt: statements.Stmt) -> bool:
+    '''
+    Whether `stmt` is a declaration made directly in the enclosing scope, which
+    the resolver has already bound names to even if it never runs.
+    '''
+    return isinstance(stmt, (statements.Function, statements.Class))
+
+
+# Binary operators that only accept two numbers, and how to fold them.
+_NUMBER_OPERATORS = {
+    TokenType.MINUS: lambda a, b: a - b,
+    TokenType.STAR: lambda a, b: a * b,
+    TokenType.SLASH: lambda a, b: a / b,
+    TokenType.GREATER: lambda a, b: a > b,
+    TokenType.GREATER_EQUAL: lambda a, b: a >= b,
+    TokenType.LESS: lambda a, b: a < b,
+    TokenType.LESS_EQUAL: lambda a, b: a <= b,
+}
+
+
+class Optimizer(expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Simplifies a resolved AST before it runs:
+
+    - constant subexpressions are folded into a single `Literal`,
+    - `Grouping` wrappers are dropped,
+    - `and`/`or` with a constant left operand are reduced to one side,
+    - `If` statements with a constant condition keep only the branch taken, and
+      `while (false)` loops and constant expression statements are removed.
+
+    Anything that would raise at run time, such as `1 + "a"`, is left in
+    place, so the error is still reported from the same token. The pass runs
+    after the `Resolver`, so static errors in removed code are still reported
+    and slot annotations stay valid.
+    '''
+
+    def optimize(self, stmts: List[statements.Stmt]) -> List[statements.Stmt]:
+        result = []
+        for statement in stmts:
+            statement = self.optimize_stmt(statement)
+            if statement is not None:
+                result.append(statement)
+        return result
+
+    def optimize_stmt(self, stmt: statements.Stmt) -> statements.Stmt:
+        '''
+        Returns the simplified statement, or None if it does nothing.
+        '''
+        return stmt.accept(self)
+
+    def optimize_expr(self, expr: expressions.Expr) -> expressions.Expr:
+        return expr.accept(self)
+
+    # Statements
+    def visit_expression_stmt(self, node: statements.Expression):
+        node.expression = self.optimize_expr(node.expression)
+        if isinstance(node.expression, expressions.Literal):
+            return None
+        return node
+
+    def visit_print_stmt(self, node: statements.Print):
+        node.expression = self.optimize_expr(node.expression)
+        return node
+
+    def visit_var_stmt(self, node: statements.Var):
+        if node.initializer is not None:
+            node.initializer = self.optimize_expr(node.initializer)
+        return node
+
+    def visit_function_stmt(self, node: statements.Function):
+        node.body = self.optimize(node.body)
+        return node
+
+    def visit_class_stmt(self, node: statements.Class):
+        for method in node.methods:
+            self.optimize_stmt(method)
+        return node
+
+    def visit_return_stmt(self, node: statements.Return):
+        if node.value is not None:
+            node.value = self.optimize_expr(node.value)
+        return node
+
+    def visit_block_stmt(self, node: statements.Block):
+        node.statements = self.optimize(node.statements)
+        return node
+
+    def visit_if_stmt(self, node: statements.If):
+        node.condition = self.optimize_expr(node.condition)
+        node.then_branch = self.optimize_branch(node.then_branch)
+        if node.else_branch is not None:
+            node.else_branch = self.optimize_branch(node.else_branch)
+        if isinstance(node.condition, expressions.Literal):
+            taken, dropped = node.then_branch, node.else_branch
+            if not _is_true(node.condition.value):
+                taken, dropped = dropped, taken
+            if not _declares(dropped):
+                return taken
+        return node
+
+    def visit_while_stmt(self, node: statements.While):
+        node.condition = self.optimize_expr(node.condition)
+        node.body = self.optimize_branch(node.body)
+        if isinstance(node.condition, expressions.Literal) and not _is_true(node.condition.value) \
+                and not _declares(node.body):
+            return None
+        return node
+
+    # Expressions
+    def visit_literal_expr(self, node: expressions.Literal):
+        return node
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        return node
+
+    def visit_this_expr(self, node: expressions.This):
+        return node
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        return self.optimize_expr(node.expression)
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        node.value = self.optimize_expr(node.value)
+        return node
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        node.left = self.optimize_expr(node.left)
+        node.right = self.optimize_expr(node.right)
+        if not isinstance(node.left, expressions.Literal):
+            return node
+        # `or` yields a truthy left operand and `and` a falsey one; otherwise
+        # the result is whatever the right operand evaluates to.
+        if _is_true(node.left.value) == (node.operator.type == TokenType.OR):
+            return node.left
+        return node.right
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        node.right = self.optimize_expr(node.right)
+        if not isinstance(node.right, expressions.Literal):
+            return node
+        value = node.right.value
+        if node.operator.type == TokenType.BANG:
+            return expressions.Literal(not _is_true(value))
+        if node.operator.type == TokenType.MINUS and isinstance(value, float):
+            return expressions.Literal(-value)
+        return node
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        node.left = self.optimize_expr(node.left)
+        node.right = self.optimize_expr(node.right)
+        if not isinstance(node.left, expressions.Literal) or not isinstance(node.right, expressions.Literal):
+            return node
+        left = node.left.value
+        right = node.right.value
+
+        node_type = node.operator.type
+        if node_type == TokenType.EQUAL_EQUAL:
+            return expressions.Literal(_is_equal(left, right))
+        if node_type == TokenType.BANG_EQUAL:
+            return expressions.Literal(not _is_equal(left, right))
+        if node_type == TokenType.PLUS:
+            if (isinstance(left, float) and isinstance(right, float)) or \
+                    (isinstance(left, str) and isinstance(right, str)):
+                return expressions.Literal(left + right)
+            return node
+
+        fold = _NUMBER_OPERATORS.get(node_type)
+        if fold is None or not isinstance(left, float) or not isinstance(right, float):
+            return node
+        if node_type == TokenType.SLASH and right == 0:
+            # Leave division by zero to the engine.
+            return node
+        return expressions.Literal(fold(left, right))
+
+    def visit_call_expr(self, node: expressions.Call):
+        node.callee = self.optimize_expr(node.callee)
+        node.arguments = [self.optimize_expr(argument)
+                          for argument in node.arguments]
+        return node
+
+    def visit_get_expr(self, node: expressions.Get):
+        node.object = self.optimize_expr(node.object)
+        return node
+
+    def visit_set_expr(self, node: expressions.Set):
+        node.object = self.optimize_expr(node.object)
+        node.value = self.optimize_expr(node.value)
+        return node
+
+    # Helpers
+    def optimize_branch(self, stmt: statements.Stmt) -> statements.Stmt:
+        '''
+        Like `optimize_stmt`, but a removed statement becomes an empty block
+        since the branch must still hold a statement.
+        '''
+        stmt = self.optimize_stmt(stmt)
+        if stmt is None:
+            stmt = statements.Block([])
+            stmt.scope_size = 0
+        return stmt
@@ -0,0 +1,158 @@
+import collections
+import signal
+import sys
+from typing import List, Tuple, Optional, Any
+
+import expressions
+import statements
+from tokens import Token
+from interpreter import LoxFunction
+from closure_compiler import CompiledFunction
+import vm
+
+# Seconds of CPU time between samples.
+INTERVAL = 0.005
+
+# Name of the top-level code in reports, as the VM calls it.
+SCRIPT = "script"
+
+
+# Code objects of the trampolines that run Lox functions, and of the VM loop.
+_CALL_CODES = {LoxFunction.call.__code__, CompiledFunction.call.__code__}
+_VM_RUN_CODE = vm.VM.run.__code__
+
+
+def _node_line(node: Any) -> Optional[int]:
+    '''
+    The line of the first token in `node`, looking into its children for
+    nodes such as `If` and `Block` that have no token of their own.
+    '''
+    children = []
+    for field in node.__slots__:
+        value = getattr(node, field)
+        if type(value) is Token:
+            return value.line
+        if isinstance(value, (expressions.Expr, statements.Stmt)):
+            children.append(value)
+        elif type(value) is list and value:
+            children.append(value[0])
+    for child in children:
+        if isinstance(child, (expressions.Expr, statements.Stmt)):
+            line = _node_line(child)
+            if line is not None:
+                return line
+    return None
+
+
+def _line_of(frame) -> Optional[int]:
+    '''
+    The source line a Python frame of an engine is working on, from a token
+    or AST node among its locals, or None if it has neither.
+    '''
+    for value in frame.f_locals.values():
+        if type(value) is Token:
+            return value.line
+        if isinstance(value, (expressions.Expr, statements.Stmt)):
+            line = _node_line(value)
+            if line is not None:
+                return line
+    return None
+
+
+def _vm_frames(frame) -> List[Tuple[str, Optional[int]]]:
+    '''
+    The Lox frames of one `VM.run` activation, innermost first.
+    '''
+    local = frame.f_locals
+    result = []
+    for closure, ip in [(local["closure"], local["ip"])] + \
+            [(entry[0], entry[1]) for entry in reversed(local["frames"])]:
+        lines = closure.proto.chunk.lines
+        result.append((closure.proto.name, lines[max(ip - 1, 0)] if lines else None))
+    return result
+
+
+class Profiler:
+    '''
+    Samples whichever engine is running on a CPU-time timer and attributes
+    each sample to the stack of Lox functions, and their lines, that were
+    active. Only works where `signal.setitimer` does.
+    '''
+
+    def __init__(self, interval: float = INTERVAL) -> None:
+        self.interval = interval
+        # Number of samples per stack, outermost frame first.
+        self.stacks = collections.Counter()
+        self._previous_handler = None
+
+    def start(self) -> None:
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        line = None
+        in_vm = False
+        while frame is not None:
+            code = frame.f_code
+            if code in _CALL_CODES:
+                local = frame.f_locals
+                # `function` is only bound once the trampoline has started.
+                function = local.get("function", local["self"])
+                stack.append((function.declaration.name.lexeme, line))
+                line = None
+            elif code is _VM_RUN_CODE:
+                # The VM keeps its own frames, down to the script.
+                stack.extend(_vm_frames(frame))
+                in_vm = True
+            elif line is None and not in_vm:
+                line = _line_of(frame)
+            frame = frame.f_back
+        if not in_vm:
+            stack.append((SCRIPT, line))
+        self.stacks[tuple(reversed(stack))] += 1
+
+    def report(self, file=sys.stderr) -> None:
+        '''
+        Prints a flat profile, of the function and line each sample was taken
+        in, and a cumulative one, of the functions on the stack.
+        '''
+        total = sum(self.stacks.values())
+        print(f"Profile: {total} samples, one per {self.interval * 1000:g} ms of CPU time",
+              file=file)
+        if total == 0:
+            return
+        flat = collections.Counter()
+        cumulative = collections.Counter()
+        for stack, count in self.stacks.items():
+            flat[stack[-1]] += count
+            for name in {name for name, _ in stack}:
+                cumulative[name] += count
+
+        print("\nFlat:", file=file)
+        print(f"{'samples':>9} {'%':>6}  function (line)", file=file)
+        for (name, line), count in flat.most_common():
+            where = name if line is None else f"{name} (line {line})"
+            print(f"{count:>9} {100 * count / total:>5.1f}%  {where}", file=file)
+
+        print("\nCumulative:", file=file)
+        print(f"{'samples':>9} {'%':>6}  function", file=file)
+        for name, count in cumulative.most_common():
+            print(f"{count:>9} {100 * count / total:>5.1f}%  {name}", file=file)
+
+    def write_collapsed(self, path: str) -> None:
+        '''
+        Writes the samples in the collapsed-stack format that flame graph
+        tools read: one `frame;frame;frame count` line per distinct stack.
+        '''
+        lines = []
+        for stack, count in self.stacks.items():
+            frames = ";".join(name if line is None else f"{name}:{line}"
+                              for name, line in stack)
+            lines.append(f"{frames} {count}\n")
+        with open(path, "w") as f:
+            f.writelines(sorted(lines))
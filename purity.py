@@ -0,0 +1,238 @@
+import collections
+import expressions
+import statements
+from typing import List, Any
+from loop_optimizer import BindingAnalyzer
+
+# Returned by `Memo.lookup` when there is no entry, since nil is a valid result.
+MISSING = object()
+
+
+def memo_key(args: List[Any]) -> tuple:
+    '''
+    The `Memo` key for a call with `args`. Python has `true == 1` and
+    `-0 == 0`, which Lox functions can tell apart (`1 / -0` is `-inf`), so
+    booleans and zeros are keyed by their type and spelling instead.
+    '''
+    key = tuple(args)
+    for arg in key:
+        if type(arg) is bool or arg == 0:
+            return tuple((type(a), repr(a)) if type(a) is bool or a == 0 else a
+                         for a in key)
+    return key
+
+
+class Memo:
+    '''
+    The results of one pure function, keyed by `memo_key`. Holds at most
+    `size` entries and evicts the least recently used one.
+    '''
+    __slots__ = ("function", "size", "entries", "hits", "misses")
+
+    def __init__(self, function: statements.Function, size: int) -> None:
+        self.function = function
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: tuple) -> Any:
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            return entries[key]
+        self.misses += 1
+        return MISSING
+
+    def store(self, key: tuple, value: Any) -> None:
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def __str__(self) -> str:
+        name = self.function.name
+        return (f"{name.lexeme} (line {name.line}): {self.hits} hits, "
+                f"{self.misses} misses, {len(self.entries)} cached")
+
+
+class PurityAnalyzer(expressions.ExprVisitor, statements.StmtVisitor):
+    '''
+    Finds the functions of a whole program whose result only depends on their
+    arguments. A function is pure if it
+
+    - does not print, declare functions or classes, or use properties,
+    - only assigns its own variables,
+    - only reads its own variables and global functions that are declared
+      once and never assigned, and
+    - only calls such global functions that are pure as well, which rules out
+      `clock`.
+
+    Methods are never pure. Built on the `Resolver`'s annotations, through the
+    bindings `loop_optimizer` recovers from them.
+    '''
+
+    def __init__(self) -> None:
+        self.bindings = BindingAnalyzer()
+        self.keys = self.bindings.keys
+        # The function being checked, or None while looking for functions.
+        self.function = None
+        self.pure = True
+        self.callees = set()
+        self.pending: List[statements.Function] = []
+        self.global_functions = collections.defaultdict(list)
+        # Global functions that are declared once and never assigned, by key.
+        self.fixed = {}
+        # Functions that are pure if their callees are.
+        self.candidates = {}
+
+    def analyze(self, stmts: List[statements.Stmt]) -> List[statements.Function]:
+        '''
+        Returns the pure functions declared anywhere in `stmts`.
+        '''
+        self.bindings.analyze(stmts)
+        for statement in stmts:
+            statement.accept(self)
+        for key, functions in self.global_functions.items():
+            binding = self.bindings.bindings[key]
+            if len(binding.values) == 1 and not binding.assigned_in:
+                self.fixed[key] = functions[0]
+
+        # Checking a function can add the functions nested in it.
+        for function in self.pending:
+            self.check_function(function)
+
+        # A function stops being pure when one of its callees does.
+        pure = set(self.candidates)
+        changed = True
+        while changed:
+            changed = False
+            for function in list(pure):
+                if not self.candidates[function] <= pure:
+                    pure.discard(function)
+                    changed = True
+        return [function for function in self.candidates if function in pure]
+
+    def check_function(self, node: statements.Function) -> None:
+        self.function, self.pure, self.callees = node, True, set()
+        for statement in node.body:
+            statement.accept(self)
+        if self.pure:
+            self.candidates[node] = self.callees
+        self.function = None
+
+    def check(self, expr: expressions.Expr) -> None:
+        if self.function is not None:
+            expr.accept(self)
+
+    def is_own(self, key: tuple) -> bool:
+        binding = self.bindings.bindings.get(key)
+        return binding is not None and binding.function is self.function
+
+    # Statements
+    def visit_function_stmt(self, node: statements.Function):
+        if self.function is not None:
+            # Each call would make a new closure.
+            self.pure = False
+        elif node.slot is None:
+            self.global_functions[self.keys[id(node)]].append(node)
+        self.pending.append(node)
+
+    def visit_class_stmt(self, node: statements.Class):
+        if self.function is not None:
+            self.pure = False
+            return
+        # Methods are not candidates, but functions declared in them are.
+        for method in node.methods:
+            for statement in method.body:
+                statement.accept(self)
+
+    def visit_var_stmt(self, node: statements.Var):
+        if node.initializer is not None:
+            self.check(node.initializer)
+
+    def visit_block_stmt(self, node: statements.Block):
+        for statement in node.statements:
+            statement.accept(self)
+
+    def visit_expression_stmt(self, node: statements.Expression):
+        self.check(node.expression)
+
+    def visit_print_stmt(self, node: statements.Print):
+        self.pure = False
+
+    def visit_return_stmt(self, node: statements.Return):
+        if node.value is not None:
+            self.check(node.value)
+
+    def visit_if_stmt(self, node: statements.If):
+        self.check(node.condition)
+        node.then_branch.accept(self)
+        if node.else_branch is not None:
+            node.else_branch.accept(self)
+
+    def visit_while_stmt(self, node: statements.While):
+        self.check(node.condition)
+        node.body.accept(self)
+
+    # Expressions
+    def visit_literal_expr(self, node: expressions.Literal):
+        pass
+
+    def visit_variable_expr(self, node: expressions.Variable):
+        key = self.keys[id(node)]
+        if not self.is_own(key) and key not in self.fixed:
+            self.pure = False
+
+    def visit_assign_expr(self, node: expressions.Assign):
+        if not self.is_own(self.keys[id(node)]):
+            self.pure = False
+        node.value.accept(self)
+
+    def visit_call_expr(self, node: expressions.Call):
+        callee = node.callee
+        function = None
+        if type(callee) is expressions.Variable:
+            function = self.fixed.get(self.keys[id(callee)])
+        if function is None:
+            self.pure = False
+        else:
+            self.callees.add(function)
+        for argument in node.arguments:
+            argument.accept(self)
+
+    def visit_binary_expr(self, node: expressions.Binary):
+        node.left.accept(self)
+        node.right.accept(self)
+
+    def visit_logical_expr(self, node: expressions.Logical):
+        node.left.accept(self)
+        node.right.accept(self)
+
+    def visit_unary_expr(self, node: expressions.Unary):
+        node.right.accept(self)
+
+    def visit_grouping_expr(self, node: expressions.Grouping):
+        node.expression.accept(self)
+
+    def visit_get_expr(self, node: expressions.Get):
+        self.pure = False
+
+    def visit_set_expr(self, node: expressions.Set):
+        self.pure = False
+
+    def visit_this_expr(self, node: expressions.This):
+        self.pure = False
+
+
+def memoize_pure_functions(stmts: List[statements.Stmt], size: int) -> List[Memo]:
+    '''
+    Gives every pure function in the whole program `stmts` a `Memo` of `size`
+    entries, which the engines consult when it is called. Returns the memos.
+    '''
+    memos = []
+    for function in PurityAnalyzer().analyze(stmts):
+        function.memo = Memo(function, size)
+        memos.append(function.memo)
+    return memos
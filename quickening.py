@@ -0,0 +1,142 @@
+import expressions
+from tokens import TokenType
+
+# How many evaluations with the same kind of operands a site needs before the
+# `Interpreter` specializes it.
+QUICKEN_THRESHOLD = 8
+
+# `feedback` of a site that stays generic, because it has seen operands it
+# cannot specialize for or a specialization of it has been deoptimized.
+GENERIC = False
+
+
+# Specialized nodes. The `Interpreter` switches the class of a warmed-up
+# `Binary` or `Unary` node to one of these; each evaluates its operator for
+# one kind of operands behind a type guard and switches the node back on a
+# miss. They add no fields, so the switch is a plain `__class__` assignment.
+class FloatAdd(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_add(self)
+
+
+class StringConcat(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_string_concat(self)
+
+
+class FloatSubtract(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_subtract(self)
+
+
+class FloatMultiply(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_multiply(self)
+
+
+class FloatDivide(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_divide(self)
+
+
+class FloatLess(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_less(self)
+
+
+class FloatLessEqual(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_less_equal(self)
+
+
+class FloatGreater(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_greater(self)
+
+
+class FloatGreaterEqual(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_greater_equal(self)
+
+
+class FloatEqual(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_equal(self)
+
+
+class FloatNotEqual(expressions.Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_not_equal(self)
+
+
+class FloatNegate(expressions.Unary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_float_negate(self)
+
+
+class BoolNot(expressions.Unary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_bool_not(self)
+
+
+# The specialized class for a `Binary` node, by operator and operand types.
+BINARY = {
+    (TokenType.PLUS, float, float): FloatAdd,
+    (TokenType.PLUS, str, str): StringConcat,
+    (TokenType.MINUS, float, float): FloatSubtract,
+    (TokenType.STAR, float, float): FloatMultiply,
+    (TokenType.SLASH, float, float): FloatDivide,
+    (TokenType.LESS, float, float): FloatLess,
+    (TokenType.LESS_EQUAL, float, float): FloatLessEqual,
+    (TokenType.GREATER, float, float): FloatGreater,
+    (TokenType.GREATER_EQUAL, float, float): FloatGreaterEqual,
+    (TokenType.EQUAL_EQUAL, float, float): FloatEqual,
+    (TokenType.BANG_EQUAL, float, float): FloatNotEqual,
+}
+
+# The specialized class for a `Unary` node, by operator and operand type.
+UNARY = {
+    (TokenType.MINUS, float): FloatNegate,
+    (TokenType.BANG, bool): BoolNot,
+}
+
+
+def observe(node: expressions.Expr, quick: type) -> bool:
+    '''
+    Records that `node` was evaluated with operands that `quick` (None if
+    nothing) specializes for. Returns True once `node` should become `quick`.
+    Only sites that have seen a single kind of operands are specialized.
+    '''
+    feedback = node.feedback
+    if quick is None or (feedback is not None and feedback[0] is not quick):
+        node.feedback = GENERIC
+        return False
+    count = 1 if feedback is None else feedback[1] + 1
+    node.feedback = (quick, count)
+    return count >= QUICKEN_THRESHOLD
@@ -3,26 +3,40 @@ import statements
 from tokens import TokenType, Token
 from typing import List, Any
 import dataclasses
+import enum
 from runtime_error import RuntimeError
-from return_exception import ReturnException
-from environment import Environment
+from environment import GlobalEnvironment
 
 
 @dataclasses.dataclass
 class Scope:
     mapping: dict
     is_function: bool
+    # Slot index of every variable declared in this scope.
+    slots: dict = dataclasses.field(default_factory=dict)
+
+
+class FunctionType(enum.Enum):
+    NONE = enum.auto()
+    FUNCTION = enum.auto()
+    # Methods take the instance as `this` in slot 0, before the parameters.
+    METHOD = enum.auto()
+    INITIALIZER = enum.auto()
 
 
 class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
-    def __init__(self):
+    def __init__(self, globals: GlobalEnvironment = None):
         self.scopes = []
-        self.resolutions = {}
+        self.current_function = FunctionType.NONE
+        # Number of class bodies enclosing the code being resolved.
+        self.class_depth = 0
+        # Unresolved names are interned into this table as global slots.
+        self.globals = globals if globals is not None else GlobalEnvironment()
 
     def visit_block_stmt(self, node: statements.Block):
         self.begin_scope()
-        self.resolve(node.statements)
-        self.end_scope()
+        self.resolve_stmts(node.statements)
+        node.scope_size = len(self.end_scope().slots)
 
     def resolve_stmts(self, statements: List[statements.Stmt]):
         for statement in statements:
@@ -40,12 +54,12 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
             len(self.scopes) > 0 and self.scopes[-1].is_function)
         self.scopes.append(Scope(mapping={}, is_function=is_function))
 
-    def end_scope(self):
-        self.scopes.pop()
+    def end_scope(self) -> Scope:
+        return self.scopes.pop()
 
     # Statements
     def visit_var_stmt(self, node: statements.Var):
-        self.declare(node.name)
+        self.declare_node(node)
         if node.initializer is not None:
             self.resolve_expr(node.initializer)
 
@@ -62,7 +76,7 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
             self.resolve_stmt(node.else_branch)
 
     def visit_function_stmt(self, node: statements.Function):
-        self.declare(node.name)
+        self.declare_node(node)
         self.define(node.name)
 
         self.resolve_function(node)
@@ -82,13 +96,24 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
             raise RuntimeError(
                 node.keyword, "Cannot return from top-level code.")
         if node.value is not None:
+            if self.current_function == FunctionType.INITIALIZER:
+                raise RuntimeError(
+                    node.keyword, "Cannot return a value from an initializer.")
             self.resolve_expr(node.value)
         return None
 
     def visit_class_stmt(self, node: statements.Class):
-        self.declare(node.name)
+        self.declare_node(node)
         self.define(node.name)
 
+        self.class_depth += 1
+        for method in node.methods:
+            kind = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                kind = FunctionType.INITIALIZER
+            self.resolve_function(method, kind)
+        self.class_depth -= 1
+
     # Expressions
 
     def visit_binary_expr(self, node: expressions.Binary):
@@ -104,6 +129,13 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
         self.resolve_expr(node.object)
         return None
 
+    def visit_this_expr(self, node: expressions.This):
+        if self.class_depth == 0:
+            raise RuntimeError(
+                node.keyword, "Cannot use 'this' outside of a class.")
+        self.resolve_local(node, node.keyword)
+        return None
+
     def visit_set_expr(self, node: expressions.Set):
         self.resolve_expr(node.value)
         self.resolve_expr(node.object)
@@ -129,7 +161,7 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
 
     def visit_variable_expr(self, node: expressions.Variable):
         if (len(self.scopes) > 0 and
-                self.scopes[-1].mapping[node.name.lexeme] == False):
+                self.scopes[-1].mapping.get(node.name.lexeme) == False):
             raise RuntimeError(
                 node.name, "Cannot read local variable in its own initializer.")
 
@@ -137,14 +169,25 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
         return None
 
     # Helpers
-    def declare(self, name: Token):
+    def declare(self, name: Token) -> int:
+        '''
+        Declares `name` in the innermost scope and returns its slot index, or
+        None for globals.
+        '''
         if not self.scopes:
-            return
+            return None
         scope = self.scopes[-1]
         if name.lexeme in scope.mapping:
             raise RuntimeError(
                 name, "Variable with this name already declared in this scope.")
         scope.mapping[name.lexeme] = False
+        scope.slots[name.lexeme] = len(scope.slots)
+        return scope.slots[name.lexeme]
+
+    def declare_node(self, node: statements.Stmt):
+        node.slot = self.declare(node.name)
+        if node.slot is None:
+            node.global_slot = self.globals.intern(node.name.lexeme)
 
     def define(self, name: Token):
         if not self.scopes:
@@ -154,18 +197,28 @@ class Resolver(expressions.ExprVisitor, statements.StmtVisitor):
 
     def resolve_local(self, expr: expressions.Expr, name: Token):
         for i in range(len(self.scopes)):
-            scope = self.scopes[len(self.scopes) - 1 - i].mapping
-            if name.lexeme in scope:
-                self.add_resolve_result(expr, i)
+            scope = self.scopes[len(self.scopes) - 1 - i]
+            if name.lexeme in scope.mapping:
+                self.add_resolve_result(expr, i, scope.slots[name.lexeme])
                 return
+        expr.global_slot = self.globals.intern(name.lexeme)
 
-    def add_resolve_result(self, expr: expressions.Expr, depth: int):
-        self.resolutions[expr] = depth
+    def add_resolve_result(self, expr: expressions.Expr, depth: int, slot: int):
+        expr.depth = depth
+        expr.slot = slot
 
-    def resolve_function(self, function: statements.Function):
+    def resolve_function(self, function: statements.Function,
+                         kind: FunctionType = FunctionType.FUNCTION):
+        enclosing_function = self.current_function
+        self.current_function = kind
         self.begin_scope(True)
+        if kind != FunctionType.FUNCTION:
+            scope = self.scopes[-1]
+            scope.mapping["this"] = True
+            scope.slots["this"] = 0
         for param in function.params:
             self.declare(param)
             self.define(param)
         self.resolve_stmts(function.body)
-        self.end_scope()
+        function.scope_size = len(self.end_scope().slots)
+        self.current_function = enclosing_function
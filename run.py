@@ -1,22 +1,90 @@
 import argparse
+import contextlib
+import copy
+import math
+import statistics
+import time
+import mmap
+import os
 import sys
 
-from scanner import Scanner, ErrorFrame
+from scanner import Scanner, RegexScanner, StreamingScanner, ErrorFrame
 from lox_parser import Parser
 import ast_printer
+import ast_cache
+import optimizer
+import loop_optimizer
+import purity
+import profiler
+import metrics
+import tracing
+import json
 import interpreter
+import vm
+import closure_compiler
 
 
 class Runner:
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, engine="interpreter", scanner="loop", streaming=False,
+                 cache=False, cache_dir=None, optimize=False, memoize=None,
+                 quicken_stats=False, profile_stacks=None, stats=False,
+                 trace_path=None, trace_events=tracing.CAPACITY, jit=True):
         self.has_error = False
-        self.interpreter = interpreter.Interpreter()
+        # Records the phases of the run, and calls of Lox functions, when
+        # `trace_path` names the trace file to write.
+        self.trace_path = trace_path
+        self.tracer = tracing.Tracer(trace_events) if trace_path is not None else None
+        # Seconds spent in each phase of the run, when `bench_file` sets it to
+        # a dict.
+        self.phase_times = None
+        # Samples the program while it runs when `profile_stacks` names the
+        # collapsed-stack file to write.
+        self.profile_stacks = profile_stacks
+        self.profiler = profiler.Profiler() if profile_stacks is not None else None
+        self.quicken_stats = quicken_stats
+        self.optimize = optimize
+        # Entries per memoized function, or None to not memoize.
+        self.memoize = memoize
+        self.memos = []
+        self.streaming = streaming
+        self.cache = cache or cache_dir is not None
+        self.cache_dir = cache_dir
+        self.scanner_class = Scanner if scanner == "loop" else RegexScanner
+        self.token_stream = scanner == "stream"
+        if engine == "vm":
+            self.interpreter = vm.VM(verbose)
+        elif engine == "closure":
+            self.interpreter = closure_compiler.ClosureInterpreter()
+        else:
+            self.interpreter = interpreter.Interpreter()
+        if not jit and type(self.interpreter) is interpreter.Interpreter:
+            self.interpreter.jit_threshold = None
+        self.metrics = metrics.enable(self.interpreter) if stats else None
+        if self.tracer is not None and isinstance(self.interpreter, interpreter.Interpreter):
+            self.interpreter.tracer = self.tracer
         self.verbose = verbose
         if self.verbose:
             print("Verbose mode enabled.")
 
     def run_file(self, filepath):
-        self._run(open(filepath).read())
+        if self.streaming:
+            with open(filepath, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._run_stream(b"")
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                        self._run_stream(buffer)
+        elif self.cache:
+            self._run_cached(open(filepath).read(),
+                             ast_cache.cache_path(filepath, self.cache_dir, self.optimize))
+        else:
+            self._run(open(filepath).read(), whole_program=True)
+        self.report_memos()
+        self.report_quickening()
+        self.report_profile()
+        self.write_trace()
+        if self.metrics is not None:
+            print(json.dumps(self.metrics.as_dict(), indent=2), file=sys.stderr)
         if self.has_error:
             sys.exit(65)
 
@@ -33,29 +101,194 @@ class Runner:
             self._run(line)
             self.had_error = False
 
-    def _run(self, source):
-        scanner = Scanner(source)
-        tokens = scanner.scan_tokens()
+    def _run(self, source, whole_program=False):
+        statements = self._parse(source)
+        if statements is None:
+            return
+        self._run_parsed(statements, whole_program)
+
+    def _run_parsed(self, statements, whole_program=False):
+        statements = self._resolve(statements, whole_program)
+        if statements is None:
+            return
+        if whole_program:
+            self._memoize(statements)
+        self._interpret(statements)
+
+    def _run_cached(self, source, cache_path):
+        '''
+        Like `_run`, but reuses the resolved AST stored at `cache_path` when it
+        was built from the same source, and stores it there otherwise.
+        '''
+        statements = ast_cache.load(
+            cache_path, source, self.interpreter.global_table, self.optimize)
+        if statements is None:
+            statements = self._parse(source)
+            if statements is None:
+                return
+            statements = self._resolve(statements, whole_program=True)
+            if statements is None:
+                return
+            ast_cache.save(cache_path, source, statements,
+                           self.interpreter.global_table, self.optimize)
+        elif self.verbose:
+            print(f"Loaded AST from {cache_path}.")
+        self._memoize(statements)
+        self._interpret(statements)
+
+    def _parse(self, source):
+        '''
+        Scans and parses `source`. Returns None after reporting any errors.
+        '''
+        scanner = self.scanner_class(source)
+        with self._phase("scan"):
+            if self.token_stream:
+                tokens = scanner.scan_token_stream()
+            else:
+                tokens = scanner.scan_tokens()
         if self.maybe_report_errors(scanner.error_frames):
             print("Exiting because of scanner errors.")
-            return
+            return None
         if self.verbose:
             print("Tokens:")
             for token in tokens:
                 print(token)
 
         parser = Parser()
-        statements = parser.parse(tokens)
+        with self._phase("parse"):
+            statements = parser.parse(tokens)
         if self.maybe_report_errors(parser.error_frames):
             print("Exiting because of parser errors.")
-            return
+            return None
         if self.verbose:
             print("AST:")
             ast_printer.print_ast(statements)
+        return statements
 
-        self.interpreter.interpret(statements)
+    def _resolve(self, statements, whole_program=False):
+        '''
+        Runs the resolver and then the optimizers over parsed `statements`.
+        `whole_program` says whether `statements` is all the code that will
+        run. Returns None after reporting any errors.
+        '''
+        with self._phase("resolve"):
+            self.interpreter.resolve(statements)
         if self.maybe_report_errors(self.interpreter.error_frames):
             print("Got interpreter errors.")
+            return None
+        with self._phase("optimize"):
+            statements = optimizer.Optimizer().optimize(statements)
+            if self.optimize:
+                statements = loop_optimizer.LoopOptimizer(
+                    whole_program).optimize(statements)
+                # The loop optimizer adds variables, so resolve the new tree.
+                self.interpreter.resolve(statements)
+            if self.maybe_report_errors(self.interpreter.error_frames):
+                print("Got interpreter errors.")
+                return None
+        return statements
+
+    def _memoize(self, statements):
+        '''
+        Enables memoization of the pure functions in the whole program
+        `statements`, if requested. Runs after the AST is cached, since the
+        memos hold run-time results.
+        '''
+        if self.memoize is not None:
+            self.memos = purity.memoize_pure_functions(
+                statements, self.memoize)
+
+    def report_memos(self):
+        if self.memoize is None:
+            return
+        print("Memoized functions:", file=sys.stderr)
+        for memo in self.memos:
+            print(f"  {memo}", file=sys.stderr)
+
+    def report_quickening(self):
+        # Only the tree-walking interpreter quickens.
+        if self.quicken_stats and type(self.interpreter) is interpreter.Interpreter:
+            print(f"Quickened {self.interpreter.quickened} operator sites, "
+                  f"deoptimized {self.interpreter.deoptimized}. Compiled "
+                  f"{self.interpreter.jitted} functions.", file=sys.stderr)
+
+    def report_profile(self):
+        if self.profiler is None:
+            return
+        self.profiler.report()
+        self.profiler.write_collapsed(self.profile_stacks)
+        print(f"Wrote collapsed stacks to {self.profile_stacks}.", file=sys.stderr)
+
+    def write_trace(self):
+        if self.tracer is None:
+            return
+        self.tracer.write(self.trace_path)
+        print(f"Wrote trace to {self.trace_path}.", file=sys.stderr)
+
+    def _phase(self, name):
+        '''
+        Records the phase `name` of the run in the trace, if there is one,
+        while the returned context is active.
+        '''
+        if self.phase_times is not None:
+            return self._timed_phase(name)
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name)
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0) + \
+                time.perf_counter() - start
+
+    def _interpret(self, statements):
+        '''
+        Runs statements that `_resolve` has accepted. Returns False if they
+        raised a runtime error.
+        '''
+        with self._phase("interpret"):
+            if self.profiler is None:
+                self.interpreter.interpret(statements, resolved=True)
+            else:
+                self.profiler.start()
+                try:
+                    self.interpreter.interpret(statements, resolved=True)
+                finally:
+                    self.profiler.stop()
+        if self.maybe_report_errors(self.interpreter.error_frames):
+            print("Got interpreter errors.")
+            return False
+        return True
+
+    def _run_stream(self, buffer):
+        '''
+        Scans, parses, resolves and executes one top-level declaration at a
+        time. Declarations before the first error have already run by the time
+        it is reported.
+        '''
+        scanner = StreamingScanner(buffer)
+        parser = Parser()
+        token_iterator = scanner.iter_tokens()
+        try:
+            for statement in parser.parse_stream(token_iterator):
+                if scanner.error_frames or parser.error_frames:
+                    # Keep parsing so that every error is reported.
+                    continue
+                resolved = self._resolve([statement])
+                if resolved is None or not self._interpret(resolved):
+                    return
+        finally:
+            # The scanner holds a view of the buffer until it is closed.
+            token_iterator.close()
+        if self.maybe_report_errors(scanner.error_frames):
+            print("Exiting because of scanner errors.")
+            return
+        if self.maybe_report_errors(parser.error_frames):
+            print("Exiting because of parser errors.")
 
     def maybe_report_errors(self, error_frames):
         if len(error_frames) > 0:
@@ -65,6 +298,103 @@ class Runner:
             return True
 
 
+class _CountingWriter:
+    '''
+    Stands in for stdout during benchmark runs, counting the lines the
+    program prints instead of writing them.
+    '''
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# The phases `bench_file` reports, by the `Runner` phase they are made of.
+BENCH_PHASES = {"scan": "scan", "parse": "parse", "resolve": "resolve",
+                "optimize": "resolve", "interpret": "execute"}
+
+
+def _percentile(values, percent):
+    '''
+    The nearest-rank `percent` percentile of `values`.
+    '''
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def bench_file(make_runner, filepath, iterations, warmup=0, reuse_ast=False):
+    '''
+    Runs the file at `filepath` `warmup` times and then `iterations` times
+    more on fresh runners from `make_runner`, and returns the wall times of
+    the measured runs, overall and by phase, and the lines each printed. With
+    `reuse_ast`, the file is scanned and parsed once and every run starts
+    from a copy of that tree. Returns None if a run reported errors.
+    '''
+    source = open(filepath).read()
+    parsed = None
+    if reuse_ast:
+        parsed = make_runner()._parse(source)
+        if parsed is None:
+            return None
+    phases = {phase: [] for phase in dict.fromkeys(BENCH_PHASES.values())}
+    totals = []
+    output = _CountingWriter()
+    for iteration in range(warmup + iterations):
+        runner = make_runner()
+        runner.phase_times = {}
+        statements = copy.deepcopy(parsed) if reuse_ast else None
+        output.lines = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            if reuse_ast:
+                runner._run_parsed(statements, whole_program=True)
+            elif runner.cache:
+                runner._run_cached(source, ast_cache.cache_path(
+                    filepath, runner.cache_dir, runner.optimize))
+            else:
+                runner._run(source, whole_program=True)
+        total = time.perf_counter() - start
+        if runner.has_error:
+            return None
+        if iteration < warmup:
+            continue
+        totals.append(total)
+        times = dict.fromkeys(phases, 0)
+        for name, seconds in runner.phase_times.items():
+            times[BENCH_PHASES[name]] += seconds
+        for phase, seconds in times.items():
+            phases[phase].append(seconds)
+    return {
+        "file": filepath,
+        "iterations": iterations,
+        "warmup": warmup,
+        "reuse_ast": reuse_ast,
+        "output_lines": output.lines,
+        "seconds": {
+            name: {"min": min(values), "median": statistics.median(values),
+                   "p95": _percentile(values, 95)}
+            for name, values in [*phases.items(), ("total", totals)]
+        },
+    }
+
+
+def report_bench(results):
+    print(f"Ran {results['file']} {results['iterations']} times after "
+          f"{results['warmup']} warmup runs" +
+          (", from one parsed tree" if results["reuse_ast"] else "") +
+          f". Each printed {results['output_lines']} lines.")
+    print(f"{'phase':<9} {'min':>10} {'median':>10} {'p95':>10}")
+    for phase, seconds in results["seconds"].items():
+        print(f"{phase:<9} " + " ".join(
+            f"{seconds[stat] * 1000:>7.2f} ms" for stat in ("min", "median", "p95")))
+
+
 def main():
     argparser = argparse.ArgumentParser(description='Run the program')
     # The argument is the path to the file to be read. The size of the argument is either 0 or 1.
@@ -75,8 +405,132 @@ def main():
     argparser.add_argument(
         '-v', '--verbose', action='store_true', help='Run in verbose mode')
 
+    # Select the execution engine: the tree-walking interpreter, the bytecode VM or
+    # the closure compiler.
+    argparser.add_argument(
+        '--engine', choices=['interpreter', 'vm', 'closure'], default='interpreter', help='The execution engine')
+
+    # Select the scanner: the character-at-a-time loop, the master regex, or the
+    # master regex producing a compact token stream.
+    argparser.add_argument(
+        '--scanner', choices=['loop', 'regex', 'stream'], default='loop', help='The scanner implementation')
+
+    # Stream a memory-mapped file through the scanner and parser, executing each
+    # top-level declaration as soon as it is parsed.
+    argparser.add_argument(
+        '--stream', action='store_true', help='Execute the file declaration by declaration')
+
+    # Cache the resolved AST in __loxcache__ next to the file, or in --cache-dir,
+    # and reuse it while the source is unchanged.
+    argparser.add_argument(
+        '--cache', action='store_true', help='Cache the parsed program on disk')
+    argparser.add_argument(
+        '--cache-dir', help='Directory for cached programs (implies --cache)')
+
+    # Enable the loop-invariant code motion and common-subexpression elimination
+    # pass.
+    argparser.add_argument(
+        '-O', '--optimize', action='store_true', help='Enable loop and subexpression optimizations')
+
+    # Cache the results of functions that provably depend only on their
+    # arguments and report the hit rates on stderr. Only applies to whole
+    # files: not to the prompt, and --stream rejects it.
+    argparser.add_argument(
+        '--memoize', action='store_true', help='Memoize pure functions')
+    argparser.add_argument(
+        '--memo-size', type=int, default=1024, metavar='N',
+        help='Results kept per memoized function (default 1024)')
+
+    # Report on stderr how many operator sites the interpreter specialized for
+    # the operand types it saw, and how many of those it had to undo.
+    argparser.add_argument(
+        '--quicken-stats', action='store_true', help='Report operator specialization')
+
+    # Sample the running program and report where the time goes by Lox function
+    # and line on stderr, writing the stacks for flame graph tools to
+    # --profile-stacks.
+    argparser.add_argument(
+        '--profile', action='store_true', help='Profile the program')
+    argparser.add_argument(
+        '--profile-stacks', default='profile.collapsed', metavar='PATH',
+        help='Collapsed-stack output of --profile (default profile.collapsed)')
+
+    # Count interpreter internals, such as environments, calls and variable
+    # lookups, and print them as JSON on stderr at exit.
+    argparser.add_argument(
+        '--stats', action='store_true', help='Print interpreter counters as JSON')
+
+    # Write a Chrome Trace Event file of the scan, parse, resolve and interpret
+    # phases and, on the tree-walking interpreter, of every Lox function call,
+    # for chrome://tracing or Perfetto. Only the last --trace-events events are
+    # kept.
+    argparser.add_argument(
+        '--trace', metavar='PATH', help='Write a timeline trace to PATH')
+    argparser.add_argument(
+        '--trace-events', type=int, default=tracing.CAPACITY, metavar='N',
+        help=f'Events kept by --trace (default {tracing.CAPACITY})')
+
+    # Keep running hot functions on the tree-walking interpreter instead of
+    # compiling them to Python.
+    argparser.add_argument(
+        '--no-jit', action='store_true', help='Do not compile hot functions')
+
+    # Run the file --bench N times on fresh interpreters, after --warmup K
+    # unmeasured runs, counting instead of printing its output, and report the
+    # wall time of each phase. --reuse-ast scans and parses the file only once.
+    argparser.add_argument(
+        '--bench', type=int, metavar='N', help='Benchmark the file over N runs')
+    argparser.add_argument(
+        '--warmup', type=int, default=0, metavar='K',
+        help='Unmeasured runs before --bench (default 0)')
+    argparser.add_argument(
+        '--reuse-ast', action='store_true', help='Parse the file once for --bench')
+    argparser.add_argument(
+        '--bench-json', action='store_true', help='Print --bench results as JSON')
+
     args = argparser.parse_args()
-    runner = Runner(args.verbose)
+    if args.trace_events < 1:
+        argparser.error("--trace-events needs at least one event")
+    if args.stats and args.engine != 'interpreter':
+        argparser.error("--stats needs --engine interpreter")
+    if args.stream and (args.memoize or args.cache or args.cache_dir):
+        argparser.error("--stream cannot be combined with --memoize or --cache")
+    if args.bench is not None:
+        if not args.file:
+            argparser.error("--bench needs a file")
+        if args.bench < 1:
+            argparser.error("--bench needs at least one run")
+        if args.stream or args.profile or args.trace or args.stats or args.verbose:
+            argparser.error("--bench cannot be combined with --stream, --profile, "
+                            "--trace, --stats or --verbose")
+        if args.reuse_ast and (args.cache or args.cache_dir):
+            argparser.error("--reuse-ast and --cache both skip parsing; pick one")
+
+        def make_runner():
+            return Runner(engine=args.engine, scanner=args.scanner, cache=args.cache,
+                          cache_dir=args.cache_dir, optimize=args.optimize,
+                          memoize=args.memo_size if args.memoize else None,
+                          jit=not args.no_jit)
+        results = bench_file(make_runner, args.file, args.bench, args.warmup,
+                             args.reuse_ast)
+        if results is None:
+            print("The program reported errors; run it without --bench to see them.",
+                  file=sys.stderr)
+            sys.exit(65)
+        if args.bench_json:
+            print(json.dumps(results, indent=2))
+        else:
+            report_bench(results)
+        return
+
+    runner = Runner(verbose=args.verbose, engine=args.engine, scanner=args.scanner,
+                    streaming=args.stream, cache=args.cache, cache_dir=args.cache_dir,
+                    optimize=args.optimize,
+                    memoize=args.memo_size if args.memoize else None,
+                    quicken_stats=args.quicken_stats,
+                    profile_stacks=args.profile_stacks if args.profile else None,
+                    stats=args.stats, trace_path=args.trace,
+                    trace_events=args.trace_events, jit=not args.no_jit)
     if args.file:
         runner.run_file(args.file)
     else:
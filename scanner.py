@@ -1,5 +1,6 @@
+import re
 import tokens
-from typing import List, Any
+from typing import List, Any, Iterator
 import dataclasses
 
 
@@ -161,3 +162,298 @@ class Scanner:
 
     def _is_at_end(self):
         return self.current >= len(self.source)
+
+
+# One alternative per token class. Leading blanks are folded into the match so
+# most tokens take a single `match` call. Only ASCII input is handled here;
+# anything else is handed to `Scanner.scan_token`.
+_TOKEN_PATTERN = re.compile(r'''
+    [ \t\r]*
+    (?:
+        (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<operator>[!=<>]=?|[(){},.\-+;*])
+      | (?P<newline>\n)
+      | (?P<number>[0-9]+(?:\.[0-9]+)?)
+      | (?P<comment>//[^\n]*)
+      | (?P<slash>/)
+      | (?P<string>"[^"]*")
+      | (?P<end>\Z)
+    )
+''', re.VERBOSE)
+
+_IDENTIFIER = _TOKEN_PATTERN.groupindex['identifier']
+_OPERATOR = _TOKEN_PATTERN.groupindex['operator']
+_NEWLINE = _TOKEN_PATTERN.groupindex['newline']
+_NUMBER = _TOKEN_PATTERN.groupindex['number']
+_SLASH = _TOKEN_PATTERN.groupindex['slash']
+_STRING = _TOKEN_PATTERN.groupindex['string']
+
+_OPERATORS = {
+    '(': tokens.TokenType.LEFT_PAREN,
+    ')': tokens.TokenType.RIGHT_PAREN,
+    '{': tokens.TokenType.LEFT_BRACE,
+    '}': tokens.TokenType.RIGHT_BRACE,
+    ',': tokens.TokenType.COMMA,
+    '.': tokens.TokenType.DOT,
+    '-': tokens.TokenType.MINUS,
+    '+': tokens.TokenType.PLUS,
+    ';': tokens.TokenType.SEMICOLON,
+    '*': tokens.TokenType.STAR,
+    '/': tokens.TokenType.SLASH,
+    '!': tokens.TokenType.BANG,
+    '!=': tokens.TokenType.BANG_EQUAL,
+    '=': tokens.TokenType.EQUAL,
+    '==': tokens.TokenType.EQUAL_EQUAL,
+    '<': tokens.TokenType.LESS,
+    '<=': tokens.TokenType.LESS_EQUAL,
+    '>': tokens.TokenType.GREATER,
+    '>=': tokens.TokenType.GREATER_EQUAL,
+}
+
+
+class RegexScanner(Scanner):
+    '''
+    Scans with a single compiled master pattern instead of one `scan_token`
+    call per character. It produces the same tokens and error frames as
+    `Scanner`, which it falls back to for characters the pattern doesn't cover.
+    '''
+
+    def scan_tokens(self) -> List[tokens.Token]:
+        source = self.source
+        append = self.tokens.append
+        Token = tokens.Token
+        keywords = tokens.KEYWORDS
+        operators = _OPERATORS
+        IDENTIFIER = tokens.TokenType.IDENTIFIER
+        NUMBER = tokens.TokenType.NUMBER
+        STRING = tokens.TokenType.STRING
+        SLASH = tokens.TokenType.SLASH
+        line = self.line
+        pos = 0
+        end = len(source)
+        # `scanner().match` continues from where the previous match ended, so
+        # the loop only has to restart it after a fallback.
+        match = _TOKEN_PATTERN.scanner(source).match
+
+        while pos < end:
+            m = match()
+            if m is None:
+                # Unterminated strings, unexpected and non-ASCII characters.
+                pos = self._scan_fallback(pos, line)
+                line = self.line
+                match = _TOKEN_PATTERN.scanner(source, pos).match
+                continue
+            kind = m.lastindex
+            text = m.group(kind)
+            if kind == _IDENTIFIER:
+                if not source[m.end():m.end() + 1].isascii():
+                    pos = self._scan_fallback(m.start(kind), line)
+                    line = self.line
+                    match = _TOKEN_PATTERN.scanner(source, pos).match
+                    continue
+                keyword = keywords.get(text)
+                if keyword is not None:
+                    append(Token(keyword, text, None, line))
+                else:
+                    append(Token(IDENTIFIER, text, text, line))
+            elif kind == _OPERATOR:
+                append(Token(operators[text], text, None, line))
+            elif kind == _NEWLINE:
+                line += 1
+            elif kind == _NUMBER:
+                if not source[m.end():m.end() + 2].isascii():
+                    pos = self._scan_fallback(m.start(kind), line)
+                    line = self.line
+                    match = _TOKEN_PATTERN.scanner(source, pos).match
+                    continue
+                append(Token(NUMBER, text, float(text), line))
+            elif kind == _STRING:
+                line += text.count('\n')
+                append(Token(STRING, text, text[1:-1], line))
+            elif kind == _SLASH:
+                append(Token(SLASH, text, None, line))
+            pos = m.end()
+
+        self.line = line
+        append(Token(tokens.TokenType.EOF, "", None, line))
+        return self.tokens
+
+    def scan_token_stream(self) -> tokens.TokenStream:
+        '''
+        Like `scan_tokens`, but records tokens as columns of a compact
+        `tokens.TokenStream` instead of creating a `Token` per token.
+        '''
+        source = self.source
+        stream = tokens.TokenStream(source)
+        add = stream.append
+        keywords = tokens.KEYWORDS
+        operators = _OPERATORS
+        IDENTIFIER = tokens.TokenType.IDENTIFIER
+        NUMBER = tokens.TokenType.NUMBER
+        STRING = tokens.TokenType.STRING
+        SLASH = tokens.TokenType.SLASH
+        line = self.line
+        pos = 0
+        end = len(source)
+        match = _TOKEN_PATTERN.scanner(source).match
+
+        while pos < end:
+            m = match()
+            if m is None:
+                pos = self._scan_fallback_into(stream, pos, line)
+                line = self.line
+                match = _TOKEN_PATTERN.scanner(source, pos).match
+                continue
+            kind = m.lastindex
+            start = m.start(kind)
+            pos = m.end()
+            if kind == _IDENTIFIER:
+                if not source[pos:pos + 1].isascii():
+                    pos = self._scan_fallback_into(stream, start, line)
+                    line = self.line
+                    match = _TOKEN_PATTERN.scanner(source, pos).match
+                    continue
+                add(keywords.get(m.group(kind), IDENTIFIER),
+                    start, pos - start, line)
+            elif kind == _OPERATOR:
+                add(operators[m.group(kind)], start, pos - start, line)
+            elif kind == _NEWLINE:
+                line += 1
+            elif kind == _NUMBER:
+                if not source[pos:pos + 2].isascii():
+                    pos = self._scan_fallback_into(stream, start, line)
+                    line = self.line
+                    match = _TOKEN_PATTERN.scanner(source, pos).match
+                    continue
+                add(NUMBER, start, pos - start, line)
+            elif kind == _STRING:
+                line += source.count('\n', start, pos)
+                add(STRING, start, pos - start, line)
+            elif kind == _SLASH:
+                add(SLASH, start, 1, line)
+
+        self.line = line
+        add(tokens.TokenType.EOF, end, 0, line)
+        return stream
+
+    def _scan_fallback_into(self, stream: tokens.TokenStream, start: int, line: int) -> int:
+        scanned = len(self.tokens)
+        current = self._scan_fallback(start, line)
+        for token in self.tokens[scanned:]:
+            stream.append(token.type, self.start, len(token.lexeme), token.line)
+        del self.tokens[scanned:]
+        return current
+
+    def _scan_fallback(self, start: int, line: int) -> int:
+        self.start = self.current = start
+        self.line = line
+        if not self._is_at_end():
+            self.scan_token()
+        return self.current
+
+
+# The master pattern over bytes, for scanning memory-mapped sources.
+_BYTES_TOKEN_PATTERN = re.compile(
+    _TOKEN_PATTERN.pattern.encode('ascii'), re.VERBOSE)
+_BLANKS = re.compile(rb'[ \t\r]*')
+_WHITESPACE = re.compile(rb'[ \t\r\n]')
+_NEWLINES = re.compile(rb'\n')
+
+
+class StreamingScanner(Scanner):
+    '''
+    Scans a bytes-like buffer, typically a memory-mapped file, and yields
+    tokens one at a time instead of building a list, so only the tokens the
+    parser is looking at are alive. It matches `RegexScanner` token for token;
+    line endings are not translated, so sources should use '\\n'.
+    '''
+
+    def __init__(self, buffer) -> None:
+        super().__init__("")
+        self.buffer = buffer
+
+    def iter_tokens(self) -> Iterator[tokens.Token]:
+        buffer = self.buffer
+        Token = tokens.Token
+        keywords = tokens.KEYWORDS
+        operators = _OPERATORS
+        IDENTIFIER = tokens.TokenType.IDENTIFIER
+        NUMBER = tokens.TokenType.NUMBER
+        STRING = tokens.TokenType.STRING
+        SLASH = tokens.TokenType.SLASH
+        line = self.line
+        pos = 0
+        end = len(buffer)
+        match = _BYTES_TOKEN_PATTERN.scanner(buffer).match
+
+        while pos < end:
+            m = match()
+            if m is None:
+                fallback_tokens, pos = self._scan_fallback_bytes(pos, line)
+                yield from fallback_tokens
+                line = self.line
+                match = _BYTES_TOKEN_PATTERN.scanner(buffer, pos).match
+                continue
+            kind = m.lastindex
+            if kind == _IDENTIFIER or kind == _NUMBER:
+                pos = m.end()
+                if buffer[pos:pos + 2].isascii():
+                    text = m.group(kind).decode('ascii')
+                    if kind == _NUMBER:
+                        yield Token(NUMBER, text, float(text), line)
+                        continue
+                    keyword = keywords.get(text)
+                    if keyword is not None:
+                        yield Token(keyword, text, None, line)
+                    else:
+                        yield Token(IDENTIFIER, text, text, line)
+                    continue
+                # The token continues with non-ASCII characters.
+                fallback_tokens, pos = self._scan_fallback_bytes(
+                    m.start(kind), line)
+                yield from fallback_tokens
+                line = self.line
+                match = _BYTES_TOKEN_PATTERN.scanner(buffer, pos).match
+                continue
+            pos = m.end()
+            if kind == _OPERATOR:
+                text = m.group(kind).decode('ascii')
+                yield Token(operators[text], text, None, line)
+            elif kind == _NEWLINE:
+                line += 1
+            elif kind == _STRING:
+                text = m.group(kind).decode('utf-8')
+                line += text.count('\n')
+                yield Token(STRING, text, text[1:-1], line)
+            elif kind == _SLASH:
+                yield Token(SLASH, '/', None, line)
+
+        self.line = line
+        yield Token(tokens.TokenType.EOF, "", None, line)
+
+    def _scan_fallback_bytes(self, start: int, line: int) -> tuple:
+        '''
+        Scans one token the pattern can't handle with `Scanner.scan_token`.
+        No token other than a string spans whitespace, so only the text up to
+        the next whitespace is decoded. Returns the tokens and the new offset.
+        '''
+        buffer = self.buffer
+        self.line = line
+        start = _BLANKS.match(buffer, start).end()
+        if start >= len(buffer):
+            return [], start
+        if buffer[start:start + 1] == b'"':
+            # The pattern only fails on a quote when the string never ends.
+            for _ in _NEWLINES.finditer(buffer, start):
+                self.line += 1
+            self.add_error("Unterminated string")
+            return [], len(buffer)
+
+        whitespace = _WHITESPACE.search(buffer, start)
+        window_end = whitespace.start() if whitespace is not None else len(buffer)
+        window = Scanner(buffer[start:window_end].decode('utf-8'))
+        window.line = line
+        window.scan_token()
+        self.error_frames.extend(window.error_frames)
+        consumed = len(window.source[:window.current].encode('utf-8'))
+        return window.tokens, start + consumed
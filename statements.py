@@ -26,30 +26,16 @@ class StmtVisitor:
         pass
 
 class Stmt:
+    __slots__ = ()
     def accept(self, visitor : StmtVisitor):
-        if isinstance(self, Expression):
-            return visitor.visit_expression_stmt(self)
-        if isinstance(self, Function):
-            return visitor.visit_function_stmt(self)
-        if isinstance(self, If):
-            return visitor.visit_if_stmt(self)
-        if isinstance(self, Block):
-            return visitor.visit_block_stmt(self)
-        if isinstance(self, Class):
-            return visitor.visit_class_stmt(self)
-        if isinstance(self, Var):
-            return visitor.visit_var_stmt(self)
-        if isinstance(self, Return):
-            return visitor.visit_return_stmt(self)
-        if isinstance(self, Print):
-            return visitor.visit_print_stmt(self)
-        if isinstance(self, While):
-            return visitor.visit_while_stmt(self)
         return visitor.default_stmt(self)
 
 class Expression(Stmt):
+    __slots__ = ("expression",)
     def __init__(self , expression : Expr):
         self.expression : Expr = expression
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_expression_stmt(self)
     def __str__(self):
         r = "Expression("
         r += f"expression : Expr = "
@@ -59,10 +45,18 @@ class Expression(Stmt):
         r += ")"
         return r
 class Function(Stmt):
+    __slots__ = ("name", "params", "body", "slot", "global_slot", "scope_size", "memo", "jit",)
     def __init__(self , name : Token, params : List[Token], body : List[Stmt]):
         self.name : Token = name
         self.params : List[Token] = params
         self.body : List[Stmt] = body
+        self.slot : int = None
+        self.global_slot : int = None
+        self.scope_size : int = None
+        self.memo : Any = None
+        self.jit : Any = None
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_function_stmt(self)
     def __str__(self):
         r = "Function("
         r += f"name : Token = "
@@ -80,10 +74,13 @@ class Function(Stmt):
         r += ")"
         return r
 class If(Stmt):
+    __slots__ = ("condition", "then_branch", "else_branch",)
     def __init__(self , condition : Expr, then_branch : Stmt, else_branch : Stmt):
         self.condition : Expr = condition
         self.then_branch : Stmt = then_branch
         self.else_branch : Stmt = else_branch
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_if_stmt(self)
     def __str__(self):
         r = "If("
         r += f"condition : Expr = "
@@ -101,8 +98,12 @@ class If(Stmt):
         r += ")"
         return r
 class Block(Stmt):
+    __slots__ = ("statements", "scope_size",)
     def __init__(self , statements : List[Stmt]):
         self.statements : List[Stmt] = statements
+        self.scope_size : int = None
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_block_stmt(self)
     def __str__(self):
         r = "Block("
         r += f"statements : List[Stmt] = "
@@ -112,9 +113,14 @@ class Block(Stmt):
         r += ")"
         return r
 class Class(Stmt):
+    __slots__ = ("name", "methods", "slot", "global_slot",)
     def __init__(self , name : Token, methods : List[Function]):
         self.name : Token = name
         self.methods : List[Function] = methods
+        self.slot : int = None
+        self.global_slot : int = None
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_class_stmt(self)
     def __str__(self):
         r = "Class("
         r += f"name : Token = "
@@ -128,9 +134,14 @@ class Class(Stmt):
         r += ")"
         return r
 class Var(Stmt):
+    __slots__ = ("name", "initializer", "slot", "global_slot",)
     def __init__(self , name : Token, initializer : Expr):
         self.name : Token = name
         self.initializer : Expr = initializer
+        self.slot : int = None
+        self.global_slot : int = None
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_var_stmt(self)
     def __str__(self):
         r = "Var("
         r += f"name : Token = "
@@ -144,9 +155,12 @@ class Var(Stmt):
         r += ")"
         return r
 class Return(Stmt):
+    __slots__ = ("keyword", "value",)
     def __init__(self , keyword : Token, value : Expr):
         self.keyword : Token = keyword
         self.value : Expr = value
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_return_stmt(self)
     def __str__(self):
         r = "Return("
         r += f"keyword : Token = "
@@ -160,8 +174,11 @@ class Return(Stmt):
         r += ")"
         return r
 class Print(Stmt):
+    __slots__ = ("expression",)
     def __init__(self , expression : Expr):
         self.expression : Expr = expression
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_print_stmt(self)
     def __str__(self):
         r = "Print("
         r += f"expression : Expr = "
@@ -171,9 +188,12 @@ class Print(Stmt):
         r += ")"
         return r
 class While(Stmt):
+    __slots__ = ("condition", "body",)
     def __init__(self , condition : Expr, body : Stmt):
         self.condition : Expr = condition
         self.body : Stmt = body
+    def accept(self, visitor : StmtVisitor):
+        return visitor.visit_while_stmt(self)
     def __str__(self):
         r = "While("
         r += f"condition : Expr = "
@@ -1,5 +1,6 @@
 from enum import Enum, auto
 from typing import Any
+from array import array
 
 
 class AutoName(Enum):
@@ -72,21 +73,24 @@ class ReservedKeyword(AutoName):
     VAR = auto()
     WHILE = auto()
 
+# Map from keyword text to its token type, built once at import time.
+KEYWORDS = {keyword.value: TokenType[keyword.name]
+            for keyword in ReservedKeyword}
+
 # check if a string is a reserved keyword
 
 
 def is_reserved_keyword(string) -> bool:
-    # Get the set of values for the enum ReservedKeyword
-    values = ReservedKeyword.__members__.values()
-    # Check if string is in the value field of the ReservedKeyword enum
-    return string in set(v.value for v in ReservedKeyword.__members__.values())
+    return string in KEYWORDS
 
 
 def get_reserved_keyword_as_token(string) -> TokenType:
-    return TokenType[string.upper()]
+    return KEYWORDS[string]
 
 
 class Token:
+    __slots__ = ("type", "lexeme", "literal", "line")
+
     def __init__(self, type: TokenType, lexeme: str, literal: Any, line: int):
         self.type = type
         self.lexeme = lexeme
@@ -97,3 +101,77 @@ class Token:
         if self.literal is None:
             return f"{self.type} lexeme: `{self.lexeme}`"
         return f"{self.type} lexeme: `{self.lexeme}` literal: {self.literal}"
+
+
+# Token types as small integer codes, for compact token storage.
+TOKEN_TYPES = list(TokenType)
+TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+# Only these token types have a lexeme that varies from token to token.
+_LITERAL_CODES = frozenset(
+    TYPE_CODES[t] for t in (TokenType.IDENTIFIER, TokenType.NUMBER, TokenType.STRING))
+
+
+class TokenStream:
+    '''
+    A compact alternative to a list of `Token`s: parallel arrays of type code,
+    start offset, length and line into the source. Indexing materializes a
+    `Token` on demand. Punctuation and keyword tokens are flyweights shared by
+    every occurrence on the same line; identifiers and literals are built only
+    when the parser looks at them.
+    '''
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.types = array('B')
+        self.starts = array('I')
+        self.lengths = array('I')
+        self.lines = array('I')
+        self._flyweights = {}
+        self._cached_index = -1
+        self._cached_token = None
+
+    def append(self, token_type: TokenType, start: int, length: int, line: int) -> None:
+        self.types.append(TYPE_CODES[token_type])
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.lines.append(line)
+
+    def token_types(self) -> list:
+        return [TOKEN_TYPES[code] for code in self.types]
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+
+    def __getitem__(self, index: int) -> Token:
+        code = self.types[index]
+        line = self.lines[index]
+        if code not in _LITERAL_CODES:
+            key = (line << 8) | code
+            token = self._flyweights.get(key)
+            if token is None:
+                start = self.starts[index]
+                token = Token(TOKEN_TYPES[code], self.source[start:start + self.lengths[index]],
+                              None, line)
+                self._flyweights[key] = token
+            return token
+
+        # The parser peeks at the same token several times before consuming it.
+        if index == self._cached_index:
+            return self._cached_token
+        start = self.starts[index]
+        lexeme = self.source[start:start + self.lengths[index]]
+        token_type = TOKEN_TYPES[code]
+        if token_type == TokenType.NUMBER:
+            literal = float(lexeme)
+        elif token_type == TokenType.STRING:
+            literal = lexeme[1:-1]
+        else:
+            literal = lexeme
+        token = Token(token_type, lexeme, literal, line)
+        self._cached_index = index
+        self._cached_token = token
+        return token
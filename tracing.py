@@ -0,0 +1,120 @@
+import collections
+import contextlib
+import json
+import os
+import time
+from typing import List, Dict, Any
+
+# Events the ring buffer holds by default; older ones are overwritten.
+CAPACITY = 1 << 20
+
+# Categories of the events, as the trace viewer shows them.
+PHASE = "phase"
+FUNCTION = "function"
+
+
+class Tracer:
+    '''
+    Records begin and end events, such as the phases of a run and calls of
+    Lox functions, and writes them as a Chrome Trace Event file that
+    chrome://tracing and Perfetto open. Events go into preallocated columns
+    used as a ring buffer, so a long run keeps its last `capacity` events
+    instead of growing without bound. The few spans recorded with `span`
+    are kept apart and never overwritten, so even a trace of a long run
+    shows its phases.
+    '''
+
+    def __init__(self, capacity: int = CAPACITY) -> None:
+        self.capacity = capacity
+        self.names: List[str] = [None] * capacity
+        self.categories: List[str] = [None] * capacity
+        self.begins: List[bool] = [False] * capacity
+        self.times: List[int] = [0] * capacity
+        # Where the next event goes, and how many were recorded in total.
+        self.next = 0
+        self.recorded = 0
+        # Events of `span`, as (begin, name, category, time), in order.
+        self.spans = []
+        self.start = time.perf_counter_ns()
+
+    def begin(self, name: str, category: str) -> None:
+        i = self.next
+        self.names[i] = name
+        self.categories[i] = category
+        self.begins[i] = True
+        self.times[i] = time.perf_counter_ns()
+        self.next = 0 if i + 1 == self.capacity else i + 1
+        self.recorded += 1
+
+    def end(self, name: str, category: str) -> None:
+        i = self.next
+        self.times[i] = time.perf_counter_ns()
+        self.names[i] = name
+        self.categories[i] = category
+        self.begins[i] = False
+        self.next = 0 if i + 1 == self.capacity else i + 1
+        self.recorded += 1
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = PHASE):
+        self.spans.append((True, name, category, time.perf_counter_ns()))
+        try:
+            yield
+        finally:
+            self.spans.append((False, name, category, time.perf_counter_ns()))
+
+    def events(self) -> List[Dict[str, Any]]:
+        '''
+        The spans and the buffered events, oldest first, in Trace Event form.
+        Ends whose begin was overwritten are dropped, and calls that a
+        runtime error left without an end are ended where their caller was,
+        so that every begin has its end.
+        '''
+        count = min(self.recorded, self.capacity)
+        first = (self.next - count) % self.capacity
+        pid = os.getpid()
+        result = []
+        open_events = []
+        open_counts = collections.Counter()
+
+        def add(phase, name, category, ts):
+            result.append({"name": name, "cat": category, "ph": phase,
+                           "ts": (ts - self.start) / 1000, "pid": pid, "tid": 0})
+
+        ts = self.start
+        for n in range(count):
+            i = (first + n) % self.capacity
+            name, category, ts = self.names[i], self.categories[i], self.times[i]
+            key = (name, category)
+            if self.begins[i]:
+                open_events.append(key)
+                open_counts[key] += 1
+                add("B", name, category, ts)
+            elif open_counts[key]:
+                while True:
+                    unended = open_events.pop()
+                    open_counts[unended] -= 1
+                    add("E", *unended, ts)
+                    if unended == key:
+                        break
+        while open_events:
+            add("E", *open_events.pop(), ts)
+
+        # Spans enclose the buffered events: at the same time, a span begins
+        # before them and ends after them.
+        for begin, name, category, ts in self.spans:
+            add("B" if begin else "E", name, category, ts)
+        # The sort is stable, so buffered events keep their order.
+        result.sort(key=lambda event: (
+            event["ts"], 1 if event["cat"] != PHASE else 0 if event["ph"] == "B" else 2))
+        return result
+
+    def write(self, path: str) -> None:
+        trace = {
+            "traceEvents": self.events(),
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_events": max(self.recorded - self.capacity, 0)},
+        }
+        with open(path, "w") as f:
+            # Much faster than `json.dump`, which writes in small pieces.
+            f.write(json.dumps(trace))
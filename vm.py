@@ -0,0 +1,518 @@
+from typing import List, Any
+from runtime_error import RuntimeError
+from tokens import Token, TokenType
+from environment import GlobalEnvironment
+from compiler import Compiler
+from bytecode import OpCode, FunctionProto, disassemble
+from interpreter import Interpreter, ErrorFrame, Callable, Clock, LoxInstance, LoxClass, BoundMethod, InlineCache
+import statements
+from purity import MISSING, memo_key
+
+FRAMES_MAX = 10000
+
+
+class Upvalue:
+    '''
+    A captured variable. While open it refers to a live stack slot; once the
+    slot goes out of scope the value is moved into the upvalue itself.
+    '''
+    __slots__ = ("index", "value", "closed")
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.value = None
+        self.closed = False
+
+
+class LoxClosure(Callable):
+    def __init__(self, proto: FunctionProto, upvalues: List[Upvalue]) -> None:
+        self.proto = proto
+        self.upvalues = upvalues
+
+    def arity(self):
+        return self.proto.arity
+
+    def call(self, interpreter, args):
+        return interpreter.call_closure(self, args)
+
+    def __str__(self) -> str:
+        return str(self.proto)
+
+
+class MemoizedClosure(LoxClosure):
+    '''
+    A closure over a pure function. Calls to it take the `VM._prepare_call`
+    path, which answers them from the function's memo when it can.
+    '''
+
+
+class VM:
+    '''
+    A stack based virtual machine that runs the bytecode produced by
+    `compiler.Compiler`. It has the same `interpret`/`error_frames` surface as
+    `interpreter.Interpreter` so `Runner` can use either one.
+    '''
+
+    stringify = Interpreter.stringify
+
+    def __init__(self, verbose: bool = False) -> None:
+        self.globals = {"clock": Clock()}
+        # The VM looks globals up by name; this table only mirrors the slots
+        # the resolver would assign in `Interpreter`, so resolved trees are
+        # interchangeable between engines.
+        self.global_table = GlobalEnvironment()
+        for name in self.globals:
+            self.global_table.intern(name)
+        self.error_frames = []
+        self.verbose = verbose
+        self.stack: List[Any] = []
+        self.open_upvalues = {}
+        # Memo entries waiting for the result of the frame at each base.
+        self.memo_waiting = {}
+
+    resolve = Interpreter.resolve
+
+    def interpret(self, statements: List[statements.Stmt], resolved: bool = False) -> None:
+        if not resolved:
+            self.resolve(statements)
+            if self.error_frames:
+                return
+        self.error_frames = []
+        script = Compiler().compile(statements)
+        if self.verbose:
+            print("Bytecode:")
+            print("\n".join(disassemble(script)))
+        self.stack = [None]
+        self.open_upvalues = {}
+        self.memo_waiting = {}
+        try:
+            self.run(LoxClosure(script, []), 0)
+        except RuntimeError as error:
+            self.error_frames.append(ErrorFrame(
+                error.token.line, error.message))
+
+    def call_closure(self, closure: LoxClosure, args: List[Any]) -> Any:
+        base = len(self.stack)
+        self.stack.append(closure)
+        self.stack.extend(args)
+        return self.run(closure, base)
+
+    def run(self, closure: LoxClosure, base: int) -> Any:
+        # Frequently used names are bound to locals; the dispatch chain below is
+        # ordered roughly by how often each instruction executes.
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        globals = self.globals
+        waiting = self.memo_waiting
+        frames = []
+        code = closure.proto.chunk.code
+        constants = closure.proto.chunk.constants
+        upvalues = closure.upvalues
+        ip = 0
+
+        CONSTANT = OpCode.CONSTANT.value
+        NIL = OpCode.NIL.value
+        TRUE = OpCode.TRUE.value
+        FALSE = OpCode.FALSE.value
+        POP = OpCode.POP.value
+        GET_LOCAL = OpCode.GET_LOCAL.value
+        SET_LOCAL = OpCode.SET_LOCAL.value
+        GET_GLOBAL = OpCode.GET_GLOBAL.value
+        DEFINE_GLOBAL = OpCode.DEFINE_GLOBAL.value
+        SET_GLOBAL = OpCode.SET_GLOBAL.value
+        GET_UPVALUE = OpCode.GET_UPVALUE.value
+        SET_UPVALUE = OpCode.SET_UPVALUE.value
+        GET_PROPERTY = OpCode.GET_PROPERTY.value
+        SET_PROPERTY = OpCode.SET_PROPERTY.value
+        EQUAL = OpCode.EQUAL.value
+        NOT_EQUAL = OpCode.NOT_EQUAL.value
+        GREATER = OpCode.GREATER.value
+        GREATER_EQUAL = OpCode.GREATER_EQUAL.value
+        LESS = OpCode.LESS.value
+        LESS_EQUAL = OpCode.LESS_EQUAL.value
+        ADD = OpCode.ADD.value
+        SUBTRACT = OpCode.SUBTRACT.value
+        MULTIPLY = OpCode.MULTIPLY.value
+        DIVIDE = OpCode.DIVIDE.value
+        NOT = OpCode.NOT.value
+        NEGATE = OpCode.NEGATE.value
+        PRINT = OpCode.PRINT.value
+        JUMP = OpCode.JUMP.value
+        JUMP_IF_FALSE = OpCode.JUMP_IF_FALSE.value
+        JUMP_IF_TRUE = OpCode.JUMP_IF_TRUE.value
+        LOOP = OpCode.LOOP.value
+        CALL = OpCode.CALL.value
+        TAIL_CALL = OpCode.TAIL_CALL.value
+        INVOKE = OpCode.INVOKE.value
+        CLOSURE = OpCode.CLOSURE.value
+        CLOSE_UPVALUE = OpCode.CLOSE_UPVALUE.value
+        RETURN = OpCode.RETURN.value
+        CLASS = OpCode.CLASS.value
+        METHOD = OpCode.METHOD.value
+
+        try:
+            while True:
+                op = code[ip]
+                ip += 1
+                if op == GET_LOCAL:
+                    push(stack[base + code[ip]])
+                    ip += 1
+                elif op == CONSTANT:
+                    push(constants[code[ip]])
+                    ip += 1
+                elif op == GET_GLOBAL:
+                    name = constants[code[ip]]
+                    ip += 1
+                    if name not in globals:
+                        raise RuntimeError(None, f"Undefined variable: {name}.")
+                    push(globals[name])
+                elif op == POP:
+                    pop()
+                elif op == JUMP_IF_FALSE:
+                    value = stack[-1]
+                    if value is None or value is False:
+                        ip = code[ip]
+                    else:
+                        ip += 1
+                elif op == ADD:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is float and type(right) is float:
+                        stack[-1] = left + right
+                    elif type(left) is str and type(right) is str:
+                        stack[-1] = left + right
+                    else:
+                        raise RuntimeError(
+                            None, "Operands must be two numbers or two strings.")
+                elif op == SUBTRACT:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left - right
+                elif op == LESS:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left < right
+                elif op == LESS_EQUAL:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left <= right
+                elif op == GREATER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left > right
+                elif op == GREATER_EQUAL:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left >= right
+                elif op == CALL:
+                    argc = code[ip]
+                    ip += 1
+                    callee = stack[-1 - argc]
+                    if type(callee) is not LoxClosure:
+                        callee = self._prepare_call(callee, argc)
+                    if callee is not None:
+                        if argc != callee.proto.arity:
+                            raise RuntimeError(
+                                None, f"Expected {callee.proto.arity} arguments but got {argc}.")
+                        if len(frames) >= FRAMES_MAX:
+                            raise RuntimeError(None, "Stack overflow.")
+                        frames.append((closure, ip, base))
+                        closure = callee
+                        code = closure.proto.chunk.code
+                        constants = closure.proto.chunk.constants
+                        upvalues = closure.upvalues
+                        base = len(stack) - 1 - argc
+                        ip = 0
+                elif op == INVOKE:
+                    cache = constants[code[ip]]
+                    argc = code[ip + 1]
+                    ip += 2
+                    receiver = stack[-1 - argc]
+                    if not isinstance(receiver, LoxInstance):
+                        raise RuntimeError(
+                            None, "Only instances have properties.")
+                    if receiver.shape is not cache.shape and not cache.miss(receiver):
+                        raise RuntimeError(
+                            None, f"Undefined property '{cache.name}'.")
+                    callee = cache.method
+                    if cache.slot >= 0:
+                        # A field: call its value as CALL would.
+                        callee = receiver.values[cache.slot]
+                        stack[-1 - argc] = callee
+                        if type(callee) is not LoxClosure:
+                            callee = self._prepare_call(callee, argc)
+                    if callee is not None:
+                        if argc != callee.proto.arity:
+                            raise RuntimeError(
+                                None, f"Expected {callee.proto.arity} arguments but got {argc}.")
+                        if len(frames) >= FRAMES_MAX:
+                            raise RuntimeError(None, "Stack overflow.")
+                        frames.append((closure, ip, base))
+                        closure = callee
+                        code = closure.proto.chunk.code
+                        constants = closure.proto.chunk.constants
+                        upvalues = closure.upvalues
+                        base = len(stack) - 1 - argc
+                        ip = 0
+                elif op == TAIL_CALL:
+                    argc = code[ip]
+                    ip += 1
+                    callee = stack[-1 - argc]
+                    if type(callee) is not LoxClosure:
+                        callee = self._prepare_call(callee, argc, base)
+                    if callee is not None:
+                        if argc != callee.proto.arity:
+                            raise RuntimeError(
+                                None, f"Expected {callee.proto.arity} arguments but got {argc}.")
+                        if self.open_upvalues:
+                            self._close_upvalues(base)
+                        # Slide the callee and its arguments down over the
+                        # current frame and run it in place.
+                        stack[base:] = stack[len(stack) - 1 - argc:]
+                        closure = callee
+                        code = closure.proto.chunk.code
+                        constants = closure.proto.chunk.constants
+                        upvalues = closure.upvalues
+                        ip = 0
+                    else:
+                        # The call already finished; return its result like
+                        # RETURN would.
+                        result = pop()
+                        if waiting and base in waiting:
+                            self._fill_memos(base, result)
+                        if self.open_upvalues:
+                            self._close_upvalues(base)
+                        del stack[base:]
+                        if not frames:
+                            return result
+                        push(result)
+                        closure, ip, base = frames.pop()
+                        code = closure.proto.chunk.code
+                        constants = closure.proto.chunk.constants
+                        upvalues = closure.upvalues
+                elif op == RETURN:
+                    result = pop()
+                    if waiting and base in waiting:
+                        self._fill_memos(base, result)
+                    if self.open_upvalues:
+                        self._close_upvalues(base)
+                    del stack[base:]
+                    if not frames:
+                        return result
+                    push(result)
+                    closure, ip, base = frames.pop()
+                    code = closure.proto.chunk.code
+                    constants = closure.proto.chunk.constants
+                    upvalues = closure.upvalues
+                elif op == SET_LOCAL:
+                    stack[base + code[ip]] = stack[-1]
+                    ip += 1
+                elif op == GET_UPVALUE:
+                    upvalue = upvalues[code[ip]]
+                    ip += 1
+                    push(upvalue.value if upvalue.closed else stack[upvalue.index])
+                elif op == SET_UPVALUE:
+                    upvalue = upvalues[code[ip]]
+                    ip += 1
+                    if upvalue.closed:
+                        upvalue.value = stack[-1]
+                    else:
+                        stack[upvalue.index] = stack[-1]
+                elif op == JUMP:
+                    ip = code[ip]
+                elif op == LOOP:
+                    ip = code[ip]
+                elif op == JUMP_IF_TRUE:
+                    value = stack[-1]
+                    if value is None or value is False:
+                        ip += 1
+                    else:
+                        ip = code[ip]
+                elif op == MULTIPLY:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left * right
+                elif op == DIVIDE:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is not float or type(right) is not float:
+                        raise self._number_operands_error(left, right)
+                    stack[-1] = left / right
+                elif op == EQUAL:
+                    right = pop()
+                    stack[-1] = stack[-1] == right
+                elif op == NOT_EQUAL:
+                    right = pop()
+                    stack[-1] = stack[-1] != right
+                elif op == NOT:
+                    value = stack[-1]
+                    stack[-1] = value is None or value is False
+                elif op == NEGATE:
+                    stack[-1] = -stack[-1]
+                elif op == NIL:
+                    push(None)
+                elif op == TRUE:
+                    push(True)
+                elif op == FALSE:
+                    push(False)
+                elif op == SET_GLOBAL:
+                    name = constants[code[ip]]
+                    ip += 1
+                    if name not in globals:
+                        raise RuntimeError(
+                            None, f"Undefined variable assignment: {name}.")
+                    globals[name] = stack[-1]
+                elif op == DEFINE_GLOBAL:
+                    globals[constants[code[ip]]] = pop()
+                    ip += 1
+                elif op == GET_PROPERTY:
+                    cache = constants[code[ip]]
+                    ip += 1
+                    instance = stack[-1]
+                    if not isinstance(instance, LoxInstance):
+                        raise RuntimeError(
+                            None, "Only instances have properties.")
+                    if instance.shape is cache.shape and cache.slot >= 0:
+                        stack[-1] = instance.values[cache.slot]
+                    else:
+                        stack[-1] = self._get_property(instance, cache)
+                elif op == SET_PROPERTY:
+                    cache = constants[code[ip]]
+                    ip += 1
+                    value = pop()
+                    instance = stack[-1]
+                    if not isinstance(instance, LoxInstance):
+                        raise RuntimeError(
+                            None, f"Only instances have fields. Got {instance.__class__.__name__}.")
+                    if instance.shape is cache.shape and cache.next_shape is cache.shape:
+                        instance.values[cache.slot] = value
+                    else:
+                        cache.store(instance, value)
+                    # Like `Interpreter.visit_set_expr`, a set evaluates to nil.
+                    stack[-1] = None
+                elif op == PRINT:
+                    print(self.stringify(pop()))
+                elif op == CLOSURE:
+                    proto = constants[code[ip]]
+                    ip += 1
+                    captured = []
+                    for _ in range(proto.upvalue_count):
+                        is_local = code[ip]
+                        index = code[ip + 1]
+                        ip += 2
+                        if is_local:
+                            captured.append(self._capture_upvalue(base + index))
+                        else:
+                            captured.append(upvalues[index])
+                    if proto.memo is None:
+                        push(LoxClosure(proto, captured))
+                    else:
+                        push(MemoizedClosure(proto, captured))
+                elif op == CLOSE_UPVALUE:
+                    self._close_upvalues(len(stack) - 1)
+                    pop()
+                elif op == CLASS:
+                    push(LoxClass(constants[code[ip]]))
+                    ip += 1
+                elif op == METHOD:
+                    method = pop()
+                    stack[-1].methods[constants[code[ip]]] = method
+                    ip += 1
+                else:
+                    raise RuntimeError(None, f"Unknown opcode {op}.")
+        except RuntimeError as error:
+            if error.token is None:
+                # Attribute the error to the line of the failing instruction.
+                error.token = Token(
+                    TokenType.EOF, "", None, closure.proto.chunk.lines[ip - 1])
+            raise
+
+    # Helpers
+    def _prepare_call(self, callee: Any, argc: int, frame_base: int = None) -> LoxClosure:
+        '''
+        Handles a call to anything but a plain closure, whose callee slot is
+        `argc` below the top of the stack. Returns the closure to run with the
+        callee slot set up, or None once the call has finished and its result
+        has replaced the callee and arguments. `frame_base` is where the
+        closure's frame will start, if not at the callee slot.
+        '''
+        stack = self.stack
+        if type(callee) is MemoizedClosure:
+            memo = callee.proto.memo
+            if argc != callee.proto.arity:
+                # Left for the caller to report.
+                return callee
+            key = memo_key(stack[len(stack) - argc:])
+            value = memo.lookup(key)
+            if value is MISSING:
+                if frame_base is None:
+                    frame_base = len(stack) - 1 - argc
+                self.memo_waiting.setdefault(frame_base, []).append((memo, key))
+                return callee
+            del stack[len(stack) - 1 - argc:]
+            stack.append(value)
+            return None
+        if type(callee) is BoundMethod:
+            stack[-1 - argc] = callee.receiver
+            return callee.method
+        if type(callee) is LoxClass:
+            # The new instance is `this` for the initializer, which returns it.
+            stack[-1 - argc] = LoxInstance(callee)
+            initializer = callee.methods.get("init")
+            if initializer is not None:
+                return initializer
+            if argc != 0:
+                raise RuntimeError(
+                    None, f"Expected 0 arguments but got {argc}.")
+            return None
+        if not isinstance(callee, Callable):
+            raise RuntimeError(None, "Can only call functions and classes.")
+        if argc != callee.arity():
+            raise RuntimeError(
+                None, f"Expected {callee.arity()} arguments but got {argc}.")
+        args = stack[len(stack) - argc:]
+        del stack[len(stack) - 1 - argc:]
+        stack.append(callee.call(self, args))
+        return None
+
+    def _fill_memos(self, base: int, result: Any) -> None:
+        # Store the outermost call last, so it is evicted last.
+        for memo, key in reversed(self.memo_waiting.pop(base)):
+            memo.store(key, result)
+
+    def _get_property(self, instance: LoxInstance, cache: InlineCache) -> Any:
+        if instance.shape is not cache.shape and not cache.miss(instance):
+            raise RuntimeError(None, f"Undefined property '{cache.name}'.")
+        if cache.slot >= 0:
+            return instance.values[cache.slot]
+        return BoundMethod(instance, cache.method)
+
+    def _capture_upvalue(self, index: int) -> Upvalue:
+        upvalue = self.open_upvalues.get(index)
+        if upvalue is None:
+            upvalue = Upvalue(index)
+            self.open_upvalues[index] = upvalue
+        return upvalue
+
+    def _close_upvalues(self, last: int) -> None:
+        for index in [index for index in self.open_upvalues if index >= last]:
+            upvalue = self.open_upvalues.pop(index)
+            upvalue.value = self.stack[index]
+            upvalue.closed = True
+
+    def _number_operands_error(self, left: Any, right: Any) -> RuntimeError:
+        return RuntimeError(
+            None, f"Operands must be numbers. Got {type(left)} and {type(right)} instead.")